@@ -6,11 +6,27 @@ History:
     v2 - recreated centered around symbol classes; XXX symbols of the same type differ based on how we got them
     v3 - recreated centered around printers (perpectives?)
 """
-from comtypes.client import GetModule, CreateObject
-import comtypes
+try:
+    from comtypes.client import GetModule, CreateObject
+    from comtypes import COMError
+    import comtypes
+except ImportError: # no COM here; only stand-in backends (captures) can be used
+    comtypes = None
+    class COMError(Exception):
+        """Stand-in for comtypes.COMError."""
+        def __init__(self, hresult, text, details):
+            Exception.__init__(self, hresult, text, details)
+            self.hresult = hresult
+            self.text = text
+            self.details = details
 import time
 import string
 import sys
+import os
+import inspect
+import json
+import re
+import timeit
 
 """
 TODO vc6 produces unsigned char for bool symbols (check undecorated name when available)
@@ -180,6 +196,142 @@ def DEBUG(context,*args):
     print ' '.join(["[%s]" % str(context)] + [str(arg) for arg in args]) + '\r\n',
 
 
+# attributes of each symTag
+SYMTAG_ATTRIBUTES = {
+    SYMTAG.SymTagNull: ("access","addressOffset","addressSection","addressTaken","age",
+                        "arrayIndexType","arrayIndexTypeId","backEndBuild","backEndMajor","backEndMinor",
+                        "backEndQFE","baseType","bitPosition","callingConvention","classParent",
+                        "classParentId","code","compilerGenerated","compilerName","constType",
+                        "constructor","container","count","countLiveRanges","customCallingConvention",
+                        "dataKind","editAndContinueEnabled","farReturn","framePointerPresent","frontEndBuild",
+                        "frontEndMajor","frontEndMinor","frontEndQFE","function","guid",
+                        "hasAlloca","hasAssignmentOperator","hasCastOperator","hasDebugInfo","hasEH",
+                        "hasEHa","hasInlAsm","hasLongJump","hasManagedCode","hasNestedTypes",
+                        "hasSEH","hasSecurityChecks","hasSetJump","hfaDouble","hfaFloat",
+                        "indirectVirtualBaseClass","inlSpec","interruptReturn","intrinsic","intro",
+                        "isAggregated","isCTypes","isCVTCIL","isConstructorVirtualBase","isCxxReturnUdt",
+                        "isDataAligned","isHotpatchable","isLTCG","isMSILNetmodule","isNaked",
+                        "isSafeBuffers","isSplitted","isStatic","isStripped","language",
+                        "length","lexicalParent","lexicalParentId","libraryName","liveRangeLength",
+                        "liveRangeStartAddressOffset","liveRangeStartAddressSection","liveRangeStartRelativeVirtualAddress","localBasePointerRegisterId","locationType",
+                        "lowerBound","lowerBoundId","machineType","managed","msil",
+                        "name","nested","noInline","noReturn","noStackOrdering",
+                        "notReached","objectPointerType","oemId","oemSymbolId","offset",
+                        "offsetInUdt","optimizedCodeDebugInfo","overloadedOperator","packed","paramBasePointerRegisterId",
+                        "platform","pure","rank","reference","registerId",
+                        "relativeVirtualAddress","scoped","sealed","signature","slot",
+                        "sourceFileName","strictGSCheck","symIndexId","symTag","symbolsFileName",
+                        "targetOffset","targetRelativeVirtualAddress","targetSection","targetVirtualAddress","thisAdjust",
+                        "thunkOrdinal","timeStamp","token","type","typeId",
+                        "udtKind","unalignedType","undecoratedName","unmodifiedType","unused",
+                        "upperBound","upperBoundId","value","virtual","virtualAddress",
+                        "virtualBaseClass","virtualBaseDispIndex","virtualBaseOffset","virtualBasePointerOffset","virtualBaseTableType",
+                        "virtualTableShape","virtualTableShapeId","volatileType","wasInlined"),
+    SYMTAG.SymTagFunction: ("access","addressOffset","addressSection","classParent","classParentId",
+                            "constType","customCallingConvention","farReturn","hasAlloca","hasEH",
+                            "hasEHa","hasInlAsm","hasLongJump","hasSecurityChecks","hasSEH",
+                            "hasSetJump","interruptReturn","intro","inlSpec","isNaked",
+                            "isStatic","length","lexicalParent","lexicalParentId","locationType",
+                            "name","noInline","notReached","noReturn","noStackOrdering",
+                            "optimizedCodeDebugInfo","pure","relativeVirtualAddress","symIndexId","symTag",
+                            "token","type","typeId","unalignedType","undecoratedName",
+                            "virtual","virtualAddress","virtualBaseOffset","volatileType"),
+    SYMTAG.SymTagFunctionType: ("callingConvention","classParent","classParentId","constType","count",
+                                "lexicalParent","lexicalParentId","objectPointerType","symIndexId","symTag",
+                                "thisAdjust","type","typeId","unalignedType","volatileType"),
+    SYMTAG.SymTagFuncDebugStart: ("addressOffset","addressSection","customCallingConvention","farReturn","farReturn",
+                                  "isStatic","lexicalParent","lexicalParentId","locationType","noInline",
+                                  "noReturn","notReached","offset","optimizedCodeDebugInfo","relativeVirtualAddress",
+                                  "symIndexId","symTag","virtualAddress"),
+    SYMTAG.SymTagFuncDebugEnd: ("addressOffset","addressSection","customCallingConvention","farReturn","interruptReturn",
+                                "isStatic","lexicalParent","lexicalParentId","locationType","noInline",
+                                "noReturn","notReached","offset","optimizedCodeDebugInfo","symIndexId",
+                                "relativeVirtualAddress","symTag","virtualAddress"),
+    SYMTAG.SymTagData: ("access","addressOffset","addressSection","addressTaken","bitPosition",
+                        "classParent","classParentId","compilerGenerated","constType","dataKind",
+                        "isAggregated","isSplitted","length","lexicalParent","lexicalParentId",
+                        "locationType","name","offset","registerId","relativeVirtualAddress",
+                        "slot","symIndexId","symTag","token","type",
+                        "typeId","unalignedType","value","virtualAddress","volatileType"),
+    SYMTAG.SymTagBaseType: ("baseType","constType","length","lexicalParent","lexicalParentId",
+                            "symIndexId","symTag","unalignedType","volatileType"),
+    SYMTAG.SymTagFunctionArgType: ("classParent","classParentId","lexicalParent","lexicalParentId","symIndexId",
+                                   "symTag","type","typeId"),
+    SYMTAG.SymTagUDT: ("classParent","classParentId","constructor","constType","hasAssignmentOperator",
+                       "hasCastOperator","hasNestedTypes","length","lexicalParent","lexicalParentId",
+                       "name","nested","overloadedOperator","packed","scoped",
+                       "symIndexId","symTag","udtKind","unalignedType","virtualTableShape",
+                       "virtualTableShapeId","volatileType"),
+    SYMTAG.SymTagVTable: ("classParent","classParentId","constType","lexicalParent","lexicalParentId",
+                          "symIndexId","symTag","type","typeId","unalignedType",
+                          "volatileType"),
+    SYMTAG.SymTagPointerType: ("constType","length","lexicalParent","lexicalParentId","reference",
+                               "symIndexId","symTag","type","typeId","unalignedType",
+                               "volatileType"),
+    SYMTAG.SymTagVTableShape: ("constType","count","lexicalParent","lexicalParentId","symIndexId",
+                               "symTag","unalignedType","volatileType"),
+    SYMTAG.SymTagTypedef: ("baseType","classParent","classParentId","constructor","constType",
+                           "hasAssignmentOperator","hasCastOperator","hasNestedTypes","length","lexicalParent",
+                           "lexicalParentId","name","nested","overloadedOperator","packed",
+                           "reference","scoped","symIndexId","symTag","type",
+                           "typeId","udtKind","unalignedType","virtualTableShape","virtualTableShapeId",
+                           "volatileType"),
+    SYMTAG.SymTagBaseClass: ("access","classParent","classParentId","constructor","constType",
+                             "hasAssignmentOperator","hasCastOperator","hasNestedTypes","indirectVirtualBaseClass","length",
+                             "lexicalParent","lexicalParentId","name","nested","offset",
+                             "overloadedOperator","packed","scoped","symIndexId","symTag",
+                             "type","typeId","udtKind","unalignedType","virtualBaseClass",
+                             "virtualBaseDispIndex","virtualBasePointerOffset","virtualBaseTableType","virtualTableShape","virtualTableShapeId",
+                             "volatileType"),
+    SYMTAG.SymTagArrayType: ("arrayIndexType","arrayIndexTypeId","constType","count","length",
+                             "lexicalParent","lexicalParentId","rank","symIndexId","symTag",
+                             "type","typeId","unalignedType","volatileType"),
+    SYMTAG.SymTagEnum: ("baseType","classParent","classParentId","constructor","constType",
+                        "hasAssignmentOperator","hasCastOperator","hasNestedTypes","length","lexicalParent",
+                        "lexicalParentId","name","nested","overloadedOperator","packed",
+                        "scoped","symIndexId","symTag","type","typeId",
+                        "unalignedType","volatileType"),
+    SYMTAG.SymTagCompiland: ("backEndBuild","backEndMajor","backEndMinor","compilerName","editAndContinueEnabled",
+                             "frontEndBuild","frontEndMajor","frontEndMinor","hasDebugInfo","hasManagedCode",
+                             "hasSecurityChecks","isCVTCIL","isDataAligned","isHotpatchable","isLTCG",
+                             "isMSILNetmodule","language","lexicalParent","lexicalParentId","platform",
+                             "symIndexId","symTag"),
+    SYMTAG.SymTagExe: ("age","guid","isCTypes","isStripped","machineType",
+                       "name","signature","symbolsFileName","symIndexId",
+                       "symTag"),
+}
+SYMTAG_ATTRIBUTES[SYMTAG.SymTagCallSite] = SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull] # TODO no information
+
+ATTRKIND = enum("AttrScalar","AttrSymbol","AttrString","AttrGuid")
+def ATTRKIND_name(value):
+    for name in ATTRKIND.__dict__.keys():
+        if name.startswith("Attr") and getattr(ATTRKIND, name) == value:
+            return name
+    return "ATTRKIND_name({})".format(value)
+
+# kind of the attribute values, the other attributes are scalars
+ATTRIBUTE_KINDS = dict(
+    [(attr, ATTRKIND.AttrSymbol) for attr in ("arrayIndexType","classParent","container","lexicalParent","lowerBound",
+                                              "objectPointerType","type","unmodifiedType","upperBound","virtualBaseTableType",
+                                              "virtualTableShape")] +
+    [(attr, ATTRKIND.AttrString) for attr in ("compilerName","libraryName","name","sourceFileName","symbolsFileName",
+                                              "undecoratedName")] +
+    [(attr, ATTRKIND.AttrGuid) for attr in ("guid",)])
+
+def attributeKind(attr):
+    """Return the ATTRKIND of an attribute"""
+    return ATTRIBUTE_KINDS.get(attr, ATTRKIND.AttrScalar)
+
+def attributesOfKind(kind, attributes=None):
+    """Return a tupple with the attributes of the specified kind (default all the known attributes)"""
+    if attributes is None:
+        attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull]
+    return tuple([attr for attr in attributes if attributeKind(attr) == kind])
+
+# symbol attributes of each symTag
+SYMTAG_SYMBOL_ATTRIBUTES = dict([(symTag, attributesOfKind(ATTRKIND.AttrSymbol, attributes)) for symTag, attributes in SYMTAG_ATTRIBUTES.iteritems()])
+
+
 class DiaEnumSymbolsIterator:
     """Iterates over the symbols in a IDiaEnumSymbols."""
 
@@ -198,19 +350,154 @@ class DiaEnumSymbolsIterator:
         return 0
 
 
+class SymbolStats:
+    """I count and time the symbol traffic of an instrumented PyDia.
+    Each operation is attributed to the nearest printer/symbol/PyDia method in the call stack."""
+    HISTOGRAM_BUCKETS = 32 # bucket i has latencies in [2**(i-1), 2**i) microseconds
+
+    def __init__(self):
+        self.counters = {} # (caller, kind, name) -> [count, seconds, histogram]
+        self.callers = {} # code -> caller name or None
+
+    def callerName(self, frame):
+        """Return "Class.method" of the nearest interesting frame"""
+        callers = self.callers
+        while frame is not None:
+            code = frame.f_code
+            try:
+                caller = callers[code]
+            except KeyError:
+                caller = callers[code] = self._classify(frame)
+            if caller is not None:
+                return caller
+            frame = frame.f_back
+        return "<other>"
+
+    def _classify(self, frame):
+        self_ = frame.f_locals.get("self")
+        if not isinstance(self_, (SymbolPrinter, DiaSymbol, PyDia)):
+            return None
+        name = frame.f_code.co_name
+        for cls in inspect.getmro(self_.__class__):
+            function = cls.__dict__.get(name)
+            if getattr(function, "func_code", None) is frame.f_code:
+                return "{}.{}".format(cls.__name__, name)
+        return "{}.{}".format(self_.__class__.__name__, name)
+
+    def add(self, kind, name, seconds):
+        caller = self.callerName(sys._getframe(2))
+        key = (caller, kind, name)
+        try:
+            counter = self.counters[key]
+        except KeyError:
+            counter = self.counters[key] = [0, 0.0, [0] * self.HISTOGRAM_BUCKETS]
+        counter[0] += 1
+        counter[1] += seconds
+        counter[2][min(int(seconds * 1e6).bit_length(), self.HISTOGRAM_BUCKETS - 1)] += 1
+
+    def stats(self):
+        """Return a dict with the totals and the counters by kind, name and caller"""
+        totals = {}
+        byName = {}
+        byCaller = {}
+        for (caller, kind, name), (count, seconds, histogram) in self.counters.iteritems():
+            total = totals.setdefault(kind, {"count": 0, "seconds": 0.0})
+            total["count"] += count
+            total["seconds"] += seconds
+            entry = byName.setdefault(kind, {}).setdefault(name, {"count": 0, "seconds": 0.0, "histogram": [0] * self.HISTOGRAM_BUCKETS})
+            entry["count"] += count
+            entry["seconds"] += seconds
+            entry["histogram"] = [a + b for a, b in zip(entry["histogram"], histogram)]
+            entry = byCaller.setdefault(caller, {"count": 0, "seconds": 0.0, "names": {}})
+            entry["count"] += count
+            entry["seconds"] += seconds
+            entry["names"]["{}.{}".format(kind, name)] = count
+        return {"totals": totals, "byName": byName, "byCaller": byCaller,
+                "histogramBuckets": ["<1us"] + ["<{}us".format(1 << i) for i in xrange(1, self.HISTOGRAM_BUCKETS)]}
+
+
+class InstrumentedEnumSymbols(object):
+    """I wrap a IDiaEnumSymbols for SymbolStats."""
+    __slots__ = ("symbols", "symbolStats")
+
+    def __init__(self, symbols, symbolStats):
+        self.symbols = symbols
+        self.symbolStats = symbolStats
+
+    def __nonzero__(self):
+        return bool(self.symbols)
+
+    @property
+    def count(self):
+        return self.symbols.count
+
+    def __len__(self):
+        return self.symbols.count
+
+    def Item(self, index):
+        t = timeit.default_timer()
+        symbol = self.symbols.Item(index)
+        self.symbolStats.add("enum", "Item", timeit.default_timer() - t)
+        return InstrumentedSymbol(symbol, self.symbolStats)
+
+    def __iter__(self):
+        for i in xrange(self.symbols.count):
+            yield self.Item(i)
+
+
+class InstrumentedSymbol(object):
+    """I wrap a IDiaSymbol for SymbolStats.
+    Symbol values are wrapped too, NULL symbols are returned as they are."""
+    __slots__ = ("symbol", "symbolStats")
+
+    def __init__(self, symbol, symbolStats):
+        self.symbol = symbol
+        self.symbolStats = symbolStats
+
+    def __getattr__(self, attr):
+        t = timeit.default_timer()
+        value = getattr(self.symbol, attr)
+        if attr in ("findChildren", "findChildrenEx"):
+            return self._findChildren(value, attr)
+        self.symbolStats.add("read", attr, timeit.default_timer() - t)
+        if value and value.__class__ is self.symbol.__class__:
+            return InstrumentedSymbol(value, self.symbolStats)
+        return value
+
+    def _findChildren(self, method, name):
+        def findChildren(*args):
+            t = timeit.default_timer()
+            children = method(*args)
+            self.symbolStats.add("enum", name, timeit.default_timer() - t)
+            return InstrumentedEnumSymbols(children, self.symbolStats)
+        return findChildren
+
+    def __repr__(self):
+        return "<InstrumentedSymbol {!r}>".format(self.symbol)
+
+
 class SymbolPrinter:
     """I provide attributes, metadata and print the attributes of a symbol with DEBUG."""
     pydia = None
     options = None
+    typeNames = None # renames the UDTs and enums (see pydiaheader.TypeNames), inherited by the printers created from this one
 
     def __init__(self, pydia, **kwargs):
         assert pydia
         if isinstance(pydia, SymbolPrinter):
             self.pydia = pydia.pydia
+            self.typeNames = pydia.typeNames
         else:
             self.pydia = pydia
+        self.typeNames = kwargs.pop("typeNames", self.typeNames)
         self.options = dict(kwargs)
 
+    def typeName(self, symbol, definition=False):
+        """Return the name of a UDT or enum, in a reference or in its definition"""
+        if self.typeNames is None:
+            return symbol.name
+        return self.typeNames.name(symbol, definition)
+
     def defaultOption(self, name):
         """Return the default value of a particular option"""
         return None
@@ -224,128 +511,18 @@ class SymbolPrinter:
         if symTag is None:
             assert symbol
             symTag = symbol.symTag
-        if symTag == SYMTAG.SymTagNull:
-            return ("access","addressOffset","addressSection","addressTaken","age",
-                    "arrayIndexType","arrayIndexTypeId","backEndBuild","backEndMajor","backEndMinor",
-                    "backEndQFE","baseType","bitPosition","callingConvention","classParent",
-                    "classParentId","code","compilerGenerated","compilerName","constType",
-                    "constructor","container","count","countLiveRanges","customCallingConvention",
-                    "dataKind","editAndContinueEnabled","farReturn","framePointerPresent","frontEndBuild",
-                    "frontEndMajor","frontEndMinor","frontEndQFE","function","guid",
-                    "hasAlloca","hasAssignmentOperator","hasCastOperator","hasDebugInfo","hasEH",
-                    "hasEHa","hasInlAsm","hasLongJump","hasManagedCode","hasNestedTypes",
-                    "hasSEH","hasSecurityChecks","hasSetJump","hfaDouble","hfaFloat",
-                    "indirectVirtualBaseClass","inlSpec","interruptReturn","intrinsic","intro",
-                    "isAggregated","isCTypes","isCVTCIL","isConstructorVirtualBase","isCxxReturnUdt",
-                    "isDataAligned","isHotpatchable","isLTCG","isMSILNetmodule","isNaked",
-                    "isSafeBuffers","isSplitted","isStatic","isStripped","language",
-                    "length","lexicalParent","lexicalParentId","libraryName","liveRangeLength",
-                    "liveRangeStartAddressOffset","liveRangeStartAddressSection","liveRangeStartRelativeVirtualAddress","localBasePointerRegisterId","locationType",
-                    "lowerBound","lowerBoundId","machineType","managed","msil",
-                    "name","nested","noInline","noReturn","noStackOrdering",
-                    "notReached","objectPointerType","oemId","oemSymbolId","offset",
-                    "offsetInUdt","optimizedCodeDebugInfo","overloadedOperator","packed","paramBasePointerRegisterId",
-                    "platform","pure","rank","reference","registerId",
-                    "relativeVirtualAddress","scoped","sealed","signature","slot",
-                    "sourceFileName","strictGSCheck","symIndexId","symTag","symbolsFileName",
-                    "targetOffset","targetRelativeVirtualAddress","targetSection","targetVirtualAddress","thisAdjust",
-                    "thunkOrdinal","timeStamp","token","type","typeId",
-                    "udtKind","unalignedType","undecoratedName","unmodifiedType","unused",
-                    "upperBound","upperBoundId","value","virtual","virtualAddress",
-                    "virtualBaseClass","virtualBaseDispIndex","virtualBaseOffset","virtualBasePointerOffset","virtualBaseTableType",
-                    "virtualTableShape","virtualTableShapeId","volatileType","wasInlined")
-        if symTag == SYMTAG.SymTagFunction:
-            return ("access","addressOffset","addressSection","classParent","classParentId",
-                    "constType","customCallingConvention","farReturn","hasAlloca","hasEH",
-                    "hasEHa","hasInlAsm","hasLongJump","hasSecurityChecks","hasSEH",
-                    "hasSetJump","interruptReturn","intro","InlSpec","isNaked",
-                    "isStatic","length","lexicalParent","lexicalParentId","locationType",
-                    "name","noInline","notReached","noReturn","noStackOrdering",
-                    "optimizedCodeDebugInfo","pure","relativeVirtualAddress","symIndexId","symTag",
-                    "token","type","typeId","unalignedType","undecoratedName",
-                    "virtual","virtualAddress","virtualBaseOffset","volatileType")
-        if symTag == SYMTAG.SymTagFunctionType:
-            return ("callingConvention","classParent","classParentId","constType","count",
-                    "lexicalParent","lexicalParentId","objectPointerType","symIndexId","symTag",
-                    "thisAdjust","type","typeId","unalignedType","volatileType")
-        if symTag == SYMTAG.SymTagFuncDebugStart:
-            return ("addressOffset","addressSection","customCallingConvention","farReturn","farReturn",
-                    "isStatic","lexicalParent","lexicalParentId","locationType","noInline",
-                    "noReturn","notReached","offset","optimizedCodeDebugInfo","relativeVirtualAddress",
-                    "symIndexId","symTag","virtualAddress")
-        if symTag == SYMTAG.SymTagFuncDebugEnd:
-            return ("addressOffset","addressSection","customCallingConvention","farReturn","interruptReturn",
-                    "isStatic","lexicalParent","lexicalParentId","locationType","noInline",
-                    "noReturn","notReached","offset","optimizedCodeDebugInfo","symIndexId",
-                    "relativeVirtualAddress","symTag","virtualAddress")
-        if symTag == SYMTAG.SymTagData:
-            return ("access","addressOffset","addressSection","addressTaken","bitPosition",
-                    "classParent","classParentId","compilerGenerated","constType","dataKind",
-                    "isAggregated","isSplitted","length","lexicalParent","lexicalParentId",
-                    "locationType","name","offset","registerId","relativeVirtualAddress",
-                    "slot","symIndexId","symTag","token","type",
-                    "typeId","unalignedType","value","virtualAddress","volatileType")
-        if symTag == SYMTAG.SymTagBaseType:
-            return ("baseType","constType","length","lexicalParent","lexicalParentId",
-                    "symIndexId","symTag","unalignedType","volatileType")
-        if symTag == SYMTAG.SymTagFunctionArgType:
-            return ("classParent","classParentId","lexicalParent","lexicalParentId","symIndexId",
-                    "symTag","type","typeId")
-        if symTag == SYMTAG.SymTagUDT:
-            return ("classParent","classParentId","constructor","constType","hasAssignmentOperator",
-                    "hasCastOperator","hasNestedTypes","length","lexicalParent","lexicalParentId",
-                    "name","nested","overloadedOperator","packed","scoped",
-                    "symIndexId","symTag","udtKind","unalignedType","virtualTableShape",
-                    "virtualTableShapeId","volatileType")
-        if symTag == SYMTAG.SymTagVTable:
-            return ("classParent","classParentId","constType","lexicalParent","lexicalParentId",
-                    "symIndexId","symTag","type","typeId","unalignedType",
-                    "volatileType")
-        if symTag == SYMTAG.SymTagPointerType:
-            return ("constType","length","lexicalParent","lexicalParentId","reference",
-                    "symIndexId","symTag","type","typeId","unalignedType",
-                    "volatileType")
-        if symTag == SYMTAG.SymTagVTableShape:
-            return ("constType","count","lexicalParent","lexicalParentId","symIndexId",
-                    "symTag","unalignedType","volatileType")
-        if symTag == SYMTAG.SymTagTypedef:
-            return ("baseType","classParent","classParentId","constructor","constType",
-                    "hasAssignmentOperator","hasCastOperator","hasNestedTypes","length","lexicalParent",
-                    "lexicalParentId","name","nested","overloadedOperator","packed",
-                    "reference","scoped","symIndexId","symTag","type",
-                    "typeId","udtKind","unalignedType","virtualTableShape","virtualTableShapeId",
-                    "volatileType")
-        if symTag == SYMTAG.SymTagBaseClass:
-            return ("access","classParent","classParentId","constructor","constType",
-                    "hasAssignmentOperator","hasCastOperator","hasNestedTypes","indirectVirtualBaseClass","length",
-                    "lexicalParent","lexicalParentId","name","nested","offset",
-                    "overloadedOperator","packed","scoped","symIndexId","symTag",
-                    "type","typeId","udtKind","unalignedType","virtualBaseClass",
-                    "virtualBaseDispIndex","virtualBasePointerOffset","virtualBaseTableType","virtualTableShape","virtualTableShapeId",
-                    "volatileType")
-        if symTag == SYMTAG.SymTagArrayType:
-            return ("arrayIndexType","arrayIndexTypeId","constType","count","length",
-                    "lexicalParent","lexicalParentId","rank","symIndexId","symTag",
-                    "type","typeId","unalignedType","volatileType")
-        if symTag == SYMTAG.SymTagEnum:
-            return ("baseType","classParent","classParentId","constructor","constType",
-                    "hasAssignmentOperator","hasCastOperator","hasNestedTypes","length","lexicalParent",
-                    "lexicalParentId","name","nested","overloadedOperator","packed",
-                    "scoped","symIndexId","symTag","type","typeId",
-                    "unalignedType","volatileType")
-        if symTag == SYMTAG.SymTagCompiland:
-            return ("backEndBuild","backEndMajor","backEndMinor","compilerName","editAndContinueEnabled",
-                    "frontEndBuild","frontEndMajor","frontEndMinor","hasDebugInfo","hasManagedCode",
-                    "hasSecurityChecks","isCVTCIL","isDataAligned","isHotpatchable","isLTCG",
-                    "isMSILNetmodule","language","lexicalParent","lexicalParentId","platform",
-                    "symIndexId","symTag")
-        if symTag == SYMTAG.SymTagExe:
-            return ("age","guid","isCTypes","isStripped","machineType",
-                    "name","signature","symbolsFileName","symIndexId",
-                    "symTag")
-        if symTag == SYMTAG.SymTagCallSite:
-            return self.attributes(symTag=SYMTAG.SymTagNull) # TODO no information
-        assert False, "TODO symTag={}".format(SYMTAG_name(symTag))
+        attributes = SYMTAG_ATTRIBUTES.get(symTag)
+        assert attributes is not None, "TODO symTag={}".format(SYMTAG_name(symTag))
+        return attributes
+
+    def symbolAttributes(self, symbol=None, symTag=None):
+        """Return a tupple with the symTag or symbol.symTag attributes that have a symbol value"""
+        if symTag is None:
+            assert symbol
+            symTag = symbol.symTag
+        attributes = SYMTAG_SYMBOL_ATTRIBUTES.get(symTag)
+        assert attributes is not None, "TODO symTag={}".format(SYMTAG_name(symTag))
+        return attributes
 
     def debugSymbol(self, symbol, symTag=None):
         """Debug all the symbol attributes of symTag or symbol.symTag"""
@@ -356,7 +533,7 @@ class SymbolPrinter:
         for attr in self.attributes(symTag=symTag):
             try:
                 result = getattr(symbol, attr)
-            except comtypes.COMError, e:
+            except COMError, e:
                 result = e
             DEBUG(context, attr, result)
 
@@ -487,7 +664,8 @@ class SymbolPrinter:
         return m
 
     def validate(self, symbol):
-        """Assert the symbol is valid"""
+        """Assert the symbol is what the printer expects.
+        The invariants of the attributes are checked in bulk by pydiavalidate."""
         pass
 
 
@@ -504,7 +682,6 @@ class TypePrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag in (SYMTAG.SymTagBaseType, SYMTAG.SymTagPointerType, SYMTAG.SymTagFunctionType, SYMTAG.SymTagEnum, SYMTAG.SymTagUDT, SYMTAG.SymTagArrayType)
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
 
     def params(self, symbol):
         self.validate(symbol)
@@ -532,8 +709,6 @@ class TypePrinter(SymbolPrinter):
             if symbol.volatileType: s.append("volatile")
             s.append(BASICTYPE_str(symbol.baseType, symbol.length))
         elif symTag == SYMTAG.SymTagPointerType:
-            assert symbol.unalignedType == 0
-            assert symbol.volatileType == 0
             if symbol.reference: pointerType = "&"
             else: pointerType = "*"
             s.append(TypePrinter(self).declare(symbol.type) + pointerType)
@@ -545,14 +720,6 @@ class TypePrinter(SymbolPrinter):
         elif symTag == SYMTAG.SymTagUDT:
             s.append(UdtPrinter(self).declare(symbol))
         elif symTag == SYMTAG.SymTagArrayType:
-            arrayIndexType = symbol.arrayIndexType
-            assert arrayIndexType.symTag == SYMTAG.SymTagBaseType
-            assert arrayIndexType.baseType in (BASICTYPE.btULong, BASICTYPE.btInt) # integer index
-            assert symbol.constType == 0
-            assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-            assert symbol.rank == 0
-            assert symbol.unalignedType == 0
-            assert symbol.volatileType == 0
             s.append(TypePrinter(self).declare(symbol.type))
             if name: s += [" ", name]
             s += ["[", str(symbol.count), "]"]
@@ -640,7 +807,6 @@ class FunctionPrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagFunction
-        assert symbol.lexicalParent.symTag in (SYMTAG.SymTagCompiland, SYMTAG.SymTagExe)
 
     def paramNames(self, symbol):
         self.validate(symbol)
@@ -708,7 +874,6 @@ class DataPrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagData
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
 
     def declareMemberLine(self, symbol):
         self.validate(symbol)
@@ -746,14 +911,13 @@ class EnumPrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagEnum
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
 
-    def declare(self, symbol):
+    def declare(self, symbol, definition=False):
         self.validate(symbol)
         s = []
         if symbol.constType: s.append("const")
         s.append("enum")
-        s.append(symbol.name)
+        s.append(self.typeName(symbol, definition))
         return " ".join(s)
 
     def declareLine(self, symbol):
@@ -764,37 +928,11 @@ class EnumPrinter(SymbolPrinter):
         #self.debugSymbol(symbol)
         self.validate(symbol)  
         lines = []
-        lines.append(" ".join([self.declare(symbol), "//"] + self.metadata(symbol)))
+        lines.append(" ".join([self.declare(symbol, True), "//"] + self.metadata(symbol)))
         lines.append("{")
-        children = DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0))
+        children = DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagData, None, 0))
         hexvalue = self.option("hexvalue")
         for child in children:
-            #SymbolPrinter(self).debugSymbol(child)
-            assert child.symTag == SYMTAG.SymTagData
-            assert child.access == 0
-            assert child.addressOffset == 0
-            assert child.addressSection == 0
-            assert child.addressTaken == 0
-            assert child.bitPosition == 0
-            assert child.compilerGenerated == 0
-            assert child.constType == 0
-            assert child.dataKind == DATAKIND.DataIsConstant
-            assert child.isAggregated == 0
-            assert child.isSplitted == 0
-            assert child.length == 0
-            assert child.locationType == LOCATIONTYPE.LocIsConstant
-            assert child.offset == 0
-            assert child.registerId == 0
-            assert child.relativeVirtualAddress == 0
-            assert child.slot == 0
-            assert child.token == 0
-            assert child.unalignedType == 0
-            assert child.virtualAddress == 0
-            assert child.volatileType == 0
-            assert child.type.symTag == SYMTAG.SymTagBaseType
-            assert child.type.baseType == BASICTYPE.btInt # must be int type
-            assert child.classParent.symTag == SYMTAG.SymTagEnum # must be enum symbol
-            assert child.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
             if hexvalue:
                 value = hexValue(child.value, child.type.length)
             else:
@@ -809,10 +947,6 @@ class VTablePrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagVTable
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
-        assert symbol.constType == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
 
     def defineLines(self, symbol):
         self.validate(symbol)
@@ -846,6 +980,127 @@ class VTablePrinter(SymbolPrinter):
             lines.append("\t// TODO " + " ".join(SymbolPrinter(self).metadata(child)))
         return lines
 
+class Vftable(object):
+    """A vftable of a class: the functions in each slot (virtualBaseOffset -> function).
+    Derived classes share the slots of the base until they override one."""
+    __slots__ = ("offset", "virtualBase", "origin", "slots", "shared")
+
+    def __init__(self, offset, virtualBase, origin, slots, shared=False):
+        self.offset = offset # offset of the vfptr in the class (or in the virtual base)
+        self.virtualBase = virtualBase # name of the virtual base that holds the vfptr, None if not virtual
+        self.origin = origin # name of the class that introduced the vfptr
+        self.slots = slots
+        self.shared = shared
+
+    def derive(self, offset, virtualBase):
+        """Return the vftable as seen in a derived class (slots are copied on write)"""
+        return Vftable(offset, virtualBase, self.origin, self.slots, True)
+
+    def setSlot(self, virtualBaseOffset, function):
+        if self.shared:
+            self.slots = dict(self.slots)
+            self.shared = False
+        self.slots[virtualBaseOffset] = function
+
+    def isPrimary(self):
+        return self.offset == 0 and self.virtualBase is None
+
+
+def overrideName(function):
+    """Return the name that an overriding function shares with the function it overrides"""
+    name = function.name.split("::")[-1]
+    if name.startswith("~"):
+        return "~" # destructors are named after their class
+    return name
+
+
+class VtableLayout:
+    """I compute the vftables of classes.
+    The vftables of each class are memoized by symIndexId and built from the
+    vftables of the base classes, so a whole hierarchy is computed once."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.layouts = {} # symIndexId -> [Vftable]
+
+    def classOf(self, symbol):
+        """Return the UDT of a SymTagBaseClass or SymTagUDT symbol"""
+        if symbol.symTag == SYMTAG.SymTagBaseClass:
+            return symbol.type or symbol
+        return symbol
+
+    def vftables(self, symbol):
+        """Return the vftables of a class, primary vftable first"""
+        symbol = self.classOf(symbol)
+        symIndexId = symbol.symIndexId
+        layout = self.layouts.get(symIndexId)
+        if layout is None:
+            layout = self.compute(symbol)
+            self.layouts[symIndexId] = layout
+        return layout
+
+    def compute(self, symbol):
+        name = symbol.name
+        tables = []
+        seen = set() # (virtualBase, offset)
+        for base in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagBaseClass, None, 0)):
+            if base.indirectVirtualBaseClass:
+                continue # reached through the direct bases
+            virtualBaseClass = base.virtualBaseClass
+            for table in self.vftables(base):
+                if table.virtualBase is not None:
+                    derived = table.derive(table.offset, table.virtualBase)
+                elif virtualBaseClass:
+                    derived = table.derive(table.offset, base.name)
+                else:
+                    derived = table.derive(table.offset + base.offset, None)
+                key = (derived.virtualBase, derived.offset)
+                if key not in seen: # shared virtual bases (diamonds) are only added once
+                    seen.add(key)
+                    tables.append(derived)
+        primary = None
+        for table in tables:
+            if table.isPrimary():
+                primary = table
+                break
+        for function in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagFunction, None, 0)):
+            if not function.virtual:
+                continue
+            virtualBaseOffset = function.virtualBaseOffset
+            if function.intro:
+                if primary is None:
+                    primary = Vftable(0, None, name, {})
+                    tables.insert(0, primary)
+                primary.setSlot(virtualBaseOffset, function)
+            else:
+                self.findOverridden(tables, function, virtualBaseOffset).setSlot(virtualBaseOffset, function)
+        # primary vftable first
+        tables.sort(key=lambda table: (table.virtualBase is not None, table.virtualBase, table.offset))
+        return tables
+
+    def findOverridden(self, tables, function, virtualBaseOffset):
+        """Return the vftable with the slot that function overrides.
+        When the slot offset is in several vftables, the table is the one of the base class that
+        introduced the function: its slot holds a function with the same name (or a destructor)."""
+        candidates = [table for table in tables if virtualBaseOffset in table.slots]
+        if len(candidates) > 1:
+            name = overrideName(function)
+            introduced = [table for table in candidates if overrideName(table.slots[virtualBaseOffset]) == name]
+            candidates = introduced or candidates
+        if len(candidates) > 1:
+            functionType = function.type
+            thisAdjust = functionType and functionType.thisAdjust or 0
+            for table in candidates:
+                if table.virtualBase is None and table.offset == thisAdjust:
+                    return table
+            # not a non-virtual base at thisAdjust, prefer the vftables of the virtual bases
+            candidates.sort(key=lambda table: table.virtualBase is None)
+        if len(candidates) > 0:
+            return candidates[0]
+        assert len(tables) > 0, "{} overrides a virtual function of an unknown vftable".format(function.name)
+        return tables[0]
+
+
 class UdtPrinter(SymbolPrinter):
     """I print a struct/class/union definition."""
 
@@ -855,7 +1110,6 @@ class UdtPrinter(SymbolPrinter):
 
     def validate(self, symbol):
         assert symbol.symTag in (SYMTAG.SymTagUDT, SYMTAG.SymTagBaseClass)
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
 
     def inheritance(self, baseClasses):
         ret = []
@@ -878,9 +1132,6 @@ class UdtPrinter(SymbolPrinter):
         self.validate(symbol)
         #DEBUG("getVirtualFunctions", symbol, symbol.name, symbol.undecoratedName)
         #SymbolPrinter(self).debugSymbol(symbol)
-        assert symbol.virtualBaseClass == 0 # TODO virtual base classes
-        assert symbol.virtualBaseDispIndex == 0
-        assert symbol.virtualBasePointerOffset == 0
         virtualFunctions = []
         for function in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagFunction, None, 0)):
             if function.virtual == 1 and function.intro == 1:
@@ -891,42 +1142,30 @@ class UdtPrinter(SymbolPrinter):
 
     def defineVtableLines(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagUDT
-        assert symbol.udtKind == UDTKIND.UdtClass
-        assert symbol.constType == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
         lines = []
-        lines.append("struct vtable_t // const {}::`vftable'".format(symbol.name))
-        lines.append("{")
-        vtable = {}
-        vtableSymbols = [symbol]
-        while len(vtableSymbols) > 0:
-            vtableSymbol = vtableSymbols[0]
-            del vtableSymbols[0]
-            vtableSymbols += list(DiaEnumSymbolsIterator(vtableSymbol.findChildrenEx(SYMTAG.SymTagBaseClass, None, 0)))
-            #DEBUG("VTABLESYMBOL", vtableSymbol, vtableSymbol.name)
-            for functionSymbol in self.virtualFunctions(vtableSymbol):
-                assert functionSymbol.virtual == 1
-                virtualBaseOffset = functionSymbol.virtualBaseOffset
-                if not vtable.has_key(virtualBaseOffset) and functionSymbol.intro == 1:
-                    vtable[virtualBaseOffset] = functionSymbol
-        for virtualBaseOffset in sorted(vtable):
-            functionSymbol = vtable[virtualBaseOffset]
-            #name = functionSymbol.undecoratedName or "{}::{}".format(functionSymbol.classParent.name, functionSymbol.name)
-            name = "{}::{}".format(functionSymbol.classParent.name, SymbolPrinter(self).name(functionSymbol))
-            lines.append("\t/* vtable+{}/0x{:X} */ {} // {}".format(virtualBaseOffset, virtualBaseOffset, name, functionSymbol.undecoratedName))
-        lines.append("};")
+        for index, vftable in enumerate(self.pydia.vtableLayout().vftables(symbol)):
+            if vftable.isPrimary():
+                lines.append("struct vtable_t // const {}::`vftable'".format(symbol.name))
+            else:
+                where = vftable.virtualBase and "virtual {}".format(vftable.virtualBase) or "this+{}".format(vftable.offset)
+                lines.append("struct vtable{}_t // const {}::`vftable'{{for `{}'}} ({})".format(index, symbol.name, vftable.origin, where))
+            lines.append("{")
+            for virtualBaseOffset in sorted(vftable.slots):
+                functionSymbol = vftable.slots[virtualBaseOffset]
+                #name = functionSymbol.undecoratedName or "{}::{}".format(functionSymbol.classParent.name, functionSymbol.name)
+                name = "{}::{}".format(functionSymbol.classParent.name, SymbolPrinter(self).name(functionSymbol))
+                lines.append("\t/* vtable+{}/0x{:X} */ {} // {}".format(virtualBaseOffset, virtualBaseOffset, name, functionSymbol.undecoratedName))
+            lines.append("};")
         return lines
 
     
-    def declare(self, symbol):
+    def declare(self, symbol, definition=False):
         self.validate(symbol)
         s = []
         if symbol.constType:
             s.append("const")
         s.append(UDTKIND_str(symbol.udtKind))
-        s.append(symbol.name)
+        s.append(self.typeName(symbol, definition))
         return " ".join(s)
 
     def declareLine(self, symbol):
@@ -935,7 +1174,7 @@ class UdtPrinter(SymbolPrinter):
     def declareEx(self, symbol, baseClasses):
         s = []
         # declare
-        s.append(self.declare(symbol))
+        s.append(self.declare(symbol, True))
         # inheritance
         if len(baseClasses) > 0:
             s.append(":")
@@ -963,7 +1202,6 @@ class UdtPrinter(SymbolPrinter):
 
     def defineLines(self, symbol):
         self.validate(symbol)
-        self.debugSymbol(symbol)
         className = self.name(symbol)
         baseClasses = [] # SymTagBaseClass
         vtables = [] # SymTagVTable
@@ -984,6 +1222,8 @@ class UdtPrinter(SymbolPrinter):
             elif childSymTag == SYMTAG.SymTagVTable:
                 vtables.append(child)
             elif childSymTag in (SYMTAG.SymTagEnum, SYMTAG.SymTagUDT, SYMTAG.SymTagTypedef):
+                if self.typeNames is not None and not self.typeNames.definedInside(child):
+                    continue # defined at the top level
                 nestedTypes.append(child)
             elif childSymTag == SYMTAG.SymTagData:
                 variables.append(child)
@@ -1064,11 +1304,6 @@ class UdtPrinter(SymbolPrinter):
 
     def debugUDT(self, symbol):
         assert symbol.symTag == SYMTAG.SymTagUDT
-        assert symbol.udtKind == UDTKIND.UdtClass
-        assert symbol.constType == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
         self.debugSymbol(symbol)
         #vtable = self.getVtableFunctions(symbol)
         #for virtualBaseOffset in sorted(vtable):
@@ -1087,23 +1322,11 @@ class UdtPrinter(SymbolPrinter):
                 self.debugChildren(vtableSymbol)
 
                 typeSymbol = vtableSymbol.type # vtable pointer
-                assert typeSymbol.symTag == SYMTAG.SymTagPointerType
-                assert typeSymbol.constType == 0
-                assert typeSymbol.length == 4
-                assert typeSymbol.reference == 0
-                assert typeSymbol.unalignedType == 0
-                assert typeSymbol.volatileType == 0
-                assert typeSymbol.lexicalParent.symTag == SYMTAG.SymTagExe
                 DEBUG(".type")
                 self.debugSymbol(typeSymbol)
                 self.debugChildren(typeSymbol, ".type")
 
                 shapeSymbol = typeSymbol.type # vtable shape
-                assert shapeSymbol.symTag == SYMTAG.SymTagVTableShape
-                assert shapeSymbol.constType == 0
-                assert shapeSymbol.unalignedType == 0
-                assert shapeSymbol.volatileType == 0
-                assert shapeSymbol.lexicalParent.symTag == SYMTAG.SymTagExe
                 DEBUG(".type.shape")
                 self.debugSymbol(shapeSymbol)
                 self.debugChildren(shapeSymbol, ".type.shape")
@@ -1122,44 +1345,26 @@ class UdtPrinter(SymbolPrinter):
                 pass
 
 
-class DiaSymbol:
+class DiaSymbol(object):
     """Any symbol."""
-    attributes = ("access","addressOffset","addressSection","addressTaken","age",
-                  "arrayIndexType","arrayIndexTypeId","backEndBuild","backEndMajor","backEndMinor",
-                  "backEndQFE","baseType","bitPosition","callingConvention","classParent",
-                  "classParentId","code","compilerGenerated","compilerName","constType",
-                  "constructor","container","count","countLiveRanges","customCallingConvention",
-                  "dataKind","editAndContinueEnabled","farReturn","framePointerPresent","frontEndBuild",
-                  "frontEndMajor","frontEndMinor","frontEndQFE","function","guid",
-                  "hasAlloca","hasAssignmentOperator","hasCastOperator","hasDebugInfo","hasEH",
-                  "hasEHa","hasInlAsm","hasLongJump","hasManagedCode","hasNestedTypes",
-                  "hasSEH","hasSecurityChecks","hasSetJump","hfaDouble","hfaFloat",
-                  "indirectVirtualBaseClass","inlSpec","interruptReturn","intrinsic","intro",
-                  "isAggregated","isCTypes","isCVTCIL","isConstructorVirtualBase","isCxxReturnUdt",
-                  "isDataAligned","isHotpatchable","isLTCG","isMSILNetmodule","isNaked",
-                  "isSafeBuffers","isSplitted","isStatic","isStripped","language",
-                  "length","lexicalParent","lexicalParentId","libraryName","liveRangeLength",
-                  "liveRangeStartAddressOffset","liveRangeStartAddressSection","liveRangeStartRelativeVirtualAddress","localBasePointerRegisterId","locationType",
-                  "lowerBound","lowerBoundId","machineType","managed","msil",
-                  "name","nested","noInline","noReturn","noStackOrdering",
-                  "notReached","objectPointerType","oemId","oemSymbolId","offset",
-                  "offsetInUdt","optimizedCodeDebugInfo","overloadedOperator","packed","paramBasePointerRegisterId",
-                  "platform","pure","rank","reference","registerId",
-                  "relativeVirtualAddress","scoped","sealed","signature","slot",
-                  "sourceFileName","strictGSCheck","symIndexId","symTag","symbolsFileName",
-                  "targetOffset","targetRelativeVirtualAddress","targetSection","targetVirtualAddress","thisAdjust",
-                  "thunkOrdinal","timeStamp","token","type","typeId",
-                  "udtKind","unalignedType","undecoratedName","unmodifiedType","unused",
-                  "upperBound","upperBoundId","value","virtual","virtualAddress",
-                  "virtualBaseClass","virtualBaseDispIndex","virtualBaseOffset","virtualBasePointerOffset","virtualBaseTableType",
-                  "virtualTableShape","virtualTableShapeId","volatileType","wasInlined")
-    pydia = None
-    symbol = None
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull]
+    __slots__ = ("pydia", "symbol")
 
     def __init__(self, pydia, symbol):
         self.pydia = pydia
         self.symbol = symbol
 
+    def __getattr__(self, attr):
+        """Read an attribute of the symbol on first use and keep it in its slot"""
+        if attr not in self.attributes or attr in ("pydia", "symbol"):
+            raise AttributeError(attr)
+        value = getattr(self.symbol, attr)
+        try:
+            object.__setattr__(self, attr, value)
+        except AttributeError:
+            pass # not a slot of this class (DiaSymbol)
+        return value
+
     def debug(self):
         context = self.__class__.__name__
         symbol = self.symbol
@@ -1167,7 +1372,7 @@ class DiaSymbol:
         for attr in self.attributes:
             try:
                 result = getattr(self.symbol, attr)
-            except comtypes.COMError, e:
+            except COMError, e:
                 result = e
             DEBUG(context, attr, result)
 
@@ -1187,7 +1392,6 @@ class DiaSymbol:
         else:
             err = "<TODO DiaSymbol.declare for symTag {}>".format(symTag)
             #return err
-            self.debug()
             assert False, err
         if symbolClass.declare == self.__class__.declare:
             raise NotImplementedError("{}.declare".format(symbolClass.__name__))
@@ -1207,113 +1411,33 @@ class DiaSymbol:
         else:
             err = "<TODO DiaSymbol.sizeof for symTag {}>".format(symTag)
             #return err
-            self.debug()
             assert False, err
         if symbolClass.sizeof == self.__class__.sizeof:
             raise NotImplementedError("{}.sizeof".format(symbolClass.__name__))
         return symbolClass(self.pydia,self.symbol).sizeof()
 
 
-class DiaFunctionType(DiaSymbol):
-    """Each unique function signature is identified by a SymTagFunctionType symbol.
-    Each parameter is identified as a class child symbol with a SymTagFunctionArgType tag."""
-    attributes = ("callingConvention","classParent","classParentId","constType","count",
-                  "lexicalParent","lexicalParentId","objectPointerType","symIndexId","symTag",
-                  "thisAdjust","type","typeId","unalignedType","volatileType")
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        self.debug()
-
 class DiaFunction(DiaSymbol):
     """Each function is identified by a SymTagFunction symbol."""
-    attributes = ("access","addressOffset","addressSection","classParent","classParentId",
-                  "constType","customCallingConvention","farReturn","hasAlloca","hasEH",
-                  "hasEHa","hasInlAsm","hasLongJump","hasSecurityChecks","hasSEH",
-                  "hasSetJump","interruptReturn","intro","InlSpec","isNaked",
-                  "isStatic","length","lexicalParent","lexicalParentId","locationType",
-                  "name","noInline","notReached","noReturn","noStackOrdering",
-                  "optimizedCodeDebugInfo","pure","relativeVirtualAddress","symIndexId","symTag",
-                  "token","type","typeId","unalignedType","undecoratedName",
-                  "undecoratedNameEx","virtual","virtualAddress","virtualBaseOffset","volatileType")
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagFunction
-        self.debug()
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagFunction]
+    __slots__ = attributes
 
 class DiaTypedef(DiaSymbol):
     """Symbols with SymTagTypedef tags introduce names for other types."""
-    attributes = ("baseType","classParent","classParentId","constructor","constType",
-                  "hasAssignmentOperator","hasCastOperator","hasNestedTypes","length","lexicalParent",
-                  "lexicalParentId","name","nested","overloadedOperator","packed",
-                  "reference","scoped","symIndexId","symTag","type",
-                  "typeId","udtKind","unalignedType","virtualTableShape","virtualTableShapeId",
-                  "volatileType")
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagTypedef
-        self.debug()
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagTypedef]
+    __slots__ = attributes
 
 class DiaBaseClass(DiaSymbol):
     """Each base class for a user-defined type (UDT) symbol is identified by a child with a SymTagBaseClass tag.
     The IDiaSymbol::get_type property contains the symbol for the underlying UDT,
     and all properties of the underlying UDT are available as part of this BaseClass symbol."""
-    attributes = ("access","classParent","classParentId","constructor","constType",
-                  "hasAssignmentOperator","hasCastOperator","hasNestedTypes","indirectVirtualBaseClass","length",
-                  "lexicalParent","lexicalParentId","name","nested","offset",
-                  "overloadedOperator","packed","scoped","symIndexId","symTag",
-                  "type","typeId","udtKind","unalignedType","virtualBaseClass",
-                  "virtualBaseDispIndex","virtualBasePointerOffset","virtualBaseTableType","virtualTableShape","virtualTableShapeId",
-                  "volatileType")
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagBaseClass]
+    __slots__ = attributes
     udtKindStr = {
         UDTKIND.UdtStruct: "struct",
         UDTKIND.UdtClass: "class",
         UDTKIND.UdtUnion: "union",
         }
-    classParentSymbol = None
-    constructor = None
-    hasAssignmentOperator = None
-    hasNestedTypes = None
-    length = None
-    name = None
-    nested = None
-    offset = None
-    overloadedOperator = None
-    typeSymbol = None
-    udtKind = None
-    virtualTableShapeSymbol = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagBaseClass
-        assert symbol.access == CVACCESS.CV_public
-        assert symbol.constType == 0
-        assert symbol.hasCastOperator == 0
-        assert symbol.indirectVirtualBaseClass == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe
-        assert symbol.packed == 0
-        assert symbol.scoped == 0
-        assert symbol.unalignedType == 0
-        assert symbol.virtualBaseClass == 0
-        assert symbol.virtualBaseDispIndex == 0
-        assert symbol.virtualBasePointerOffset == 0
-        assert not symbol.virtualBaseTableType #<POINTER(IDiaSymbol) ptr=0x0 at 486bc60>
-        assert symbol.volatileType == 0
-
-        self.classParentSymbol = symbol.classParent
-        self.constructor = symbol.constructor
-        self.hasAssignmentOperator = symbol.hasAssignmentOperator
-        self.hasNestedTypes = symbol.hasNestedTypes
-        self.length = symbol.length
-        self.name = symbol.name
-        self.nested = symbol.nested
-        self.offset = symbol.offset
-        self.overloadedOperator = symbol.overloadedOperator
-        self.typeSymbol = symbol.type
-        self.udtKind = symbol.udtKind
-        self.virtualTableShape = symbol.virtualTableShape
 
     def define(self):
         return "/* this+{} */ public: //{} {}".format(
@@ -1323,12 +1447,8 @@ class DiaBaseClass(DiaSymbol):
 
 class DiaData(DiaSymbol):
     """TODO"""
-    attributes = ("access","addressOffset","addressSection","addressTaken","bitPosition",
-                  "classParent","classParentId","compilerGenerated","constType","dataKind",
-                  "isAggregated","isSplitted","length","lexicalParent","lexicalParentId",
-                  "locationType","name","offset","registerId","relativeVirtualAddress",
-                  "slot","symIndexId","symTag","token","type",
-                  "typeId","unalignedType","value","virtualAddress","volatileType")
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagData]
+    __slots__ = attributes
     accessStr = {
         CVACCESS.CV_private: "private:",
         CVACCESS.CV_protected: "protected:",
@@ -1368,50 +1488,6 @@ class DiaData(DiaSymbol):
         #       int TestClass::test_location_class_public_static = 1;
         (DATAKIND.DataIsGlobal,LOCATIONTYPE.LocIsStatic): ("header/source","source"),
         }
-    access = None # 0 in global scope, valid otherwise
-    addressOffset = None
-    addressSection = None
-    classParentSymbol = None
-    dataKind = None
-    locationType = None
-    name = None
-    offset = None
-    typeSymbol = None
-    relativeVirtualAddress = None
-    value = None
-    virtualAddress = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagData
-        #DEBUG("")
-        #self.debug()
-        assert symbol.addressTaken == 0
-        assert symbol.bitPosition == 0
-        assert symbol.compilerGenerated == 0
-        assert symbol.constType == 0
-        assert symbol.isAggregated == 0
-        assert symbol.isSplitted == 0
-        assert symbol.length == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        assert symbol.registerId == 0
-        assert symbol.slot == 0
-        assert symbol.token == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-
-        self.access = symbol.access
-        self.addressOffset = symbol.addressOffset
-        self.addressSection = symbol.addressSection
-        self.classParentSymbol = symbol.classParent
-        self.dataKind = symbol.dataKind
-        self.locationType = symbol.locationType
-        self.name = symbol.name
-        self.offset = symbol.offset
-        self.typeSymbol = symbol.type
-        self.relativeVirtualAddress = symbol.relativeVirtualAddress
-        self.value = symbol.value
-        self.virtualAddress = symbol.virtualAddress
 
     def declare(self):
         assert self.access != 0
@@ -1419,7 +1495,7 @@ class DiaData(DiaSymbol):
             self.offset,
             self.offset,
             self.accessStr[self.access],
-            DiaSymbol(self.pydia,self.typeSymbol).declare(),
+            DiaSymbol(self.pydia,self.type).declare(),
             self.name)
 
     def defineLines(self):
@@ -1428,7 +1504,7 @@ class DiaData(DiaSymbol):
             # constant variable present only inside a source file; can be static or not
             #   const int test_location_const = 1;
             #   static const int test_location_static_const = 1;
-            typeStr = DiaSymbol(self.pydia,self.typeSymbol).declare()
+            typeStr = DiaSymbol(self.pydia,self.type).declare()
             hexValueStr = hexValue(self.value,self.sizeof())
             lines.append("{} {} = {};//{} <constant> <maybe-static>".format(
                 typeStr, self.name, self.value, hexValueStr))
@@ -1471,64 +1547,28 @@ class DiaData(DiaSymbol):
                 comments.append("<normal-or-extern-or-member-static>")
             else:
                 dataKindStr = "<{}> ".format(DATAKIND_name(self.dataKind))
-            typeStr = DiaSymbol(self.pydia,self.typeSymbol).declare()
+            typeStr = DiaSymbol(self.pydia,self.type).declare()
             lines.append('{}& {} = VTOR<int>(SymDB::Add("{}", SAKEXE, "{}")); // = TODO;'.format(
                 typeStr, self.name, self.name, self.name))
             lines.append("{}{} {};// {}".format(
                 dataKindStr, typeStr, self.name, ' '.join(comments)))
         else:
             #self.debug()
-            #DiaSymbol(self.pydia,self.typeSymbol).debug()
+            #DiaSymbol(self.pydia,self.type).debug()
             lines.append("<TODO DiaData.define {}>".format(
                 (LOCATIONTYPE_name(self.locationType),DATAKIND_name(self.dataKind))))
         return lines
 
     def sizeof(self):
-        return DiaSymbol(self.pydia,self.typeSymbol).sizeof()
+        return DiaSymbol(self.pydia,self.type).sizeof()
 
 class DiaFunctionType(DiaSymbol):
     """TODO"""
-    attributes = ("callingConvention","classParent","classParentId","constType","count",
-                  "lexicalParent","lexicalParentId","objectPointerType","symIndexId","symTag",
-                  "thisAdjust","type","typeId","unalignedType","volatileType")
-    callingConvention = None
-    classParentSymbol = None # None or UDT
-    objectPointerTypeSymbol = None # None or PointerType
-    count = None
-    thisAdjust = None
-    returnType = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        #DEBUG("")
-        #self.debug()
-        assert symbol.symTag == SYMTAG.SymTagFunctionType
-        assert symbol.constType == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        classParent = symbol.classParent
-        if classParent:
-            assert classParent.symTag == SYMTAG.SymTagUDT
-        objectPointerType = symbol.objectPointerType
-        if objectPointerType:
-            assert objectPointerType.symTag == SYMTAG.SymTagPointerType
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-
-        self.callingConvention = symbol.callingConvention
-        classParent = symbol.classParent
-        if classParent:
-            self.classParentSymbol = classParent
-        self.count = symbol.count
-        objectPointerType = symbol.objectPointerType
-        if objectPointerType:
-            self.objectPointerTypeSymbol = objectPointerType
-        self.thisAdjust = symbol.thisAdjust
-        self.returnType = symbol.type
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagFunctionType]
+    __slots__ = attributes
 
     def declare(self):
-        #self.debug()
-        #assert False, "<TODO DiaFunctionType.declare>"
-        return "<TODO DiaFunctionType.declare>"
+        return self.pydia.signatureTable().signature(self.symbol).declare()
 
     def sizeof(self):
         return 
@@ -1536,55 +1576,13 @@ class DiaFunctionType(DiaSymbol):
 
 class DiaUDT(DiaSymbol):
     """TODO"""
-    attributes = ("classParent","classParentId","constructor","constType","hasAssignmentOperator",
-                  "hasCastOperator","hasNestedTypes","length","lexicalParent","lexicalParentId",
-                  "name","nested","overloadedOperator","packed","scoped",
-                  "symIndexId","symTag","udtKind","unalignedType","virtualTableShape",
-                  "virtualTableShapeId","volatileType")
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagUDT]
+    __slots__ = attributes
     udtKindStr = {
         UDTKIND.UdtStruct: "struct",
         UDTKIND.UdtClass: "class",
         UDTKIND.UdtUnion: "union",
         }
-    classParentSymbol = None
-    constructor = None
-    constType = None
-    hasAssignmentOperator = None
-    hasCastOperator = None
-    hasNestedTypes = None
-    length = None
-    name = None
-    nested = None
-    overloadedOperator = None
-    packed = None
-    scoped = None
-    udtKind = None
-    virtualTableShapeSymbol = None
-    volatileType = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        #DEBUG("")
-        #self.debug()
-        assert symbol.symTag == SYMTAG.SymTagUDT
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        assert symbol.unalignedType == 0
-
-        self.classParentSymbol = symbol.classParent
-        self.constructor = symbol.constructor
-        self.constType = symbol.constType
-        self.hasAssignmentOperator = symbol.hasAssignmentOperator
-        self.hasCastOperator = symbol.hasCastOperator
-        self.hasNestedTypes = symbol.hasNestedTypes
-        self.length = symbol.length
-        self.name = symbol.name
-        self.nested = symbol.nested
-        self.overloadedOperator = symbol.overloadedOperator
-        self.scoped = symbol.scoped
-        self.udtKind = symbol.udtKind
-        self.packed = symbol.packed
-        self.virtualTableShapeSymbol = symbol.virtualTableShape
-        self.volatileType = symbol.volatileType
 
     def declare(self):
         s = []
@@ -1608,7 +1606,6 @@ class DiaUDT(DiaSymbol):
         dataSymbols = []
         functionSymbols = []
         
-        self.debug()
         children = self.pydia.findChildrenEx(self.symbol)
         DEBUG("DiaUDT.defineLines", "len(children) == {}".format(len(children)))
         for child in children:
@@ -1658,29 +1655,12 @@ class DiaUDT(DiaSymbol):
 
 class DiaPointerType(DiaSymbol):
     """Pointer type."""
-    attributes = ("constType","length","lexicalParent","lexicalParentId","reference",
-                  "symIndexId","symTag","type","typeId","unalignedType",
-                  "volatileType")
-    constType = None
-    reference = None
-    typeSymbol = None
-    volatileType = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagPointerType
-        assert symbol.length == 4
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        assert symbol.unalignedType == 0
-
-        self.constType = symbol.constType
-        self.reference = symbol.reference
-        self.typeSymbol = symbol.type
-        self.volatileType = symbol.volatileType
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagPointerType]
+    __slots__ = attributes
 
     def declare(self):
         s = []
-        s.append(DiaSymbol(self.pydia,self.typeSymbol).declare())
+        s.append(DiaSymbol(self.pydia,self.type).declare())
         if self.reference:      s.append("&")
         else:                   s.append("*")
         if self.constType:      s.append("const")
@@ -1693,36 +1673,12 @@ class DiaPointerType(DiaSymbol):
 
 class DiaArrayType(DiaSymbol):
     """Array type."""
-    attributes = ("arrayIndexType","arrayIndexTypeId","constType","count","length",
-                  "lexicalParent","lexicalParentId","rank","symIndexId","symTag",
-                  "type","typeId","unalignedType","volatileType")
-    count = None
-    length = None
-    typeSymbol = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagArrayType
-        arrayIndexType = symbol.arrayIndexType
-        printer = SymbolPrinter(pydia)
-        printer.debugSymbol(symbol)
-        printer.debugSymbol(arrayIndexType)
-        del printer
-        assert arrayIndexType.symTag == SYMTAG.SymTagBaseType
-        assert arrayIndexType.baseType in (BASICTYPE.btULong, BASICTYPE.btInt) # integer index
-        assert symbol.constType == 0
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        assert symbol.rank == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-
-        self.count = symbol.count
-        self.length = symbol.length
-        self.typeSymbol = symbol.type
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagArrayType]
+    __slots__ = attributes
 
     def declare(self):
         s = []
-        s.append(DiaSymbol(self.pydia,self.typeSymbol).declare())
+        s.append(DiaSymbol(self.pydia,self.type).declare())
         s.append("[{}]".format(self.count))
         return ''.join(s)
 
@@ -1733,47 +1689,9 @@ class DiaArrayType(DiaSymbol):
 class DiaEnumData(DiaSymbol): # done
     """Enum value.
     Parent: DiaEnum"""
-    attributes = ("access", "addressOffset", "addressSection", "addressTaken", "bitPosition",
-                  "classParent", "classParentId", "compilerGenerated", "constType", "dataKind",
-                  "isAggregated", "isSplitted", "length", "lexicalParent", "lexicalParentId",
-                  "locationType", "name", "offset", "registerId", "relativeVirtualAddress",
-                  "slot", "symIndexId", "symTag", "token", "type",
-                  "typeId", "unalignedType", "value", "virtualAddress", "volatileType")
-    name = None
-    value = None
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagData]
+    __slots__ = attributes
     
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagData
-        assert symbol.access == 0
-        assert symbol.addressOffset == 0
-        assert symbol.addressSection == 0
-        assert symbol.addressTaken == 0
-        assert symbol.bitPosition == 0
-        assert symbol.compilerGenerated == 0
-        assert symbol.constType == 0
-        assert symbol.dataKind == DATAKIND.DataIsConstant
-        assert symbol.isAggregated == 0
-        assert symbol.isSplitted == 0
-        assert symbol.length == 0
-        assert symbol.locationType == LOCATIONTYPE.LocIsConstant
-        assert symbol.offset == 0
-        assert symbol.registerId == 0
-        assert symbol.relativeVirtualAddress == 0
-        assert symbol.slot == 0
-        assert symbol.token == 0
-        assert symbol.unalignedType == 0
-        assert symbol.virtualAddress == 0
-        assert symbol.volatileType == 0
-        symbolType = symbol.type
-        assert symbolType.symTag == SYMTAG.SymTagBaseType
-        assert symbolType.baseType == BASICTYPE.btInt # must be int type
-        assert symbol.classParent.symTag == SYMTAG.SymTagEnum # must be enum symbol
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-        
-        self.name = symbol.name
-        self.value = symbol.value
-
     def define(self, prefix="", suffix=",", hexvalue=True):
         assert isinstance(prefix, basestring)
         assert isinstance(suffix, basestring)
@@ -1790,39 +1708,8 @@ class DiaEnum(DiaSymbol): # done
     """Enum type.
     If nested, define inside the parent instead of globally.
     Child: DiaEnumData"""
-    attributes = ("baseType", "classParent", "classParentId", "constructor", "constType",
-                  "hasAssignmentOperator", "hasCastOperator", "hasNestedTypes", "length", "lexicalParent",
-                  "lexicalParentId", "name", "nested", "overloadedOperator", "packed",
-                  "scoped", "symIndexId", "symTag", "type", "typeId",
-                  "unalignedType", "volatileType")
-    constType = None
-    classParentSymbol = None # when child
-    name = None
-    nested = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagEnum
-        assert symbol.baseType == BASICTYPE.btInt
-        assert symbol.constructor == 0
-        assert symbol.hasAssignmentOperator == 0
-        assert symbol.hasCastOperator == 0
-        assert symbol.hasNestedTypes == 0
-        assert symbol.length == 4
-        assert symbol.overloadedOperator == 0
-        assert symbol.packed == 0
-        assert symbol.scoped == 0
-        assert symbol.unalignedType == 0
-        assert symbol.volatileType == 0
-        symbolType = symbol.type
-        assert symbolType.symTag == SYMTAG.SymTagBaseType
-        assert symbolType.baseType == BASICTYPE.btInt # must be int type
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be global scope
-
-        self.classParentSymbol = symbol.classParent
-        self.constType = symbol.constType
-        self.name = symbol.name
-        self.nested = symbol.nested
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagEnum]
+    __slots__ = attributes
 
     def children(self):
         return self.pydia.findChildrenEx(self.symbol)
@@ -1843,7 +1730,7 @@ class DiaEnum(DiaSymbol): # done
             s += "//nested (put inside the parent)"
         lines.append(s)
         for child in self.children():
-            enumData = DiaEnumData(self, child)
+            enumData = DiaEnumData(self.pydia, child)
             lines.append(enumData.define(prefix="\t"))
         lines.append("};")
         return lines
@@ -1854,8 +1741,8 @@ class DiaEnum(DiaSymbol): # done
 
 class DiaBaseType(DiaSymbol): # done
     """Compiler type."""
-    attributes = ("baseType", "constType", "length", "lexicalParent", "lexicalParentId",
-                  "symIndexId", "symTag", "unalignedType", "volatileType")
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagBaseType]
+    __slots__ = attributes
     typeStr = {
         (BASICTYPE.btVoid,0): "void", # void type
         (BASICTYPE.btChar,1): "char", # char WITHOUT signed/unsigned type
@@ -1874,22 +1761,6 @@ class DiaBaseType(DiaSymbol): # done
         (BASICTYPE.btLong,4): "long", # signed long int type
         (BASICTYPE.btULong,4): "unsigned long", # unsigned long int type
         }
-    baseType = None
-    constType = None
-    length = None
-    unalignedType = None
-    volatileType = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagBaseType
-        assert symbol.lexicalParent.symTag == SYMTAG.SymTagExe # must be the global scope
-
-        self.baseType = symbol.baseType
-        self.constType = symbol.constType
-        self.length = symbol.length
-        self.unalignedType = symbol.unalignedType
-        self.volatileType = symbol.volatileType
 
     def declare(self):
         s = []
@@ -1906,32 +1777,13 @@ class DiaBaseType(DiaSymbol): # done
 class DiaExe(DiaSymbol): # done
     """Executable.
     It represents the global scope."""
-    attributes = ("age","guid","isCTypes","isStripped","machineType",
-                  "name","signature","symbolsFileName","symIndexId","symTag")
+    attributes = SYMTAG_ATTRIBUTES[SYMTAG.SymTagExe]
+    __slots__ = attributes
     machineTypeStr = {
         0x014c: "IMAGE_FILE_MACHINE_I386",
         0x0200: "IMAGE_FILE_MACHINE_IA64",
         0x8664: "IMAGE_FILE_MACHINE_AMD64",
         }
-    age = None
-    guid = None # comtypes.GUID
-    machineType = None
-    name = None
-    signature = None
-    symbolsFileName = None
-
-    def __init__(self, pydia, symbol):
-        DiaSymbol.__init__(self,pydia,symbol)
-        assert symbol.symTag == SYMTAG.SymTagExe
-        assert symbol.isCTypes == 0
-        assert symbol.isStripped == 0
-
-        self.age = symbol.age
-        self.guid = symbol.guid
-        self.machineType = symbol.machineType
-        self.name = symbol.name
-        self.signature = symbol.signature
-        self.symbolsFileName = symbol.symbolsFileName
 
 
 class PyDia:
@@ -1943,6 +1795,17 @@ class PyDia:
     dataSource = None # IDiaDataSource
     session = None # IDiaSession
     globalScope = None # IDiaSymbol
+    symbolStats = None # SymbolStats when instrumented
+    vtableLayouts = None # VtableLayout, created on demand
+    classHierarchyIndex = None # pydiaindex.ClassHierarchy, created on demand
+    typeUsageIndex = None # pydiaindex.TypeUsageIndex, created on demand
+    ctypesTypes = None # module of ctypes classes, created on demand
+    enumTypes = None # module of IntEnum classes, created on demand
+    functionSignatures = None # pydiasignature.SignatureTable, created on demand
+    sourceFiles = None # pydiasource.SourceInventory, created on demand
+    binarySizes = None # pydiasize.SizeReport, created on demand
+    queryEngine = None # pydiaquery.QueryEngine, created on demand
+    invariantReport = None # pydiavalidate.ValidationReport, created on demand
 
     prefix = []
 
@@ -1989,7 +1852,123 @@ class PyDia:
         del self.prefix[-1]
 
     def symbolById(self, id):
-        return self.session.symbolById(id)
+        if self.symbolStats is None:
+            return self.session.symbolById(id)
+        t = timeit.default_timer()
+        symbol = self.session.symbolById(id)
+        self.symbolStats.add("session", "symbolById", timeit.default_timer() - t)
+        return InstrumentedSymbol(symbol, self.symbolStats)
+
+    def instrument(self):
+        """Count and time the symbol traffic from now on.
+        Only symbols obtained after this call are instrumented."""
+        if self.symbolStats is None:
+            self.symbolStats = SymbolStats()
+            self.globalScope = InstrumentedSymbol(self.globalScope, self.symbolStats)
+
+    def stats(self):
+        """Return the symbol traffic counters or None when not instrumented"""
+        if self.symbolStats is None:
+            return None
+        return self.symbolStats.stats()
+
+    def dumpStats(self, filepath):
+        """Write the symbol traffic counters to a JSON file"""
+        f = open(filepath, "w")
+        try:
+            json.dump(self.stats(), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def printStats(self, top=20):
+        stats = self.stats()
+        if stats is None:
+            DEBUG("PyDia.printStats", "not instrumented")
+            return
+        for kind in sorted(stats["totals"]):
+            total = stats["totals"][kind]
+            DEBUG("PyDia.printStats", "{:<8} count={} seconds={:.3f}".format(kind, total["count"], total["seconds"]))
+        names = [(entry["count"], kind, name, entry["seconds"]) for kind in stats["byName"] for name, entry in stats["byName"][kind].iteritems()]
+        for count, kind, name, seconds in sorted(names, reverse=True)[:top]:
+            DEBUG("PyDia.printStats", "{:>10} {:>9.3f}s {}.{}".format(count, seconds, kind, name))
+        callers = [(entry["count"], caller, entry["seconds"]) for caller, entry in stats["byCaller"].iteritems()]
+        for count, caller, seconds in sorted(callers, reverse=True)[:top]:
+            DEBUG("PyDia.printStats", "{:>10} {:>9.3f}s {}".format(count, seconds, caller))
+
+    def vtableLayout(self):
+        """Return the VtableLayout of the session (memoized vftables)"""
+        if self.vtableLayouts is None:
+            self.vtableLayouts = VtableLayout(self)
+        return self.vtableLayouts
+
+    def classHierarchy(self):
+        """Return the ClassHierarchy of the session (from the offline cache when the PDB has a GUID)"""
+        if self.classHierarchyIndex is None:
+            import pydiaindex, pydiacache
+            hierarchy = pydiaindex.ClassHierarchy()
+            if self.globalScope.guid:
+                hierarchy.loadOrBuild(self, pydiacache.OfflineCache(self))
+            else:
+                hierarchy.build(self)
+            self.classHierarchyIndex = hierarchy
+        return self.classHierarchyIndex
+
+    def typeUsages(self):
+        """Return the TypeUsageIndex of the session"""
+        if self.typeUsageIndex is None:
+            import pydiaindex
+            index = pydiaindex.TypeUsageIndex()
+            index.build(self)
+            self.typeUsageIndex = index
+        return self.typeUsageIndex
+
+    def ctypesModule(self):
+        """Return the module of ctypes classes of the session (from the offline cache when the PDB has a GUID)"""
+        if self.ctypesTypes is None:
+            import pydiactypes
+            if self.globalScope.guid:
+                self.ctypesTypes = pydiactypes.loadModule(self)
+            else:
+                self.ctypesTypes = pydiactypes.newModule(pydiactypes.CtypesGenerator(self).generate())
+        return self.ctypesTypes
+
+    def enumsModule(self):
+        """Return the module of IntEnum classes of the session (from the offline cache when the PDB has a GUID)"""
+        if self.enumTypes is None:
+            import pydiaenums
+            if self.globalScope.guid:
+                self.enumTypes = pydiaenums.loadModule(self)
+            else:
+                self.enumTypes = pydiaenums.newModule(pydiaenums.moduleSource(pydiaenums.extract(self), self.targetFilepath), "pydia_enums")
+        return self.enumTypes
+
+    def signatureTable(self):
+        """Return the pydiasignature.SignatureTable of the session, the function types are interned as they are used"""
+        if self.functionSignatures is None:
+            import pydiasignature
+            self.functionSignatures = pydiasignature.SignatureTable(self)
+        return self.functionSignatures
+
+    def sourceInventory(self):
+        """Return the pydiasource.SourceInventory of the session (from the offline cache when the PDB has a GUID)"""
+        if self.sourceFiles is None:
+            import pydiasource
+            self.sourceFiles = pydiasource.loadInventory(self)
+        return self.sourceFiles
+
+    def sizeReport(self):
+        """Return the pydiasize.SizeReport of the functions and static data of the session"""
+        if self.binarySizes is None:
+            import pydiasize
+            self.binarySizes = pydiasize.SizeReport(self).collect()
+        return self.binarySizes
+
+    def query(self, query):
+        """Yield the symbols that match a query text or pydiaquery.Query"""
+        import pydiaquery
+        if self.queryEngine is None:
+            self.queryEngine = pydiaquery.QueryEngine(self)
+        return self.queryEngine.execute(query)
 
     def findChildrenEx(self, symbol = None, symTag = SYMTAG.SymTagNull, name = None, flags = 0):
         """Return an iterator for all the children."""
@@ -2033,6 +2012,39 @@ class PyDia:
             DEBUG(context,child)
             DEBUG(context,child.QueryInterface(self.msdia.IDiaSymbol))
 
+    def printSources(self, pattern=None):
+        """Print the source files, or the compilands that include the files matching pattern"""
+        import pydiasource
+        inventory = self.sourceInventory()
+        lines = []
+        if pattern:
+            for fileId in inventory.find(pattern):
+                lines.append(inventory.files[fileId])
+                for symIndexId in inventory.includersOf(fileId):
+                    lines.append("\t{}".format(inventory.names[symIndexId]))
+            lines.append("{} translation units".format(len(inventory.translationUnits(pattern))))
+        else:
+            for fileId, path in sorted(inventory.files.iteritems()):
+                checksumType, checksum = inventory.checksums.get(fileId, (0, None))
+                lines.append("{:>6} {} {} {} ({} compilands)".format(
+                    fileId, pydiasource.CHECKSUM_name(checksumType)[8:], checksum or "-", path, len(inventory.includersOf(fileId))))
+        self._printLines(*lines)
+
+    def printSizes(self, by="compiland", count=20, depth=1):
+        """Print the biggest compilands, namespaces (scopes up to depth), sections or symbols"""
+        report = self.sizeReport()
+        rows = report.top(by, count, depth)
+        lines = ["{:>10} {:>8}  {}".format("bytes", report.countLabel(by), by)]
+        for key, size, n in rows:
+            lines.append("{:>10} {:>8}  {}".format(size, n, key))
+        self._printLines(*lines)
+
+    def writeSizeTreemap(self, filepath, by="namespace"):
+        """Write the sizes as a JSON tree of {"name", "size", "children"} (by namespace or compiland)"""
+        with open(filepath, "wb") as f:
+            json.dump(self.sizeReport().treemap(by), f)
+        self._print(filepath)
+
     def printDatas(self):
         children = self.findChildrenByTypeEx(SYMTAG.SymTagData)
         DEBUG("PyDia.printDatas", "len(children)", len(children))
@@ -2064,18 +2076,12 @@ class PyDia:
         #    for v in bytype[k]:
         #        DEBUG(k, v)
 
-    def printFunctionTypes(self):
-        children = self.findChildrenByTypeEx(SYMTAG.SymTagFunctionType)
-        DEBUG("PyDia.printFunctionTypes", "len(children)", len(children))
-        lines = []
-        for symbol in children:
-            functionType = DiaFunctionType(self, symbol)
-            s = functionType.declare()
-            #n = functionType.sizeof()
-            lines.append("")
-            lines.append(s)
-            #lines.append("sizeof({}) == {}".format(s,n))
-            #assert False, "<TODO PyDia.printFunctionTypes>"
+    def printFunctionTypes(self, count=0):
+        """Print the unique function signatures, the most used first"""
+        table = self.signatureTable().build()
+        lines = ["{:>6} {:>6}  {}".format("types", "funcs", "signature")]
+        for signature in table.top(count):
+            lines.append("{:>6} {:>6}  {}".format(signature.count, signature.functions, signature.declare()))
         self._printLines(*lines)
 
     def printUDTsByLength(self, length):
@@ -2140,6 +2146,177 @@ class PyDia:
             lines += UdtPrinter(self).defineVtableLines(symbol)
         self._printLines(*lines)
 
+    def printVtables(self):
+        """Define the vtables of all the classes"""
+        children = self.findChildrenByTypeEx(SYMTAG.SymTagUDT)
+        DEBUG("PyDia.printVtables", "len(children)", len(children))
+        lines = []
+        udtPrinter = UdtPrinter(self)
+        for symbol in children:
+            if symbol.udtKind != UDTKIND.UdtUnion and len(self.vtableLayout().vftables(symbol)) > 0:
+                lines += udtPrinter.defineVtableLines(symbol)
+        self._printLines(*lines)
+
+    def printAncestors(self, name):
+        """List the base classes of the classes with NAME, nearest first"""
+        hierarchy = self.classHierarchy()
+        lines = []
+        for i in hierarchy.find(name):
+            lines.append("{} // #{}".format(hierarchy.names[i], hierarchy.symIndexIds[i]))
+            for j in hierarchy.ancestors(i):
+                lines.append("\t{} // #{}".format(hierarchy.names[j], hierarchy.symIndexIds[j]))
+            for j in hierarchy.diamondBases(i):
+                lines.append("\t// diamond: {} is inherited through more than one path".format(hierarchy.names[j]))
+        self._printLines(*lines)
+
+    def printDescendants(self, name):
+        """List the classes that derive from the classes with NAME"""
+        hierarchy = self.classHierarchy()
+        lines = []
+        for i in hierarchy.find(name):
+            lines.append("{} // #{}".format(hierarchy.names[i], hierarchy.symIndexIds[i]))
+            for j in hierarchy.descendants(i):
+                lines.append("\t{} // #{}".format(hierarchy.names[j], hierarchy.symIndexIds[j]))
+        self._printLines(*lines)
+
+    def printCommonAncestors(self, name, other):
+        """List the lowest common base classes of the classes with NAME and the classes with OTHER"""
+        hierarchy = self.classHierarchy()
+        lines = []
+        for i in hierarchy.find(name):
+            for j in hierarchy.find(other):
+                lines.append("{} // #{} and {} // #{}".format(hierarchy.names[i], hierarchy.symIndexIds[i], hierarchy.names[j], hierarchy.symIndexIds[j]))
+                for k in hierarchy.lowestCommonAncestors(i, j):
+                    lines.append("\t{} // #{}".format(hierarchy.names[k], hierarchy.symIndexIds[k]))
+        self._printLines(*lines)
+
+    def printDiamonds(self):
+        """List the classes that inherit a base class through more than one path"""
+        hierarchy = self.classHierarchy()
+        lines = []
+        for i in hierarchy.diamonds():
+            bases = ", ".join([hierarchy.names[j] for j in hierarchy.diamondBases(i)])
+            lines.append("{} // #{} inherits {} more than once".format(hierarchy.names[i], hierarchy.symIndexIds[i], bases))
+        self._printLines(*lines)
+
+    def printLayouts(self, sortKey = "wasted", limit = 0):
+        """Table of the layout of all the UDTs, sorted by sortKey (descending, names ascending)"""
+        import pydialayout
+        summaries = [layout.summary() for layout in pydialayout.LayoutAnalyzer(self).layouts()]
+        summaries = pydialayout.sortSummaries(summaries, sortKey)
+        if limit > 0:
+            summaries = summaries[:limit]
+        self._printLines(*pydialayout.formatSummaries(summaries))
+
+    def printLayout(self, name):
+        """Layout of the UDTs with NAME (members, holes, padding and cachelines)"""
+        import pydialayout
+        children = self.findChildrenByNameEx(name, SYMTAG.SymTagUDT)
+        lines = []
+        for layout in pydialayout.LayoutAnalyzer(self).layouts(children):
+            lines += layout.lines()
+        self._printLines(*lines)
+
+    def printUsages(self, name):
+        """List the symbols that use the types with NAME"""
+        import pydiaindex
+        index = self.typeUsages()
+        lines = []
+        for symbol in self.findChildrenByNameEx(name):
+            if symbol.symTag not in (SYMTAG.SymTagUDT, SYMTAG.SymTagEnum, SYMTAG.SymTagTypedef):
+                continue
+            users = index.users(symbol.symIndexId)
+            lines.append("{} {} // #{} {} users".format(SYMTAG_name(symbol.symTag), symbol.name, symbol.symIndexId, len(users)))
+            for userId, usage in users:
+                user = self.symbolById(userId)
+                userName = user.name
+                if usage == pydiaindex.USAGE.UsageBase:
+                    userName = user.classParent.name # the derived class
+                elif usage == pydiaindex.USAGE.UsageMember and userName.find("::") == -1:
+                    userName = "{}::{}".format(user.classParent.name, userName)
+                lines.append("\t{:<12} {} // #{}".format(pydiaindex.USAGE_name(usage)[5:], userName, userId))
+        self._printLines(*lines)
+
+    def printCompilands(self, processes = 0):
+        """Compiler and symbol counts of each compiland, scanned in parallel (0=all cores)"""
+        import pydiascan
+        if self.targetFilepath == "<capture>":
+            processes = 1 # the workers can't open it
+        lines = []
+        for symIndexId, info in pydiascan.scanCompilands(self.targetFilepath, pydiascan.compilandSummary, processes or None, self, ordered=True):
+            lines.append("{} // #{} {} (front end {}, back end {}) functions={} statics={} locals={}".format(*((info[0], symIndexId) + info[1:])))
+        self._printLines(*lines)
+
+    def printDiff(self, otherFilepath):
+        """Types added, removed, renamed and changed in another target (or capture)"""
+        import pydiacapture, pydiadiff
+        other = pydiacapture.openSession(otherFilepath)
+        for line in pydiadiff.formatDiff(pydiadiff.TypeDiff(self, other).diff()):
+            self._printLines(line)
+
+    def exportJsonLines(self, filepath):
+        """Export the symbol graph to FILE as JSON Lines (resumes an interrupted export)"""
+        import pydiaexport
+        count = pydiaexport.exportFile(self, filepath)
+        self._print("{} symbols exported to {}".format(count, filepath))
+
+    def exportShards(self, directory, processes = 0):
+        """Export the symbol graph to DIRECTORY as one JSON Lines shard per compiland"""
+        import pydiaexport
+        if self.targetFilepath == "<capture>":
+            processes = 1 # the workers can't open it
+        for filepath, count in pydiaexport.exportShards(self.targetFilepath, directory, processes or None, self):
+            self._print("{} symbols exported to {}".format(count, filepath))
+
+    def writeHeaders(self, directory, shards = 1):
+        """Write the UDTs and enums to DIRECTORY as headers in dependency order, split in SHARDS files"""
+        import pydiaheader
+        for filepath in pydiaheader.HeaderGenerator(self).write(directory, shards):
+            self._print(filepath)
+
+    def writeCtypes(self, filepath):
+        """Write the ctypes classes of all the UDTs and enums to FILE"""
+        import io, pydiactypes
+        source = pydiactypes.CtypesGenerator(self).generate()
+        with io.open(filepath, "w", encoding="utf-8") as f:
+            f.write(source)
+        self._print(filepath)
+
+    def writeEnums(self, directory):
+        """Write all the enums to DIRECTORY as a python module of IntEnums (enums.py) and a JSON map (enums.json)"""
+        import io, pydiaenums
+        if self.globalScope.guid:
+            enums = pydiaenums.loadMap(self)
+        else:
+            enums = pydiaenums.extract(self)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filepath = os.path.join(directory, "enums.py")
+        with io.open(filepath, "w", encoding="utf-8") as f:
+            f.write(pydiaenums.moduleSource(enums, self.targetFilepath))
+        self._print(filepath)
+        filepath = os.path.join(directory, "enums.json")
+        with open(filepath, "wb") as f:
+            json.dump(enums, f, indent=1, sort_keys=True)
+        self._print(filepath)
+
+    def printQuery(self, text):
+        """Show the symbols that match a query (ex: udt where length == 46 and name ~ "^PACKET_" show define)"""
+        import pydiaquery
+        query = pydiaquery.Query(text)
+        for symbol in self.query(query):
+            self._printLines(*pydiaquery.showLines(self, query.show, symbol))
+
+    def validationReport(self):
+        """Return the pydiavalidate.ValidationReport of the invariants assumed by the printers (cached)"""
+        if self.invariantReport is None:
+            import pydiavalidate
+            self.invariantReport = pydiavalidate.loadReport(self)
+        return self.invariantReport
+
+    def printValidation(self):
+        self._printLines(*self.validationReport().lines())
+
     def printUDTs(self):
         children = self.findChildrenByTypeEx(SYMTAG.SymTagUDT)
         DEBUG("PyDia.printUDTs", "len(children)", len(children))
@@ -2230,7 +2407,7 @@ class PyDia:
             DEBUG("PyDia.printEnums", "skipped={}".format(skipped), "count={}".format(len(children)-skipped))
 
     def printBaseTypes(self):
-        children = self.findChildrenByTypeEx(self.msdia.SymTagBaseType)
+        children = self.findChildrenByTypeEx(SYMTAG.SymTagBaseType)
         DEBUG("PyDia.printBaseTypes", "len(children)", len(children))
         lines = []
         for symbol in children:
@@ -2241,7 +2418,7 @@ class PyDia:
             lines.append("sizeof({}) == {}".format(s,n))
         self._printLines(*lines)
 
-    def printSymTagCount(self, findByType):
+    def printSymTagCount(self, findByType=True):
         symbol = self.globalScope
         symTagName = {}
         symTagCount = {}
@@ -2278,38 +2455,155 @@ class PyDia:
         print ''.join(data),
 
 
-if __name__ == "__main__":
-    t = time.clock()
-    print "----- BEGIN -----\r\n",
-    #pydia = PyDia("../highpriest-2008-11-05/HighPriest.exe")
-    #pydia = PyDia("../client-twro-2004-03-09aSakexe/Sakexe_ep6.pdb")
-    pydia = PyDia("../inter-cro-2009-10-15/InterServer.exe")
-    #pydia = PyDia("../zone-cro-2009-07-03/ZoneProcess.exe")
-    #pydia = PyDia("../zone-cro-2009-09-21/ZoneProcess.exe")
-    #pydia = PyDia("D:/SHARE/-teste-/vc6/teste.exe")
-    #pydia = PyDia("D:/SHARE/-teste-/vc9/teste.exe")
+def parseBool(value):
+    value = value.strip().lower()
+    if value in ("1", "true", "yes", "on"): return True
+    if value in ("0", "false", "no", "off"): return False
+    raise ValueError("not a boolean: '{}'".format(value))
+
+CLI_COMMANDS = (
+    # (name, PyDia method, argument converters, description)
+    ("exe", "printExe", (), "attributes and metadata of the global scope"),
+    ("symTagCount", "printSymTagCount", (parseBool,), "count symbols by symTag (1=find by type, 0=find any, VERY SLOW)"),
+    ("baseTypes", "printBaseTypes", (), "declare all base types"),
+    ("enums", "printEnums", (parseBool,), "define all enums (1=skip nested)"),
+    ("children", "printChildrenByName", (unicode,), "debug the children with NAME"),
+    ("arrayTypes", "printArrayTypes", (), "declare all array types"),
+    ("pointerTypes", "printPointerTypes", (), "declare all pointer types"),
+    ("query", "printQuery", (unicode,), "show the symbols that match QUERY (see pydiaquery)"),
+    ("udts", "printUDTs", (), "define all UDTs"),
+    ("validate", "printValidation", (), "check the invariants assumed by the printers in one pass and report the violations"),
+    ("pyEnums", "writeEnums", (unicode,), "write all the enums to DIRECTORY as a python module of IntEnums and a JSON map"),
+    ("ctypes", "writeCtypes", (unicode,), "write the ctypes classes of all the UDTs and enums to FILE"),
+    ("headers", "writeHeaders", (unicode, int), "write the UDTs and enums to DIRECTORY as compilable headers, split in SHARDS files"),
+    ("udt", "printUDT", (unicode,), "define the UDTs with NAME (DiaUDT)"),
+    ("udt2", "printUDT2", (unicode,), "define the UDTs with NAME (UdtPrinter)"),
+    ("udtsByLength", "printUDTsByLength", (int,), "define the UDTs with LENGTH"),
+    ("vtable", "printVtable", (unicode,), "define the vtable of the UDTs with NAME"),
+    ("vtables", "printVtables", (), "define the vtables of all the classes"),
+    ("ancestors", "printAncestors", (unicode,), "list the base classes of the classes with NAME"),
+    ("descendants", "printDescendants", (unicode,), "list the classes derived from the classes with NAME"),
+    ("commonAncestors", "printCommonAncestors", (unicode, unicode), "list the lowest common base classes of the classes with NAME and OTHER"),
+    ("diamonds", "printDiamonds", (), "list the classes that inherit a base class more than once"),
+    ("layouts", "printLayouts", (str, int), "table of the layout of all the UDTs (sort by KEY, show LIMIT rows)"),
+    ("layout", "printLayout", (unicode,), "holes, padding and cachelines of the UDTs with NAME"),
+    ("usages", "printUsages", (unicode,), "list the functions, data, members and typedefs that use the types with NAME"),
+    ("diff", "printDiff", (unicode,), "types added, removed, renamed and changed in the OTHER target (or capture)"),
+    ("export", "exportJsonLines", (unicode,), "export the symbol graph to FILE as JSON Lines (resumable)"),
+    ("exportShards", "exportShards", (unicode, int), "export the symbol graph to DIRECTORY, one shard per compiland (PROCESSES, 0=all cores)"),
+    ("compilands", "printCompilands", (int,), "compiler and symbol counts of each compiland (scanned by PROCESSES, 0=all cores)"),
+    ("functionTypes", "printFunctionTypes", (int,), "unique function signatures with the number of function types and functions (show COUNT, 0=all)"),
+    ("datas", "printDatas", (), "define the data symbols"),
+    ("sources", "printSources", (unicode,), "source files with their checksums, or the compilands that include the files matching PATTERN"),
+    ("sizes", "printSizes", (str, int, int), "biggest compilands, namespaces, sections or symbols (BY, COUNT, namespace DEPTH)"),
+    ("sizeTreemap", "writeSizeTreemap", (unicode, str), "write the sizes to FILE as a JSON treemap (BY namespace or compiland)"),
+    ("session", "printSession", (), "debug the session tables and source files"),
+    )
+
+def parseCommand(text):
+    """Parse "NAME[:ARG[,ARG...]]" into (name, method, args); the last argument keeps the commas"""
+    name, sep, args = text.strip().partition(":")
+    for command in CLI_COMMANDS:
+        if command[0].lower() == name.lower():
+            break
+    else:
+        raise ValueError("unknown command '{}'".format(name))
+    name, method, converters, description = command
+    args = args and args.split(",", max(len(converters) - 1, 0)) or []
+    if len(args) > len(converters):
+        raise ValueError("too many arguments in '{}'".format(text))
+    return (name, method, [convert(arg) for convert, arg in zip(converters, args)])
+
+COMMAND_COMMENT = re.compile(r"(^|\s)#.*")
+
+def readCommands(filepath):
+    """Return the commands in a file (one per line, # at the start or after a space starts a comment)"""
+    commands = []
+    f = open(filepath, "r")
     try:
-        #pydia.printExe()
-        #pydia.printSymTagCount(True)#find by type
-        #pydia.printSymTagCount(False)#find any (VERY SLOW!!! finds more symbol types)
-        #pydia.printBaseTypes()
-        #pydia.printEnums(True)#skip nested
-        #pydia.printEnums(False)#all
-        # TODO
-        #pydia.printChildrenByName("CODBC")
-        #pydia.printArrayTypes()
-        #pydia.printPointerTypes()
-        #pydia.printUDTs()
-        #pydia.printUDT("PACKET_ZI_CHAT_PARTY")
-        pydia.printUDT2("CNpc")
-        #pydia.printVtable("CPc")
-        #pydia.printUDTsByLength(46)
-        #pydia.printFunctionTypes()
-        # TODO
-        #pydia.printDatas()
-        #pydia.printSession()
+        for line in f:
+            line = COMMAND_COMMENT.sub("", line).strip()
+            if line:
+                commands.append(line)
     finally:
-        del pydia
-    print "----- END -----\r\n",
-    t = time.clock() - t
-    print "{}\r\n".format(t),
+        f.close()
+    return commands
+
+def commandFilename(index, text):
+    name = "".join([c if c.isalnum() or c in "-_." else "_" for c in text.replace(":", "-")])
+    return "{:03d}-{}.txt".format(index + 1, name)
+
+def main(argv=None):
+    """Run a batch of commands on one session, each with its own output file."""
+    import argparse
+    import traceback
+    import pydiacapture
+    epilog = ["commands (NAME[:ARG[,ARG...]]):"]
+    for name, method, converters, description in CLI_COMMANDS:
+        epilog.append("  {:<14} {}".format(name, description))
+    parser = argparse.ArgumentParser(description="Explore the debug symbols of a target with MSDIA.",
+                                     epilog="\n".join(epilog), formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", help=".pdb/.exe/.dll or {} capture".format(pydiacapture.CAPTURE_EXTENSION))
+    parser.add_argument("commands", nargs="*", metavar="COMMAND", help="command to run (see below)")
+    parser.add_argument("-f", "--file", action="append", default=[], help="read commands from FILE (one per line, # comments)")
+    parser.add_argument("-o", "--output", default=".", help="directory of the output files, - for stdout (default %(default)s)")
+    parser.add_argument("--stats", metavar="FILE", help="instrument the session and dump the symbol traffic to a JSON FILE")
+    args, extra = parser.parse_known_args(argv) # commands can follow the options
+    for arg in extra:
+        if arg.startswith("-"):
+            parser.error("unrecognized arguments: {}".format(arg))
+
+    texts = list(args.commands) + extra
+    for filepath in args.file:
+        texts += readCommands(filepath)
+    if not texts:
+        parser.error("no commands")
+    try:
+        commands = [(text,) + parseCommand(text) for text in texts]
+    except ValueError, e:
+        parser.error(str(e))
+
+    if args.output != "-" and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    stdout = sys.stdout
+    t = timeit.default_timer()
+    session = pydiacapture.openSession(args.target)
+    timings = [("<open>", timeit.default_timer() - t, "ok", None)]
+    if args.stats:
+        session.instrument()
+    try:
+        for index, (text, name, method, params) in enumerate(commands):
+            filepath = None
+            output = stdout
+            t = timeit.default_timer()
+            try:
+                if args.output != "-":
+                    filepath = os.path.join(args.output, commandFilename(index, text))
+                    output = open(filepath, "w")
+                sys.stdout = output # DEBUG and _printLines
+                getattr(session, method)(*params)
+                status = "ok"
+            except Exception:
+                traceback.print_exc(file=output)
+                status = "FAILED"
+            t = timeit.default_timer() - t
+            sys.stdout = stdout
+            if output is not stdout:
+                output.close()
+            timings.append((text, t, status, filepath))
+            DEBUG("pydia", "{:>9.3f}s {:<6} {} {}".format(t, status, text, filepath or ""))
+    finally:
+        sys.stdout = stdout
+        if args.stats:
+            session.dumpStats(args.stats)
+        del session
+    DEBUG("pydia", "----- timings -----")
+    for text, t, status, filepath in timings:
+        DEBUG("pydia", "{:>9.3f}s {:<6} {}".format(t, status, text))
+    DEBUG("pydia", "{:>9.3f}s total".format(sum([timing[1] for timing in timings])))
+    return len([timing for timing in timings if timing[2] != "ok"]) and 1 or 0
+
+
+if __name__ == "__main__":
+    import pydia # run in the module that pydiacapture and friends import
+    sys.exit(pydia.main())
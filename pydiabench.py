@@ -0,0 +1,326 @@
+"""
+Benchmarks for the printer hot paths.
+
+The printers run against a replayed capture (see pydiacapture), either a
+synthetic symbol graph of configurable size or a capture file, so this runs
+on linux and regressions show up before deployment.
+
+Reported per benchmark:
+    ops/sec    - root symbols (or calls) processed per second
+    reads/op   - IDiaSymbol attribute reads per op
+    enums/op   - findChildrenEx calls per op
+    syms/op    - distinct symbols touched per op
+    peak KB    - peak resident memory of the process (when available)
+"""
+import argparse
+import sys
+import timeit
+import pydia
+import pydiacapture
+from pydia import SYMTAG, BASICTYPE, DATAKIND, LOCATIONTYPE, UDTKIND, CVACCESS, CVCALL
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+
+def peakMemoryKB():
+    """Return the peak resident memory of the process in KB or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024 # bytes
+    return peak
+
+
+class NullOutput:
+    """I discard everything written to me."""
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+#---------------------------------------------------------------------------
+
+class SyntheticGraph:
+    """I build a Capture that looks like the type information of a C++ program.
+    Classes form inheritance chains of `depth` classes with virtual functions,
+    data members (base types, pointers and arrays) and member functions with
+    parameters; enums have `enumerators` constants."""
+
+    def __init__(self, udts=200, enums=50, members=10, functions=10, enumerators=20, depth=4):
+        self.udts = udts
+        self.enums = enums
+        self.members = members
+        self.functions = functions
+        self.enumerators = enumerators
+        self.depth = max(1, depth)
+        self.nextId = 1
+        self.capture = None
+
+    def newId(self):
+        symIndexId = self.nextId
+        self.nextId += 1
+        return symIndexId
+
+    def add(self, symTag, values, children=()):
+        symIndexId = self.newId()
+        values.setdefault("lexicalParent", self.exe)
+        self.capture.add(symIndexId, symTag, values, children)
+        return symIndexId
+
+    def baseType(self, baseType, length):
+        return self.add(SYMTAG.SymTagBaseType, dict(baseType=baseType, length=length))
+
+    def build(self):
+        """Return the Capture"""
+        self.capture = pydiacapture.Capture()
+        self.exe = self.newId()
+        self.capture.add(self.exe, SYMTAG.SymTagExe, dict(name=u"synthetic", age=1, machineType=0x014c), [])
+        globalChildren = []
+        self.intType = self.baseType(BASICTYPE.btInt, 4)
+        self.charType = self.baseType(BASICTYPE.btChar, 1)
+        self.indexType = self.baseType(BASICTYPE.btULong, 4)
+        self.voidType = self.baseType(BASICTYPE.btVoid, 0)
+        globalChildren += [self.intType, self.charType, self.indexType, self.voidType]
+        for i in xrange(self.enums):
+            globalChildren += self.buildEnum("E_SYNTHETIC_{}".format(i))
+        previous = None
+        for i in xrange(self.udts):
+            if i % self.depth == 0:
+                previous = None
+            previous = self.buildClass("CSynthetic{}".format(i), previous)
+            globalChildren += previous["globals"]
+        self.capture.setChildren(self.exe, globalChildren)
+        return self.capture
+
+    def buildEnum(self, name):
+        enum = self.newId()
+        constants = []
+        for i in xrange(self.enumerators):
+            constants.append(self.add(SYMTAG.SymTagData, dict(
+                name=u"{}_{}".format(name, i), value=i - 1, dataKind=DATAKIND.DataIsConstant,
+                locationType=LOCATIONTYPE.LocIsConstant, type=self.intType, classParent=enum)))
+        self.capture.add(enum, SYMTAG.SymTagEnum, dict(name=unicode(name), baseType=BASICTYPE.btInt,
+            length=4, type=self.intType, lexicalParent=self.exe), constants)
+        return [enum] + constants
+
+    def buildClass(self, name, base):
+        udt = self.newId()
+        children = []
+        globals = [udt]
+        length = 0
+        pointer = self.add(SYMTAG.SymTagPointerType, dict(length=4, type=udt))
+        globals.append(pointer)
+        if base is None:
+            shape = self.add(SYMTAG.SymTagVTableShape, dict(count=self.functions))
+            vtablePointer = self.add(SYMTAG.SymTagPointerType, dict(length=4, type=shape))
+            children.append(self.add(SYMTAG.SymTagVTable, dict(type=vtablePointer, classParent=udt)))
+            globals += [shape, vtablePointer]
+            length = 4
+        else:
+            children.append(self.add(SYMTAG.SymTagBaseClass, dict(
+                name=base["name"], access=CVACCESS.CV_public, type=base["id"], classParent=udt,
+                udtKind=UDTKIND.UdtClass, length=base["length"], offset=0), base["children"]))
+            length = base["length"]
+        for i in xrange(self.members):
+            kind = i % 3
+            if kind == 0:
+                memberType, memberLength = self.intType, 4
+            elif kind == 1:
+                memberType, memberLength = base and base["pointer"] or pointer, 4
+            else:
+                memberType = self.add(SYMTAG.SymTagArrayType, dict(
+                    arrayIndexType=self.indexType, type=self.charType, count=16, length=16))
+                globals.append(memberType)
+                memberLength = 16
+            children.append(self.add(SYMTAG.SymTagData, dict(
+                name=u"{}::m_member{}".format(name, i), dataKind=DATAKIND.DataIsMember,
+                locationType=LOCATIONTYPE.LocIsThisRel, offset=length, access=CVACCESS.CV_private,
+                type=memberType, classParent=udt)))
+            length += memberLength
+        for i in xrange(self.functions):
+            functionName = "Func{}".format(i)
+            virtual = base is None or i % 2 == 0 # derived classes override half of the slots
+            params = [self.add(SYMTAG.SymTagFunctionArgType, dict(type=self.intType, classParent=udt))
+                      for j in xrange(i % 3)]
+            functionType = self.add(SYMTAG.SymTagFunctionType, dict(
+                callingConvention=CVCALL.CV_CALL_THISCALL, type=self.intType, classParent=udt,
+                objectPointerType=pointer, count=len(params)), params)
+            paramData = [self.add(SYMTAG.SymTagData, dict(
+                name=u"arg{}".format(j), dataKind=DATAKIND.DataIsParam, type=self.intType))
+                for j in xrange(len(params))]
+            undecoratedName = u"public: {}int __thiscall {}::{}({})".format(
+                virtual and "virtual " or "", name, functionName, ",".join(["int"] * len(params)) or "void")
+            function = self.add(SYMTAG.SymTagFunction, dict(
+                name=u"{}::{}".format(name, functionName), undecoratedName=undecoratedName,
+                access=CVACCESS.CV_public, virtual=int(virtual), intro=int(virtual and base is None),
+                virtualBaseOffset=virtual and 4 * i or 0, locationType=LOCATIONTYPE.LocIsStatic,
+                type=functionType, classParent=udt, length=16 + i), paramData)
+            children.append(function)
+            globals += params + [functionType, function]
+        self.capture.add(udt, SYMTAG.SymTagUDT, dict(name=unicode(name), udtKind=UDTKIND.UdtClass,
+            length=length, lexicalParent=self.exe), children)
+        return dict(id=udt, name=unicode(name), length=length, children=children, pointer=pointer, globals=globals)
+
+
+#---------------------------------------------------------------------------
+
+class CountingReplaySymbol(pydiacapture.ReplaySymbol):
+    """ReplaySymbol that counts the attribute reads and enumerations in the session."""
+    __slots__ = ()
+
+    def __getattribute__(self, attr):
+        session = object.__getattribute__(self, "session")
+        if attr in session.countedNames:
+            session.reads += 1
+            session.touched.add(object.__getattribute__(self, "symIndexId"))
+        elif attr == "findChildrenEx":
+            session.enumerations += 1
+        return object.__getattribute__(self, attr)
+
+    def __getattr__(self, attr):
+        return pydiacapture.ReplaySymbol.__getattr__(self, attr)
+
+
+class CountingReplaySession(pydiacapture.ReplaySession):
+    symbolClass = CountingReplaySymbol
+
+    def __init__(self, capture):
+        self.countedNames = frozenset(pydiacapture.captureAttributes() + pydiacapture.KEY_ATTRIBUTES)
+        self.reset()
+        pydiacapture.ReplaySession.__init__(self, capture)
+
+    def reset(self):
+        self.reads = 0
+        self.enumerations = 0
+        self.touched = set()
+
+
+class CountingPyDia(pydiacapture.PyDiaReplay):
+    sessionClass = CountingReplaySession
+
+
+#---------------------------------------------------------------------------
+
+class Benchmark:
+    """A printer hot path.
+    roots(pydia) returns the symbols of one pass and run(pydia, symbol) is one op."""
+
+    def __init__(self, name, symTag, run, filter=None):
+        self.name = name
+        self.symTag = symTag
+        self.run = run
+        self.filter = filter
+
+    def roots(self, pydia):
+        if self.symTag is None:
+            return [None]
+        roots = list(pydia.findChildrenByTypeEx(self.symTag))
+        if self.filter:
+            roots = [root for root in roots if self.filter(root)]
+        return roots
+
+
+def _hasVtable(symbol):
+    return symbol.udtKind == UDTKIND.UdtClass
+
+BENCHMARKS = [
+    Benchmark("EnumPrinter.defineLines", SYMTAG.SymTagEnum,
+              lambda p, s: pydia.EnumPrinter(p).defineLines(s)),
+    Benchmark("UdtPrinter.defineLines", SYMTAG.SymTagUDT,
+              lambda p, s: pydia.UdtPrinter(p).defineLines(s)),
+    Benchmark("UdtPrinter.defineLines(showHooks)", SYMTAG.SymTagUDT,
+              lambda p, s: pydia.UdtPrinter(p, showHooks=True).defineLines(s)),
+    Benchmark("UdtPrinter.defineVtableLines", SYMTAG.SymTagUDT,
+              lambda p, s: pydia.UdtPrinter(p).defineVtableLines(s), _hasVtable),
+    Benchmark("TypePrinter.declareFunctionType", SYMTAG.SymTagFunctionType,
+              lambda p, s: pydia.TypePrinter(p, name="f").declareFunctionType(s)),
+    Benchmark("PyDia.printSymTagCount(True)", None,
+              lambda p, s: p.printSymTagCount(True)),
+    Benchmark("PyDia.printSymTagCount(False)", None,
+              lambda p, s: p.printSymTagCount(False)),
+    ]
+
+
+def runBenchmark(benchmark, capture, repeat=3):
+    """Return a dict with the results of a benchmark"""
+    stdout = sys.stdout
+    sys.stdout = NullOutput() # DEBUG and _printLines
+    try:
+        # counting pass
+        counting = CountingPyDia(capture)
+        roots = benchmark.roots(counting)
+        counting.session.reset()
+        for root in roots:
+            benchmark.run(counting, root)
+        session = counting.session
+        ops = len(roots)
+        result = dict(name=benchmark.name, ops=ops,
+                      reads=float(session.reads) / max(ops, 1),
+                      enumerations=float(session.enumerations) / max(ops, 1),
+                      touched=float(len(session.touched)) / max(ops, 1))
+        del counting, session
+        # timed passes
+        replay = pydiacapture.PyDiaReplay(capture)
+        roots = benchmark.roots(replay)
+        best = None
+        for i in xrange(repeat):
+            t = timeit.default_timer()
+            for root in roots:
+                benchmark.run(replay, root)
+            t = timeit.default_timer() - t
+            if best is None or t < best:
+                best = t
+        result["seconds"] = best
+        result["opsPerSec"] = best and ops / best or float("inf")
+        result["peakKB"] = peakMemoryKB()
+    finally:
+        sys.stdout = stdout
+    return result
+
+
+def formatResults(results):
+    lines = ["{:<36} {:>7} {:>12} {:>9} {:>9} {:>8} {:>9}".format(
+        "benchmark", "ops", "ops/sec", "reads/op", "enums/op", "syms/op", "peak KB")]
+    for r in results:
+        lines.append("{:<36} {:>7} {:>12.1f} {:>9.1f} {:>9.1f} {:>8.1f} {:>9}".format(
+            r["name"], r["ops"], r["opsPerSec"], r["reads"], r["enumerations"], r["touched"],
+            r["peakKB"] if r["peakKB"] is not None else "-"))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pydia printers against a replayed capture.")
+    parser.add_argument("--capture", help="use a capture file instead of a synthetic graph")
+    parser.add_argument("--udts", type=int, default=200, help="synthetic classes (default %(default)s)")
+    parser.add_argument("--enums", type=int, default=50, help="synthetic enums (default %(default)s)")
+    parser.add_argument("--members", type=int, default=10, help="data members per class (default %(default)s)")
+    parser.add_argument("--functions", type=int, default=10, help="member functions per class (default %(default)s)")
+    parser.add_argument("--enumerators", type=int, default=20, help="constants per enum (default %(default)s)")
+    parser.add_argument("--depth", type=int, default=4, help="length of the inheritance chains (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes, the best is reported (default %(default)s)")
+    parser.add_argument("benchmarks", nargs="*", help="substrings of the benchmarks to run (default all)")
+    args = parser.parse_args(argv)
+
+    if args.capture:
+        capture = pydiacapture.Capture.load(args.capture)
+    else:
+        capture = SyntheticGraph(args.udts, args.enums, args.members, args.functions,
+                                 args.enumerators, args.depth).build()
+    benchmarks = [b for b in BENCHMARKS if not args.benchmarks or [s for s in args.benchmarks if s in b.name]]
+    results = []
+    print formatResults(results)[0] + "\r\n",
+    for benchmark in benchmarks:
+        results.append(runBenchmark(benchmark, capture, args.repeat))
+        print formatResults(results[-1:])[-1] + "\r\n",
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Offline cache of data derived from a session.
+
+Entries are files in a directory per program database, keyed by the PDB GUID
+and age of the global scope, so they stay valid for as long as the PDB does.
+The directory is PYDIA_CACHE or ~/.pydia/cache.
+"""
+import json
+import os
+import tempfile
+from pydia import DEBUG
+
+
+CACHE_ENVIRONMENT = "PYDIA_CACHE"
+
+def defaultDirectory():
+    directory = os.environ.get(CACHE_ENVIRONMENT)
+    if not directory:
+        directory = os.path.join(os.path.expanduser("~"), ".pydia", "cache")
+    return directory
+
+def sessionKey(pydia):
+    """Return "GUID-age" of the program database of the session"""
+    globalScope = pydia.globalScope
+    guid = str(globalScope.guid or "").strip("{}").upper()
+    assert guid, "the global scope has no GUID"
+    return "{}-{}".format(guid, globalScope.age)
+
+
+class OfflineCache:
+    """I store named entries of a session on disk."""
+
+    def __init__(self, pydia, directory=None):
+        self.key = sessionKey(pydia)
+        self.directory = os.path.join(directory or defaultDirectory(), self.key)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self, name):
+        """Return the data of an entry or None"""
+        try:
+            with open(self.path(name), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def save(self, name, data):
+        """Write an entry (atomically, concurrent readers see the old or the new data)"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if os.path.exists(self.path(name)):
+                os.remove(self.path(name)) # windows can't rename over a file
+            os.rename(tmp, self.path(name))
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        DEBUG("OfflineCache.save", self.path(name), "{} bytes".format(len(data)))
+
+    def loadJSON(self, name):
+        data = self.load(name)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            DEBUG("OfflineCache.loadJSON", "ignoring corrupt entry", self.path(name))
+            return None
+
+    def saveJSON(self, name, value):
+        self.save(name, json.dumps(value, sort_keys=True))
@@ -0,0 +1,572 @@
+"""
+Record/replay of IDiaSymbol graphs.
+
+A capture holds the attributes and the child list of every recorded symbol.
+It is saved in a compact binary file (string table, varint encoded ids) and
+replayed with objects that imitate IDiaSymbol/IDiaEnumSymbols, so the printers
+and the GUI run without MSDIA (ex: linux).
+
+File format (all integers are unsigned varints unless noted):
+    magic "PYDIACAP", version byte
+    strings: count, then (length, utf-8 bytes) for each string
+    attributes: count, then the string id of each attribute name
+    globalScope symIndexId
+    symbols: count, then for each symbol
+        symIndexId, symTag
+        values: count, then (attribute index, kind byte, payload) for each value
+        children: 0 if not captured, otherwise count+1 followed by zigzag deltas of the symIndexIds
+"""
+import fnmatch
+import re
+import struct
+import sys
+import pydia
+from pydia import SYMTAG, ATTRKIND, NameSearchOptions, COMError, DEBUG
+
+
+CAPTURE_MAGIC = "PYDIACAP"
+CAPTURE_VERSION = 1
+CAPTURE_EXTENSION = ".pydiacap"
+
+# attributes with a IDiaSymbol value (stored as a symIndexId)
+SYMBOL_ATTRIBUTES = pydia.attributesOfKind(ATTRKIND.AttrSymbol)
+# attributes with the symIndexId of a symbol attribute
+SYMBOL_ID_ATTRIBUTES = dict([(attr + "Id", attr) for attr in SYMBOL_ATTRIBUTES if attr + "Id" in pydia.SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull]])
+# attributes with a BSTR value
+STRING_ATTRIBUTES = pydia.attributesOfKind(ATTRKIND.AttrString)
+# attributes with a GUID value
+GUID_ATTRIBUTES = pydia.attributesOfKind(ATTRKIND.AttrGuid)
+# attributes that are always recorded (stored in the symbol record)
+KEY_ATTRIBUTES = ("symIndexId","symTag")
+
+# value kinds in the file
+VALUE_NONE = 0
+VALUE_INT = 1 # zigzag
+VALUE_STRING = 2 # string id
+VALUE_SYMBOL = 3 # symIndexId
+VALUE_GUID = 4 # string id
+VALUE_FLOAT = 5 # little-endian double
+VALUE_ERROR = 6 # zigzag hresult, string id
+
+# symbols whose children are only recorded when they are roots or reached as children (whole-program lists)
+SHALLOW_SYMTAGS = (SYMTAG.SymTagExe, SYMTAG.SymTagCompiland)
+
+
+def captureAttributes():
+    """Return the names of the recorded attributes"""
+    return tuple([attr for attr in pydia.SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull] if attr not in KEY_ATTRIBUTES])
+
+def attributeDefault(attr):
+    """Return the value of an attribute that was not stored"""
+    if pydia.attributeKind(attr) != ATTRKIND.AttrScalar or attr == "value":
+        return None
+    return 0
+
+
+class CapturedError(object):
+    """A COMError raised while recording an attribute."""
+    __slots__ = ("hresult", "text")
+
+    def __init__(self, hresult, text):
+        self.hresult = hresult
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, CapturedError) and (self.hresult, self.text) == (other.hresult, other.text)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def exception(self):
+        return COMError(self.hresult, self.text, None)
+
+
+class Capture:
+    """In-memory symbol graph.
+    records maps symIndexId to [symTag, values, children], where values only has
+    the attributes that differ from attributeDefault and children is a list of
+    symIndexIds or None when the children were not captured."""
+    globalScopeId = None
+    records = None
+
+    def __init__(self, globalScopeId=None):
+        self.globalScopeId = globalScopeId
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, symIndexId):
+        return symIndexId in self.records
+
+    def add(self, symIndexId, symTag, values=None, children=None):
+        """Add a symbol. Symbol attributes have symIndexId values.
+        Missing *Id attributes are derived from the symbol attributes."""
+        values = dict([(attr, value) for attr, value in (values or {}).iteritems() if value != attributeDefault(attr)])
+        for idAttr, attr in SYMBOL_ID_ATTRIBUTES.iteritems():
+            if idAttr not in values and isinstance(values.get(attr), (int, long)):
+                values[idAttr] = values[attr]
+        if children is not None:
+            children = list(children)
+        self.records[symIndexId] = [symTag, values, children]
+        if self.globalScopeId is None and symTag == SYMTAG.SymTagExe:
+            self.globalScopeId = symIndexId
+
+    def setChildren(self, symIndexId, children):
+        self.records[symIndexId][2] = list(children)
+
+    def save(self, filepath):
+        f = open(filepath, "wb")
+        try:
+            f.write(CaptureWriter(self).encode())
+        finally:
+            f.close()
+
+    @staticmethod
+    def load(filepath):
+        f = open(filepath, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        return CaptureReader(data).decode()
+
+
+#---------------------------------------------------------------------------
+
+def _writeVarint(buf, n):
+    assert n >= 0
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def _zigzag(n):
+    if n < 0:
+        return ((-n) << 1) - 1
+    return n << 1
+
+def _unzigzag(n):
+    if n & 1:
+        return -((n + 1) >> 1)
+    return n >> 1
+
+
+class CaptureWriter:
+    """I encode a Capture into the binary format."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.strings = {}
+        self.stringList = []
+
+    def stringId(self, s):
+        if isinstance(s, str):
+            s = s.decode("utf-8")
+        try:
+            return self.strings[s]
+        except KeyError:
+            n = self.strings[s] = len(self.stringList)
+            self.stringList.append(s)
+            return n
+
+    def encodeValue(self, buf, attr, value):
+        if isinstance(value, CapturedError):
+            buf.append(VALUE_ERROR)
+            _writeVarint(buf, _zigzag(value.hresult or 0))
+            _writeVarint(buf, self.stringId(unicode(value.text)))
+        elif value is None:
+            buf.append(VALUE_NONE)
+        elif attr in SYMBOL_ATTRIBUTES:
+            buf.append(VALUE_SYMBOL)
+            _writeVarint(buf, value)
+        elif attr in GUID_ATTRIBUTES:
+            buf.append(VALUE_GUID)
+            _writeVarint(buf, self.stringId(unicode(value)))
+        elif isinstance(value, (bool, int, long)):
+            buf.append(VALUE_INT)
+            _writeVarint(buf, _zigzag(int(value)))
+        elif isinstance(value, float):
+            buf.append(VALUE_FLOAT)
+            buf.extend(struct.pack("<d", value))
+        elif isinstance(value, basestring):
+            buf.append(VALUE_STRING)
+            _writeVarint(buf, self.stringId(value))
+        else: # unknown VARIANT content
+            buf.append(VALUE_STRING)
+            _writeVarint(buf, self.stringId(unicode(value)))
+
+    def encode(self):
+        capture = self.capture
+        attributes = list(captureAttributes())
+        extra = set()
+        for symTag, values, children in capture.records.itervalues():
+            extra.update(values.keys())
+        attributes += sorted(extra.difference(attributes))
+        attrIndex = dict([(attr, i) for i, attr in enumerate(attributes)])
+        body = bytearray()
+        _writeVarint(body, len(attributes))
+        for attr in attributes:
+            _writeVarint(body, self.stringId(attr))
+        _writeVarint(body, capture.globalScopeId or 0)
+        _writeVarint(body, len(capture.records))
+        for symIndexId in sorted(capture.records):
+            symTag, values, children = capture.records[symIndexId]
+            _writeVarint(body, symIndexId)
+            _writeVarint(body, symTag)
+            _writeVarint(body, len(values))
+            for attr in sorted(values, key=attrIndex.get):
+                _writeVarint(body, attrIndex[attr])
+                self.encodeValue(body, attr, values[attr])
+            if children is None:
+                _writeVarint(body, 0)
+            else:
+                _writeVarint(body, len(children) + 1)
+                previous = 0
+                for child in children:
+                    _writeVarint(body, _zigzag(child - previous))
+                    previous = child
+        head = bytearray(CAPTURE_MAGIC)
+        head.append(CAPTURE_VERSION)
+        _writeVarint(head, len(self.stringList))
+        for s in self.stringList:
+            data = s.encode("utf-8")
+            _writeVarint(head, len(data))
+            head.extend(data)
+        return str(head + body)
+
+
+class CaptureReader:
+    """I decode the binary format into a Capture."""
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.pos = 0
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        b = data[pos]
+        pos += 1
+        n = b & 0x7F
+        shift = 7
+        while b & 0x80:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            shift += 7
+        self.pos = pos
+        return n
+
+    def decode(self):
+        data = self.data
+        magic = str(data[:len(CAPTURE_MAGIC)])
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("not a pydia capture (magic={!r})".format(magic))
+        version = data[len(CAPTURE_MAGIC)]
+        if version != CAPTURE_VERSION:
+            raise ValueError("unsupported capture version {}".format(version))
+        self.pos = len(CAPTURE_MAGIC) + 1
+        varint = self.varint
+        strings = []
+        for i in xrange(varint()):
+            n = varint()
+            strings.append(str(data[self.pos:self.pos + n]).decode("utf-8"))
+            self.pos += n
+        attributes = [str(strings[varint()]) for i in xrange(varint())]
+        symbolAttributes = frozenset(SYMBOL_ATTRIBUTES)
+        guid = comtypesGUID()
+        capture = Capture(varint() or None)
+        records = capture.records
+        for i in xrange(varint()):
+            symIndexId = varint()
+            symTag = varint()
+            values = {}
+            for j in xrange(varint()):
+                attr = attributes[varint()]
+                kind = data[self.pos]
+                self.pos += 1
+                if kind == VALUE_NONE:
+                    value = None
+                elif kind == VALUE_INT:
+                    value = _unzigzag(varint())
+                elif kind == VALUE_STRING:
+                    value = strings[varint()]
+                elif kind == VALUE_SYMBOL:
+                    value = varint()
+                elif kind == VALUE_GUID:
+                    value = guid(strings[varint()])
+                elif kind == VALUE_FLOAT:
+                    value = struct.unpack("<d", str(data[self.pos:self.pos + 8]))[0]
+                    self.pos += 8
+                elif kind == VALUE_ERROR:
+                    hresult = _unzigzag(varint())
+                    value = CapturedError(hresult, strings[varint()])
+                else:
+                    raise ValueError("unknown value kind {} at offset {}".format(kind, self.pos - 1))
+                values[attr] = value
+            n = varint()
+            if n == 0:
+                children = None
+            else:
+                children = []
+                previous = 0
+                for j in xrange(n - 1):
+                    previous += _unzigzag(varint())
+                    children.append(previous)
+            records[symIndexId] = [symTag, values, children]
+        return capture
+
+
+def comtypesGUID():
+    """Return the constructor of replayed GUID values"""
+    if pydia.comtypes is not None:
+        return pydia.comtypes.GUID
+    return unicode
+
+
+#---------------------------------------------------------------------------
+
+class SymbolRecorder:
+    """I walk the symbols of a PyDia session and record them into a Capture.
+    Children are recorded for the roots and everything reached from them,
+    except for SHALLOW_SYMTAGS reached through an attribute (ex: lexicalParent)."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.attributes = captureAttributes()
+        self.capture = None
+
+    def recordValue(self, symbol, attr):
+        try:
+            value = getattr(symbol, attr)
+        except COMError, e:
+            return CapturedError(getattr(e, "hresult", None), getattr(e, "text", None) or str(e)), None
+        if attr in SYMBOL_ATTRIBUTES:
+            if not value: # NULL pointer
+                return None, None
+            return value.symIndexId, value
+        if attr in GUID_ATTRIBUTES:
+            if not value:
+                return None, None
+            return unicode(value), None
+        return value, None
+
+    def record(self, roots=None):
+        """Record the symbols reachable from roots (default is the global scope).
+        Return the Capture."""
+        if roots is None:
+            roots = [self.pydia.globalScope]
+        capture = Capture(self.pydia.globalScope.symIndexId)
+        self.capture = capture
+        walked = set()
+        pending = [(root, True) for root in roots]
+        while pending:
+            symbol, walkChildren = pending.pop()
+            symIndexId = symbol.symIndexId
+            if symIndexId not in capture:
+                symTag = symbol.symTag
+                values = {}
+                for attr in self.attributes:
+                    value, valueSymbol = self.recordValue(symbol, attr)
+                    values[attr] = value
+                    if valueSymbol is not None and value not in capture:
+                        pending.append((valueSymbol, valueSymbol.symTag not in SHALLOW_SYMTAGS))
+                capture.add(symIndexId, symTag, values)
+                if len(capture) % 10000 == 0:
+                    DEBUG("SymbolRecorder.record", "symbols={}".format(len(capture)), "pending={}".format(len(pending)))
+            if walkChildren and symIndexId not in walked:
+                walked.add(symIndexId)
+                children = []
+                for child in self.pydia.findChildrenEx(symbol):
+                    childId = child.symIndexId
+                    children.append(childId)
+                    if childId not in walked:
+                        pending.append((child, True))
+                capture.setChildren(symIndexId, children)
+        DEBUG("SymbolRecorder.record", "symbols={}".format(len(capture)), "walked={}".format(len(walked)))
+        return capture
+
+
+#---------------------------------------------------------------------------
+
+def nameMatcher(name, flags):
+    """Return a function that tests names like IDiaSymbol::findChildrenEx or None for any name"""
+    if name is None:
+        return None
+    useUndecorated = flags & NameSearchOptions.nsfUndecoratedName
+    if flags & NameSearchOptions.nsfRegularExpression:
+        reflags = 0
+        if flags & NameSearchOptions.nsfCaseInsensitive:
+            reflags = re.IGNORECASE
+        match = re.compile(fnmatch.translate(name), reflags).match
+        test = lambda s: s is not None and match(s) is not None
+    elif flags & NameSearchOptions.nsfCaseInsensitive:
+        lname = name.lower()
+        test = lambda s: s is not None and s.lower() == lname
+    else:
+        test = lambda s: s == name
+    if useUndecorated:
+        return lambda symbol: test(symbol.undecoratedName or symbol.name)
+    return lambda symbol: test(symbol.name)
+
+
+class ReplayEnumSymbols(object):
+    """I imitate IDiaEnumSymbols."""
+    __slots__ = ("session", "ids")
+
+    def __init__(self, session, ids):
+        self.session = session
+        self.ids = ids
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    def Item(self, index):
+        return self.session.symbolById(self.ids[index])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return self.session.symbolById(self.ids[index])
+
+    def __iter__(self):
+        symbolById = self.session.symbolById
+        for symIndexId in self.ids:
+            yield symbolById(symIndexId)
+
+
+class ReplayNull(object):
+    """I imitate a NULL POINTER(IDiaSymbol): false, and any attribute access raises like comtypes."""
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return False
+
+    def __getattr__(self, attr):
+        raise ValueError("NULL COM pointer access")
+
+    def __repr__(self):
+        return "<ReplayNull>"
+
+REPLAY_NULL = ReplayNull()
+
+
+class ReplaySymbol(object):
+    """I imitate IDiaSymbol with the data of a Capture.
+    NULL symbol attributes are REPLAY_NULL, like the NULL pointers of comtypes."""
+    __slots__ = ("symIndexId", "symTag", "session", "values", "children")
+
+    def __init__(self, session, symIndexId, record):
+        self.session = session
+        self.symIndexId = symIndexId
+        self.symTag, self.values, self.children = record
+
+    def __getattr__(self, attr):
+        try:
+            value = self.values[attr]
+        except KeyError:
+            if attr not in self.session.attributeNames:
+                raise AttributeError(attr)
+            if attr in SYMBOL_ATTRIBUTES:
+                return REPLAY_NULL
+            return attributeDefault(attr)
+        if value.__class__ is CapturedError:
+            raise value.exception()
+        if attr in SYMBOL_ATTRIBUTES:
+            if value is None:
+                return REPLAY_NULL
+            return self.session.symbolById(value)
+        return value
+
+    def __repr__(self):
+        return "<ReplaySymbol symIndexId={} symTag={}>".format(self.symIndexId, pydia.SYMTAG_name(self.symTag))
+
+    def findChildrenEx(self, symTag, name, flags):
+        children = self.children
+        if children is None:
+            raise COMError(None, "children of symbol {} were not captured".format(self.symIndexId), None)
+        session = self.session
+        if symTag != SYMTAG.SymTagNull:
+            records = session.capture.records
+            children = [child for child in children if records[child][0] == symTag]
+        match = nameMatcher(name, flags)
+        if match is not None:
+            children = [child for child in children if match(session.symbolById(child))]
+        return ReplayEnumSymbols(session, children)
+
+    def findChildren(self, symTag, name, flags):
+        return self.findChildrenEx(symTag, name, flags)
+
+
+class ReplaySession(object):
+    """I imitate IDiaSession with the data of a Capture."""
+    symbolClass = ReplaySymbol
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.symbols = {}
+        self.attributeNames = frozenset(captureAttributes())
+        self.globalScope = self.symbolById(capture.globalScopeId)
+
+    def symbolById(self, symIndexId):
+        try:
+            return self.symbols[symIndexId]
+        except KeyError:
+            pass
+        try:
+            record = self.capture.records[symIndexId]
+        except KeyError:
+            raise COMError(None, "symbol {} was not captured".format(symIndexId), None)
+        symbol = self.symbols[symIndexId] = self.symbolClass(self, symIndexId, record)
+        return symbol
+
+    def findChildrenEx(self, parent, symTag, name, flags):
+        return parent.findChildrenEx(symTag, name, flags)
+
+
+class PyDiaReplay(pydia.PyDia):
+    """PyDia over a capture file or Capture instead of a MSDIA session."""
+    sessionClass = ReplaySession
+
+    def __init__(self, targetFilepath):
+        if isinstance(targetFilepath, Capture):
+            capture = targetFilepath
+            self.targetFilepath = "<capture>"
+        else:
+            assert isinstance(targetFilepath, basestring)
+            self.targetFilepath = targetFilepath
+            capture = Capture.load(targetFilepath)
+        DEBUG("PyDiaReplay", "__enter__", "symbols={}".format(len(capture)))
+        self.session = self.sessionClass(capture)
+        self.globalScope = self.session.globalScope
+
+
+def isCaptureFile(filepath):
+    return filepath.lower().endswith(CAPTURE_EXTENSION)
+
+def openSession(filepath):
+    """Return a PyDia for a target or capture file"""
+    if isCaptureFile(filepath):
+        return PyDiaReplay(filepath)
+    return pydia.PyDia(filepath)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "usage: {} TARGET CAPTURE [ROOTNAME ...]\r\n".format(sys.argv[0]),
+        sys.exit(1)
+    session = pydia.PyDia(sys.argv[1])
+    try:
+        roots = None
+        if len(sys.argv) > 3:
+            roots = []
+            for name in sys.argv[3:]:
+                roots += list(session.findChildrenByNameEx(name))
+        capture = SymbolRecorder(session).record(roots)
+        capture.save(sys.argv[2])
+        DEBUG("pydiacapture", "saved {} symbols to {}".format(len(capture), sys.argv[2]))
+    finally:
+        del session
@@ -0,0 +1,299 @@
+"""
+ctypes code generation.
+
+Each UDT becomes a ctypes.Structure (or ctypes.Union) with _pack_ = 1 and
+explicit padding, so every field is at the offset of the UDT layout (see
+pydialayout) and the sizeof of the class is the length of the UDT; the
+generated module asserts both. Bitfields share a storage unit padded to its
+full width, base classes are fields named baseclass_OFFSET and virtual bases
+are left in the tail padding. Pointers, vfptrs and vbptrs are integers of
+their length (they are addresses in the dumped process) and enums are their
+underlying integer type, with a class that holds the enumerators.
+
+Types with the same name and the same shape (the pydiadiff.TypeShape digest,
+computed only when a name is seen twice) are generated once; the others get a
+class of their own. Unnamed types (<unnamed-tag>) are named after their
+symIndexId. The module is cached per PDB in the offline cache (see pydiacache)
+and imported from there.
+"""
+import imp
+import keyword
+import re
+import pydia
+import pydiacache
+import pydiadiff
+import pydiaheader
+import pydialayout
+from pydia import SYMTAG, BASICTYPE, UDTKIND, DEBUG, DiaEnumSymbolsIterator
+
+
+GENERATOR_VERSION = 3 # bump when the generated code changes
+CACHE_ENTRY = "ctypes_{}.py".format(GENERATOR_VERSION)
+
+BASICTYPE_CTYPES = {
+    (BASICTYPE.btChar, 1): "ctypes.c_char",
+    (BASICTYPE.btWChar, 2): "ctypes.c_uint16", # ctypes.c_wchar is 4 bytes on linux
+    (BASICTYPE.btInt, 1): "ctypes.c_int8",
+    (BASICTYPE.btInt, 2): "ctypes.c_int16",
+    (BASICTYPE.btInt, 4): "ctypes.c_int32",
+    (BASICTYPE.btInt, 8): "ctypes.c_int64",
+    (BASICTYPE.btUInt, 1): "ctypes.c_uint8",
+    (BASICTYPE.btUInt, 2): "ctypes.c_uint16",
+    (BASICTYPE.btUInt, 4): "ctypes.c_uint32",
+    (BASICTYPE.btUInt, 8): "ctypes.c_uint64",
+    (BASICTYPE.btLong, 4): "ctypes.c_int32",
+    (BASICTYPE.btULong, 4): "ctypes.c_uint32",
+    (BASICTYPE.btFloat, 4): "ctypes.c_float",
+    (BASICTYPE.btFloat, 8): "ctypes.c_double",
+    (BASICTYPE.btBool, 1): "ctypes.c_bool",
+    (BASICTYPE.btHresult, 4): "ctypes.c_int32",
+    }
+SIGNED_BASICTYPES = (BASICTYPE.btInt, BASICTYPE.btLong, BASICTYPE.btHresult)
+
+def integerCtype(length, signed=False):
+    """Return the ctypes integer of a length or None"""
+    if length not in (1, 2, 4, 8):
+        return None
+    return "ctypes.c_{}int{}".format(not signed and "u" or "", length * 8)
+
+def bytesCtype(length):
+    return "(ctypes.c_uint8 * {})".format(length)
+
+def identifier(name):
+    """Return a python identifier for a C++ name"""
+    ident = re.sub(r"[^0-9A-Za-z_]", "_", name.replace("::", "__"))
+    if not ident or ident[0].isdigit() or keyword.iskeyword(ident) or ident in ("None", "True", "False"): # keywords in python 3
+        ident = "_" + ident
+    return ident
+
+
+class CtypesGenerator:
+    """I write the UDTs and enums of a session as a python module of ctypes classes."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.analyzer = pydialayout.LayoutAnalyzer(pydia)
+        self.names = {} # symIndexId of a UDT or enum -> class name
+        self.byName = {} # (symTag, C++ name) -> [[digest or None, symIndexId, class name]]
+        self.shape = None # pydiadiff.TypeShape, created when a name is seen twice
+        self.identifiers = set()
+        self.lines = []
+        self.overlaps = 0 # members that overlap the previous ones (not generated)
+
+    def className(self, name):
+        base = ident = identifier(name)
+        n = 1
+        while ident in self.identifiers:
+            n += 1
+            ident = "{}_{}".format(base, n)
+        self.identifiers.add(ident)
+        return ident
+
+    def sameType(self, key, symbol):
+        """Return (class name of a generated type with the same name and shape or None, digest or None)"""
+        definitions = self.byName.get(key)
+        if not definitions:
+            return None, None # first of its name, no digest
+        if self.shape is None:
+            self.shape = pydiadiff.TypeShape(self.pydia)
+        digest = self.shape.digest(symbol)
+        for definition in definitions:
+            if definition[0] is None:
+                definition[0] = self.shape.digest(self.pydia.symbolById(definition[1]))
+            if definition[0] == digest:
+                return definition[2], digest
+        return None, digest
+
+    def newType(self, key, symbol, digest):
+        """Return the class name of a type that isn't generated yet"""
+        name = symbol.name
+        if pydiaheader.isUnnamed(name):
+            name = "{}_{}".format(name, symbol.symIndexId)
+        name = self.className(name)
+        self.byName.setdefault(key, []).append([digest, symbol.symIndexId, name])
+        return name
+
+    def ctype(self, symbol):
+        """Return the ctypes expression of a type, generating the classes it needs"""
+        symTag = symbol.symTag
+        if symTag == SYMTAG.SymTagBaseType:
+            baseType = symbol.baseType
+            length = symbol.length
+            return BASICTYPE_CTYPES.get((baseType, length)) or integerCtype(length, baseType in SIGNED_BASICTYPES) or bytesCtype(length)
+        if symTag == SYMTAG.SymTagPointerType:
+            return integerCtype(symbol.length) or bytesCtype(symbol.length)
+        if symTag == SYMTAG.SymTagArrayType:
+            return "({} * {})".format(self.ctype(symbol.type), symbol.count)
+        if symTag == SYMTAG.SymTagEnum:
+            self.defineEnum(symbol)
+            return self.integerCtype(symbol)
+        if symTag == SYMTAG.SymTagUDT:
+            return self.defineUdt(symbol)
+        if symTag == SYMTAG.SymTagTypedef:
+            return self.ctype(symbol.type)
+        DEBUG("CtypesGenerator.ctype", "TODO", pydia.SYMTAG_name(symTag), symbol.symIndexId)
+        return bytesCtype(symbol.length or 0)
+
+    def integerCtype(self, symbol):
+        """Return the ctypes integer of an integer, bool or enum type (bitfield storage)"""
+        length = symbol.length
+        if symbol.symTag == SYMTAG.SymTagEnum and symbol.type:
+            symbol = symbol.type
+        signed = symbol.symTag == SYMTAG.SymTagBaseType and symbol.baseType in SIGNED_BASICTYPES
+        return integerCtype(length, signed) or bytesCtype(length)
+
+    def defineEnum(self, symbol):
+        """Generate an enum, returns the class name"""
+        name = self.names.get(symbol.symIndexId)
+        if name is not None:
+            return name
+        key = (SYMTAG.SymTagEnum, symbol.name)
+        name, digest = self.sameType(key, symbol)
+        if name is None:
+            name = self.newType(key, symbol, digest)
+            lines = ["", "class {}(object):".format(name), '    """enum {} #{}"""'.format(symbol.name, symbol.symIndexId)]
+            lines.append("    _ctype_ = {}".format(self.integerCtype(symbol)))
+            for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagData, None, 0)):
+                lines.append("    {} = {}".format(identifier(child.name), child.value))
+            self.lines += lines
+        self.names[symbol.symIndexId] = name
+        return name
+
+    def defineUdt(self, symbol):
+        """Generate a UDT (and the types it contains by value), returns the class name"""
+        name = self.names.get(symbol.symIndexId)
+        if name is not None:
+            return name
+        if symbol.length == 0 and not pydiaheader.isUnnamed(symbol.name):
+            # forward declaration, use a definition with the same name
+            for definition in self.pydia.findChildrenByNameEx(symbol.name, SYMTAG.SymTagUDT):
+                if definition.length != 0:
+                    name = self.names[symbol.symIndexId] = self.defineUdt(definition)
+                    return name
+        key = (SYMTAG.SymTagUDT, symbol.name)
+        name, digest = self.sameType(key, symbol)
+        if name is None:
+            name = self.newType(key, symbol, digest)
+            self.names[symbol.symIndexId] = name
+            self.lines += self.classLines(name, symbol)
+        self.names[symbol.symIndexId] = name
+        return name
+
+    def fields(self, layout):
+        """Return the (field line, comment) of a layout with padding, generating the field types"""
+        fields = []
+        names = set()
+        def fieldName(name):
+            base = name = identifier(name)
+            n = 1
+            while name in names:
+                n += 1
+                name = "{}_{}".format(base, n)
+            names.add(name)
+            return name
+        union = layout.udtKind == UDTKIND.UdtUnion
+        end = 0
+        bitUnit = None # [offset, length, ctype, next bit position]
+        for member in layout.members:
+            if member.isBitField() and bitUnit is not None and bitUnit[0] == member.offset:
+                if member.bitPosition > bitUnit[3]:
+                    fields.append(('("{}", {}, {})'.format(fieldName("_bits_{}_{}".format(member.offset, bitUnit[3])), bitUnit[2], member.bitPosition - bitUnit[3]), "bit hole"))
+                fields.append(('("{}", {}, {})'.format(fieldName(member.name), bitUnit[2], member.bitLength), "+{}:{}".format(member.offset, member.bitPosition)))
+                bitUnit[3] = member.bitPosition + member.bitLength
+                continue
+            self.closeBitUnit(bitUnit, fields, fieldName)
+            bitUnit = None
+            if member.length == 0:
+                continue # empty base class
+            if member.kind == "vbase":
+                continue # left in the tail padding
+            if not union and member.offset < end:
+                DEBUG("CtypesGenerator.fields", "{}.{} overlaps the previous members".format(layout.name, member.name))
+                fields.append((None, "XXX {} +{} overlaps the previous members".format(member.name, member.offset)))
+                self.overlaps += 1
+                continue
+            if not union and member.offset > end:
+                fields.append(('("{}", {})'.format(fieldName("_pad_{}".format(end)), bytesCtype(member.offset - end)), "+{} hole".format(end)))
+            typeSymbol = member.typeId is not None and self.pydia.symbolById(member.typeId) or None
+            if member.kind in ("vfptr", "vbptr") or typeSymbol is None:
+                ctype = integerCtype(member.length) or bytesCtype(member.length)
+            elif member.kind == "base" and typeSymbol.length != member.length:
+                ctype = bytesCtype(member.length) # without its virtual bases
+            elif member.isBitField():
+                ctype = self.integerCtype(typeSymbol)
+            else:
+                ctype = self.ctype(typeSymbol)
+            if member.kind == "base":
+                name = fieldName("baseclass_{}".format(member.offset))
+            else:
+                name = fieldName(member.name)
+            if member.isBitField():
+                bitUnit = [member.offset, member.length, ctype, 0]
+                if member.bitPosition > 0:
+                    fields.append(('("{}", {}, {})'.format(fieldName("_bits_{}_0".format(member.offset)), ctype, member.bitPosition), "bit hole"))
+                fields.append(('("{}", {}, {})'.format(name, ctype, member.bitLength), "+{}:{}".format(member.offset, member.bitPosition)))
+                bitUnit[3] = member.bitPosition + member.bitLength
+            else:
+                fields.append(('("{}", {})'.format(name, ctype), "+{}".format(member.offset)))
+            end = max(end, member.end())
+        self.closeBitUnit(bitUnit, fields, fieldName)
+        if layout.length > end:
+            fields.append(('("{}", {})'.format(fieldName("_pad_{}".format(end)), bytesCtype(layout.length - end)), "+{} tail padding".format(end)))
+        return fields
+
+    def closeBitUnit(self, bitUnit, fields, fieldName):
+        """Pad a bitfield storage unit to its full width"""
+        if bitUnit is None:
+            return
+        offset, length, ctype, position = bitUnit
+        if position < length * 8:
+            fields.append(('("{}", {}, {})'.format(fieldName("_bits_{}_{}".format(offset, position)), ctype, length * 8 - position), "bit hole"))
+
+    def classLines(self, name, symbol):
+        layout = self.analyzer.layout(symbol)
+        fields = self.fields(layout) # generates the field types first
+        base = layout.udtKind == UDTKIND.UdtUnion and "ctypes.Union" or "ctypes.Structure"
+        lines = ["", "class {}({}):".format(name, base)]
+        lines.append('    """{} {} #{}"""'.format(pydia.UDTKIND_str(layout.udtKind), layout.name, layout.symIndexId))
+        lines.append("    _pack_ = 1")
+        lines.append("    _fields_ = [")
+        for field, comment in fields:
+            if field is None:
+                lines.append("        # {}".format(comment))
+            else:
+                lines.append("        {}, # {}".format(field, comment))
+        lines.append("        ]")
+        lines.append('assert ctypes.sizeof({0}) == {1}, "sizeof({0}) != {1}"'.format(name, layout.length))
+        return lines
+
+    def generate(self, symbols=None):
+        """Return the source of the module (default all the UDTs and enums of the session)"""
+        if symbols is None:
+            symbols = list(self.pydia.findChildrenByTypeEx(SYMTAG.SymTagEnum)) + list(self.pydia.findChildrenByTypeEx(SYMTAG.SymTagUDT))
+        for symbol in symbols:
+            if symbol.symTag == SYMTAG.SymTagEnum:
+                self.defineEnum(symbol)
+            elif symbol.length != 0:
+                self.defineUdt(symbol)
+        DEBUG("CtypesGenerator.generate", "{} classes, {} overlapping members".format(len(self.identifiers), self.overlaps))
+        header = [
+            "# -*- coding: utf-8 -*-",
+            "# generated by pydia from {}".format(self.pydia.targetFilepath),
+            "import ctypes",
+            ]
+        return u"\n".join([unicode(line) for line in header + self.lines]) + u"\n"
+
+
+def newModule(source, name="pydia_ctypes"):
+    """Return a module that runs source"""
+    module = imp.new_module(name)
+    exec compile(source.encode("utf-8"), "<{}>".format(name), "exec") in module.__dict__
+    return module
+
+def loadModule(pydia, cache=None, name="pydia_ctypes"):
+    """Return the generated module of a session, from the offline cache when possible"""
+    if cache is None:
+        cache = pydiacache.OfflineCache(pydia)
+    if cache.load(CACHE_ENTRY) is None:
+        cache.save(CACHE_ENTRY, CtypesGenerator(pydia).generate().encode("utf-8"))
+    return imp.load_source(name, cache.path(CACHE_ENTRY))
@@ -0,0 +1,233 @@
+"""
+Structural diff of the types of two sessions.
+
+Each UDT and enum is reduced to a structural digest (size, bases, members with
+their offsets and types, vtable slots, enumerators). The digest ignores the
+name of the type itself, so types are paired by name first and then by digest
+(renames). The member level deltas are computed for the changed types alone
+by reading both symbols again.
+
+Memory is bounded by PARTITION_TYPES plus the differences: the types are split
+in partitions by a hash of their name, and each partition is compared with the
+digests of its old types only (a PDB bigger than a partition is enumerated once
+per partition, but each type is reduced to its digest once). The memos of the
+type keys and vftables are cleared when they reach MEMO_ENTRIES.
+"""
+import hashlib
+import zlib
+import pydia
+from pydia import SYMTAG, BASICTYPE_str, DEBUG, DiaEnumSymbolsIterator, VtableLayout
+
+
+# diff events
+DIFF = pydia.enum("DiffAdded","DiffRemoved","DiffChanged","DiffRenamed")
+def DIFF_name(value):
+    for name in DIFF.__dict__.keys():
+        if name.startswith("Diff") and getattr(DIFF, name) == value:
+            return name
+    return "DIFF_name({})".format(value)
+
+DIFF_SYMTAGS = (SYMTAG.SymTagUDT, SYMTAG.SymTagEnum)
+PARTITION_TYPES = 50000 # old types whose digests are held at once
+MEMO_ENTRIES = 20000 # type keys and vftables memoized at once
+
+def partitionOf(name, partitions):
+    return zlib.crc32(unicode(name or u"").encode("utf-8")) % partitions
+
+
+class TypeShape:
+    """I reduce a UDT or enum to the facts that are compared."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.typeKeys = {} # symIndexId -> type key
+        self.vtableLayout = VtableLayout(pydia) # not the session's, its memo is bounded here
+
+    def bound(self):
+        """Clear the memos that reached MEMO_ENTRIES"""
+        if len(self.typeKeys) >= MEMO_ENTRIES:
+            self.typeKeys.clear()
+        if len(self.vtableLayout.layouts) >= MEMO_ENTRIES:
+            self.vtableLayout.layouts.clear()
+
+    def typeKey(self, symbol):
+        """Return a short description of a type that doesn't depend on symIndexIds"""
+        if not symbol: # NULL pointer
+            return "void"
+        symIndexId = symbol.symIndexId
+        key = self.typeKeys.get(symIndexId)
+        if key is None:
+            symTag = symbol.symTag
+            if symTag == SYMTAG.SymTagBaseType:
+                key = BASICTYPE_str(symbol.baseType, symbol.length)
+            elif symTag == SYMTAG.SymTagPointerType:
+                key = self.typeKey(symbol.type) + (symbol.reference and "&" or "*")
+            elif symTag == SYMTAG.SymTagArrayType:
+                key = "{}[{}]".format(self.typeKey(symbol.type), symbol.count)
+            elif symTag == SYMTAG.SymTagFunctionType:
+                args = [self.typeKey(arg.type) for arg in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagFunctionArgType, None, 0))]
+                key = "{}({})".format(self.typeKey(symbol.type), ",".join(args))
+            else:
+                key = symbol.name or pydia.SYMTAG_name(symTag)
+            if symbol.constType:
+                key = "const " + key
+            if symbol.volatileType:
+                key = "volatile " + key
+            self.typeKeys[symIndexId] = key
+        return key
+
+    def shape(self, symbol):
+        """Return a dict with the compared facts of a type"""
+        if symbol.symTag == SYMTAG.SymTagEnum:
+            values = [(child.name, child.value) for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagData, None, 0))]
+            return dict(length=symbol.length, underlying=self.typeKey(symbol.type), enumerators=values)
+        members = []
+        bases = []
+        for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+            symTag = child.symTag
+            if symTag == SYMTAG.SymTagData:
+                members.append((child.name.split("::")[-1], child.offset, child.bitPosition, child.dataKind, self.typeKey(child.type)))
+            elif symTag == SYMTAG.SymTagBaseClass:
+                bases.append((child.name, child.offset, child.virtualBaseClass))
+        slots = []
+        if symbol.udtKind != pydia.UDTKIND.UdtUnion: # structs have vftables too
+            for vftable in self.vtableLayout.vftables(symbol):
+                for virtualBaseOffset, function in vftable.slots.iteritems():
+                    slots.append((vftable.virtualBase, vftable.offset, virtualBaseOffset, function.name.split("::")[-1], self.typeKey(function.type)))
+        return dict(length=symbol.length, udtKind=symbol.udtKind, bases=bases, members=members, slots=sorted(slots))
+
+    def digest(self, symbol):
+        self.bound()
+        return hashlib.md5(repr(sorted(self.shape(symbol).items()))).digest()
+
+
+class TypeDiff:
+    """I compare the types of two sessions."""
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.oldShape = TypeShape(old)
+        self.newShape = TypeShape(new)
+
+    def types(self, session, partition=0, partitions=1):
+        """Yield the compared types of a session in a partition"""
+        for symTag in DIFF_SYMTAGS:
+            for symbol in session.findChildrenByTypeEx(symTag):
+                if partitions > 1 and partitionOf(symbol.name, partitions) != partition:
+                    continue
+                if symTag == SYMTAG.SymTagUDT and symbol.length == 0:
+                    continue # forward declaration
+                yield symbol
+
+    def diff(self):
+        """Yield (DIFF, symTag, oldName, newName, deltas) for each difference.
+        Memory: the digests of the old types of one partition, plus the types that differ."""
+        count = sum([len(self.old.findChildrenByTypeEx(symTag)) for symTag in DIFF_SYMTAGS])
+        partitions = max(1, (count + PARTITION_TYPES - 1) // PARTITION_TYPES)
+        removed = {} # (symTag, digest) -> [name]
+        added = [] # (symTag, digest, name)
+        for partition in xrange(partitions):
+            for event in self.diffPartition(partition, partitions, removed, added):
+                yield event
+        # renames: same shape, different name
+        for symTag, digest, name in added:
+            names = removed.get((symTag, digest))
+            if names:
+                yield DIFF.DiffRenamed, symTag, names.pop(0), name, []
+            else:
+                yield DIFF.DiffAdded, symTag, None, name, []
+        for (symTag, digest), names in sorted(removed.iteritems()):
+            for name in names:
+                yield DIFF.DiffRemoved, symTag, name, None, []
+
+    def diffPartition(self, partition, partitions, removed, added):
+        """Yield the changed types of a partition, collect its removed and added ones"""
+        # old types: {(symTag, name): [(digest, symIndexId)]}
+        oldTypes = {}
+        for symbol in self.types(self.old, partition, partitions):
+            oldTypes.setdefault((symbol.symTag, symbol.name), []).append((self.oldShape.digest(symbol), symbol.symIndexId))
+        # new types, unchanged ones are dropped as they are found
+        newTypes = {}
+        for symbol in self.types(self.new, partition, partitions):
+            key = (symbol.symTag, symbol.name)
+            digest = self.newShape.digest(symbol)
+            olds = oldTypes.get(key)
+            match = olds and [entry for entry in olds if entry[0] == digest]
+            if match:
+                olds.remove(match[0])
+                if not olds:
+                    del oldTypes[key]
+            else:
+                newTypes.setdefault(key, []).append((digest, symbol.symIndexId))
+        DEBUG("TypeDiff.diff", "partition {}/{}: {} old and {} new names differ".format(partition + 1, partitions, len(oldTypes), len(newTypes)))
+        for key in sorted(set(oldTypes) | set(newTypes)):
+            olds = oldTypes.pop(key, [])
+            news = newTypes.pop(key, [])
+            # same name, different shape
+            while olds and news:
+                (oldDigest, oldId), (newDigest, newId) = olds.pop(0), news.pop(0)
+                yield DIFF.DiffChanged, key[0], key[1], key[1], self.deltas(oldId, newId)
+            for digest, symIndexId in olds:
+                removed.setdefault((key[0], digest), []).append(key[1])
+            for digest, symIndexId in news:
+                added.append((key[0], digest, key[1]))
+
+    def deltas(self, oldId, newId):
+        """Return the member level differences of two versions of a type"""
+        old = self.oldShape.shape(self.old.symbolById(oldId))
+        new = self.newShape.shape(self.new.symbolById(newId))
+        deltas = []
+        for attr in ("length", "udtKind", "underlying"):
+            if old.get(attr) != new.get(attr):
+                deltas.append("{}: {} -> {}".format(attr, old.get(attr), new.get(attr)))
+        if old.get("bases") != new.get("bases"):
+            deltas.append("bases: {} -> {}".format(
+                ", ".join(["{}@{}".format(name, offset) for name, offset, virtual in old.get("bases", [])]),
+                ", ".join(["{}@{}".format(name, offset) for name, offset, virtual in new.get("bases", [])])))
+        deltas += self.namedDeltas("member", old.get("members", []), new.get("members", []),
+            lambda member: "+{} {}".format(member[1], member[4]))
+        deltas += self.namedDeltas("enumerator", old.get("enumerators", []), new.get("enumerators", []),
+            lambda enumerator: "= {}".format(enumerator[1]))
+        # slots are keyed by their position, overloads have the same name
+        deltas += self.namedDeltas("slot", [(slotName(slot), slot[3], slot[4]) for slot in old.get("slots", [])],
+            [(slotName(slot), slot[3], slot[4]) for slot in new.get("slots", [])], lambda slot: "{} {}".format(slot[1], slot[2]))
+        return deltas
+
+    def namedDeltas(self, what, olds, news, describe):
+        """Return the differences of two lists of tuples that start with a name"""
+        deltas = []
+        oldByName = dict([(entry[0], entry) for entry in olds])
+        newByName = dict([(entry[0], entry) for entry in news])
+        for entry in olds:
+            if entry[0] not in newByName:
+                deltas.append("- {} {} {}".format(what, entry[0], describe(entry)))
+        for entry in news:
+            oldEntry = oldByName.get(entry[0])
+            if oldEntry is None:
+                deltas.append("+ {} {} {}".format(what, entry[0], describe(entry)))
+            elif oldEntry != entry:
+                deltas.append("~ {} {} {} -> {}".format(what, entry[0], describe(oldEntry), describe(entry)))
+        return deltas
+
+
+def slotName(slot):
+    """Return the position of a (virtualBase, vftable offset, virtualBaseOffset, name, signature) slot"""
+    virtualBase, offset, virtualBaseOffset = slot[:3]
+    return "vftable{}@{}+{}".format(virtualBase and " of " + virtualBase or "", offset, virtualBaseOffset)
+
+
+def formatDiff(events):
+    """Yield the lines of the diff events"""
+    for event, symTag, oldName, newName, deltas in events:
+        kind = pydia.SYMTAG_name(symTag)[6:]
+        if event == DIFF.DiffAdded:
+            yield "+ {} {}".format(kind, newName)
+        elif event == DIFF.DiffRemoved:
+            yield "- {} {}".format(kind, oldName)
+        elif event == DIFF.DiffRenamed:
+            yield "~ {} {} renamed to {}".format(kind, oldName, newName)
+        else:
+            yield "~ {} {}".format(kind, newName)
+            for delta in deltas:
+                yield "\t" + delta
@@ -0,0 +1,162 @@
+"""
+Enum extraction for python tools.
+
+Every SymTagEnum and its SymTagData constants are read in one pass into a map
+    {C++ name: {"length": 4, "signed": true, "enumerators": [[name, value], ...]}}
+that is saved as JSON and rendered as a python module with an IntEnum class per
+enum. Nested enums are namespaced: CClass::EType is the class CClass__EType,
+also reachable as CClass.EType through a namespace class.
+
+Enums with the same name are extracted once; when the enumerators differ the
+first one is kept and the symIndexIds of the others are listed in "conflicts".
+The map and the module are cached per PDB in the offline cache (see
+pydiacache), so tools import the enums instead of scraping printEnums.
+"""
+import imp
+import pydia
+import pydiacache
+import pydiaheader
+from pydia import SYMTAG, DEBUG, DiaEnumSymbolsIterator
+from pydiactypes import SIGNED_BASICTYPES, identifier, newModule
+
+
+GENERATOR_VERSION = 2 # bump when the map or the generated code change
+MAP_ENTRY = "enums_{}.json".format(GENERATOR_VERSION)
+MODULE_ENTRY = "enums_{}.py".format(GENERATOR_VERSION)
+
+
+# IntEnum of the generated modules when the enum module (python 3.4+, enum34 backport) is missing:
+# int members with name/value, lookup by value, iteration and __members__
+INTENUM_SHIM = """\
+try:
+    from enum import IntEnum
+except ImportError:
+    class _IntEnumMeta(type):
+        def __new__(mcs, name, bases, namespace):
+            cls = type.__new__(mcs, name, bases, namespace)
+            cls._member_names_ = []
+            cls._value2member_map_ = {}
+            for value, key in sorted([(value, key) for key, value in namespace.items() if isinstance(value, (int, long))]):
+                member = cls._value2member_map_.get(value)
+                if member is None:
+                    member = int.__new__(cls, value)
+                    member.name, member.value = key, value
+                    cls._member_names_.append(key)
+                    cls._value2member_map_[value] = member
+                setattr(cls, key, member)
+            return cls
+        def __call__(cls, value):
+            try:
+                return cls._value2member_map_[value]
+            except KeyError:
+                raise ValueError("{!r} is not a valid {}".format(value, cls.__name__))
+        def __iter__(cls):
+            return iter([getattr(cls, name) for name in cls._member_names_])
+        def __len__(cls):
+            return len(cls._member_names_)
+        @property
+        def __members__(cls):
+            return dict([(name, getattr(cls, name)) for name in cls._member_names_])
+    IntEnum = _IntEnumMeta("IntEnum", (int,), dict(
+        __repr__=lambda self: "<{}.{}: {}>".format(self.__class__.__name__, self.name, self.value),
+        __str__=lambda self: "{}.{}".format(self.__class__.__name__, self.name)))
+"""
+
+
+def memberName(name):
+    """Return an IntEnum member name for an enumerator (_sunder_ names are reserved)"""
+    ident = identifier(name)
+    if len(ident) > 2 and ident[0] == "_" and ident[-1] == "_":
+        ident += "_"
+    return ident
+
+
+def extract(pydia):
+    """Return the map of all the enums of a session"""
+    enums = {}
+    duplicates = 0
+    for symbol in pydia.findChildrenByTypeEx(SYMTAG.SymTagEnum):
+        name = symbol.name
+        enumerators = [[child.name, child.value] for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagData, None, 0))]
+        entry = enums.get(name)
+        if entry is not None:
+            if entry["enumerators"] == enumerators:
+                duplicates += 1
+            else:
+                entry["conflicts"].append(symbol.symIndexId)
+            continue
+        underlying = symbol.type
+        signed = bool(underlying) and underlying.symTag == SYMTAG.SymTagBaseType and underlying.baseType in SIGNED_BASICTYPES
+        enums[name] = dict(symIndexId=symbol.symIndexId, length=symbol.length, signed=signed, enumerators=enumerators, conflicts=[])
+    DEBUG("pydiaenums.extract", "{} enums, {} duplicates".format(len(enums), duplicates))
+    return enums
+
+
+def moduleSource(enums, targetFilepath=None):
+    """Return the source of a module with an IntEnum class per enum of the map"""
+    lines = [
+        "# -*- coding: utf-8 -*-",
+        "# generated by pydia from {}".format(targetFilepath),
+        ] + INTENUM_SHIM.splitlines()
+    classNames = {} # C++ name -> class name
+    identifiers = set()
+    for name in sorted(enums):
+        base = ident = identifier(name)
+        n = 1
+        while ident in identifiers:
+            n += 1
+            ident = "{}_{}".format(base, n)
+        identifiers.add(ident)
+        classNames[name] = ident
+        entry = enums[name]
+        lines += ["", "class {}(IntEnum):".format(ident), '    """enum {} #{}"""'.format(name, entry["symIndexId"])]
+        for symIndexId in entry["conflicts"]:
+            lines.append("    # XXX #{} is another definition of {} (not generated)".format(symIndexId, name))
+        members = set()
+        for enumerator, value in entry["enumerators"]:
+            member = memberName(enumerator)
+            if member in members:
+                lines.append("    # XXX {} = {} (duplicate name)".format(member, value))
+                continue
+            members.add(member)
+            lines.append("    {} = {}".format(member, value))
+    # namespaces of the nested enums: path -> {attribute: class name}
+    namespaces = {}
+    for name in enums:
+        parts = pydiaheader.splitName(name)
+        for i in xrange(1, len(parts)):
+            namespaces.setdefault(tuple(parts[:i]), {})[parts[i]] = i + 1 == len(parts) and classNames[name] or None
+    namespaceNames = {}
+    for path in sorted(namespaces, key=len, reverse=True):
+        ident = identifier("::".join(path))
+        if ident in identifiers:
+            DEBUG("pydiaenums.moduleSource", "namespace {} is already a class, not generated".format("::".join(path)))
+            continue
+        identifiers.add(ident)
+        namespaceNames[path] = ident
+        lines += ["", "class {}(object):".format(ident), '    """namespace {}"""'.format("::".join(path))]
+        for attribute, className in sorted(namespaces[path].iteritems()):
+            if className is None:
+                className = namespaceNames.get(path + (attribute,))
+            if className is not None:
+                lines.append("    {} = {}".format(identifier(attribute), className))
+    return u"\n".join([unicode(line) for line in lines]) + u"\n"
+
+
+def loadMap(pydia, cache=None):
+    """Return the map of the enums of a session, from the offline cache when possible"""
+    if cache is None:
+        cache = pydiacache.OfflineCache(pydia)
+    enums = cache.loadJSON(MAP_ENTRY)
+    if enums is None:
+        enums = extract(pydia)
+        cache.saveJSON(MAP_ENTRY, enums)
+    return enums
+
+def loadModule(pydia, cache=None, name="pydia_enums"):
+    """Return the generated module of a session, from the offline cache when possible"""
+    if cache is None:
+        cache = pydiacache.OfflineCache(pydia)
+    if cache.load(MODULE_ENTRY) is None:
+        cache.save(MODULE_ENTRY, moduleSource(loadMap(pydia, cache), pydia.targetFilepath).encode("utf-8"))
+    return imp.load_source(name, cache.path(MODULE_ENTRY))
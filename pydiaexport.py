@@ -0,0 +1,174 @@
+"""
+JSON Lines export of the symbol graph.
+
+One JSON object per symbol, written as the graph is walked:
+    {"id": symIndexId, "symTag": "SymTagUDT", "attributes": {...}, "children": [ids]}
+The attributes are the ones of the symTag in SYMTAG_ATTRIBUTES; symbol values
+are written as symIndexIds and default values (0, None) are left out.
+
+The walk keeps a bitmap of the visited symIndexIds and a stack of ids, and
+saves them in a checkpoint file every few thousand symbols, so an interrupted
+export resumes where it stopped. The parallel mode writes one shard per
+compiland (see pydiascan) plus a shard with the rest of the global scope.
+"""
+import base64
+import functools
+import json
+import os
+import pydia
+import pydiascan
+from pydia import SYMTAG, ATTRKIND, COMError, DEBUG, DiaEnumSymbolsIterator
+
+
+KEY_ATTRIBUTES = ("symIndexId", "symTag")
+CHECKPOINT_INTERVAL = 5000 # symbols between checkpoints
+
+
+class VisitedBitmap(object):
+    """Set of symIndexIds, one bit per id."""
+
+    def __init__(self, data=None):
+        self.bits = bytearray(data or "")
+
+    def add(self, symIndexId):
+        byte = symIndexId >> 3
+        if byte >= len(self.bits):
+            self.bits.extend("\0" * max(byte + 1 - len(self.bits), len(self.bits)))
+        self.bits[byte] |= 1 << (symIndexId & 7)
+
+    def __contains__(self, symIndexId):
+        byte = symIndexId >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (symIndexId & 7)) & 1 == 1
+
+    def dumps(self):
+        return base64.b64encode(str(self.bits))
+
+    @classmethod
+    def loads(cls, text):
+        return cls(base64.b64decode(text))
+
+
+def jsonValue(attr, value):
+    """Return the JSON value of an attribute or None if it's a default"""
+    if not value: # None, 0, "", NULL pointer
+        return None
+    kind = pydia.attributeKind(attr)
+    if kind == ATTRKIND.AttrSymbol:
+        return value.symIndexId
+    if kind == ATTRKIND.AttrGuid:
+        return str(value)
+    if isinstance(value, (bool, int, long, float, basestring)):
+        return value
+    return unicode(value) # unknown VARIANT content
+
+
+class JsonLinesExporter:
+    """I write the symbols reachable from the roots as JSON Lines."""
+
+    def __init__(self, pydia, output, followAttributes=True, skipSymTags=()):
+        self.pydia = pydia
+        self.output = output # file
+        self.followAttributes = followAttributes # also export the symbols referenced by attributes
+        self.skipSymTags = skipSymTags # symTags whose children are listed but not exported
+        self.visited = VisitedBitmap()
+        self.stack = [] # symIndexIds to export
+        self.count = 0
+
+    def push(self, symIndexId):
+        if symIndexId not in self.visited:
+            self.visited.add(symIndexId)
+            self.stack.append(symIndexId)
+
+    def record(self, symbol):
+        """Return the JSON object of a symbol, pushing the symbols it references"""
+        symTag = symbol.symTag
+        attributes = {}
+        for attr in pydia.SYMTAG_ATTRIBUTES.get(symTag, pydia.SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull]):
+            if attr in KEY_ATTRIBUTES:
+                continue
+            try:
+                value = jsonValue(attr, getattr(symbol, attr))
+            except COMError:
+                continue
+            if value is not None:
+                attributes[attr] = value
+                if self.followAttributes and pydia.attributeKind(attr) == ATTRKIND.AttrSymbol:
+                    self.push(value)
+        children = []
+        walk = symTag not in self.skipSymTags
+        for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+            symIndexId = child.symIndexId
+            children.append(symIndexId)
+            if walk:
+                self.push(symIndexId)
+        return dict(id=symbol.symIndexId, symTag=pydia.SYMTAG_name(symTag), attributes=attributes, children=children)
+
+    def export(self, roots=None, checkpoint=None):
+        """Write the symbols reachable from roots (default globalScope), returns the number written.
+        With a checkpoint path, progress is saved there and an existing checkpoint is resumed."""
+        if checkpoint and os.path.exists(checkpoint):
+            self.resume(checkpoint)
+        else:
+            for root in roots or [self.pydia.globalScope]:
+                self.push(root.symIndexId)
+        while self.stack:
+            symbol = self.pydia.symbolById(self.stack.pop())
+            self.output.write(json.dumps(self.record(symbol), sort_keys=True))
+            self.output.write("\n")
+            self.count += 1
+            if checkpoint and self.count % CHECKPOINT_INTERVAL == 0:
+                self.saveCheckpoint(checkpoint)
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint) # done
+        DEBUG("JsonLinesExporter.export", "{} symbols".format(self.count))
+        return self.count
+
+    def saveCheckpoint(self, checkpoint):
+        self.output.flush()
+        state = dict(offset=self.output.tell(), count=self.count, stack=self.stack, visited=self.visited.dumps())
+        with open(checkpoint + ".tmp", "wb") as f:
+            json.dump(state, f)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        os.rename(checkpoint + ".tmp", checkpoint)
+
+    def resume(self, checkpoint):
+        with open(checkpoint, "rb") as f:
+            state = json.load(f)
+        # drop what was written after the checkpoint
+        self.output.seek(state["offset"])
+        self.output.truncate()
+        self.count = state["count"]
+        self.stack = state["stack"]
+        self.visited = VisitedBitmap.loads(state["visited"])
+        DEBUG("JsonLinesExporter.resume", "{} symbols already written, {} pending".format(self.count, len(self.stack)))
+
+
+def exportFile(pydia, filepath, roots=None, resume=True, **kwargs):
+    """Export to filepath, resuming from filepath.checkpoint if it exists"""
+    checkpoint = filepath + ".checkpoint"
+    if os.path.exists(checkpoint) and not (resume and os.path.exists(filepath)):
+        os.remove(checkpoint) # export() would resume from it into a new file
+    mode = os.path.exists(checkpoint) and "r+b" or "wb"
+    with open(filepath, mode) as output:
+        return JsonLinesExporter(pydia, output, **kwargs).export(roots, checkpoint)
+
+
+def _exportCompiland(directory, pydia, compiland):
+    """pydiascan callback: export the subtree of a compiland to its own shard"""
+    filepath = os.path.join(directory, "compiland-{}.jsonl".format(compiland.symIndexId))
+    return filepath, exportFile(pydia, filepath, [compiland], followAttributes=False)
+
+def exportShards(target, directory, processes=None, pydia=None):
+    """Export target as one shard per compiland plus global.jsonl, yields (filepath, count) as shards complete.
+    Symbols referenced from more than one shard (ex: the compilands) appear in each of them."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if pydia is None:
+        pydia = pydiascan.pydiacapture.openSession(target)
+    # everything but the compiland subtrees (types, publics, ...)
+    filepath = os.path.join(directory, "global.jsonl")
+    yield filepath, exportFile(pydia, filepath, skipSymTags=(SYMTAG.SymTagCompiland,))
+    callback = functools.partial(_exportCompiland, directory)
+    for symIndexId, result in pydiascan.scanCompilands(target, callback, processes, pydia):
+        yield result
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import sys, os, traceback, thread
+import sys, os, traceback, threading, Queue, array
 import wx
 import wx.py.crust
 import wx.html
 import pydia
+import pydiacapture
+import pydiaindex
 
 try:
     from agw import aui
@@ -26,6 +28,9 @@ class TreeData(object):
 
     SEARCH = "search"
     SYMBOL = "symbol"
+    MORE = "more"
+
+    item = None # tree item, None once deleted
     
     def GetTreeDataType(self):
         raise NotImplementedError("TreeData.GetTreeDataType")
@@ -37,17 +42,52 @@ class FindChildrenData(TreeData):
     DEFAULT_TYPE = pydia.SYMTAG.SymTagNull
     DEFAULT_FLAGS = pydia.NameSearchOptions.nsNone
     
+    CHUNK_SIZE = 200 # children materialized in the tree at a time
+    
     def __init__(self):
         self.name = self.DEFAULT_NAME
         self.type = self.DEFAULT_TYPE
         self.flags = self.DEFAULT_FLAGS
         self.busy = False
+        self.session = None
+        self.results = None # symIndexIds found
+        self.loaded = 0 # results in the tree
+        self.moreItem = None # tree item that loads the next chunk
+        self.job = None # SearchJob while busy
+        self.collapsed = False # the loaded chunks were evicted
 
     def GetTreeDataType(self):
         return TreeData.SEARCH
 
     def GetTitle(self):
-        return "Find children... [{}]".format(",".join(self.GetOptions()))
+        title = "Find children... [{}]".format(",".join(self.GetOptions()))
+        if self.results is not None:
+            title += " ({})".format(len(self.results))
+        return title
+
+    def SetResults(self, session, results):
+        self.session = session
+        self.results = results
+        self.loaded = 0
+        self.moreItem = None
+        self.collapsed = False
+
+    def Evict(self):
+        """Forget the loaded chunks, the tree items were deleted"""
+        self.loaded = 0
+        self.moreItem = None
+        self.collapsed = True
+
+    def NextChunk(self):
+        """Return the next symIndexIds to add to the tree"""
+        chunk = self.results[self.loaded:self.loaded + self.CHUNK_SIZE]
+        self.loaded += len(chunk)
+        return chunk
+
+    def GetRemaining(self):
+        if self.results is None:
+            return 0
+        return len(self.results) - self.loaded
 
     def GetOptions(self):
         opt = []
@@ -71,29 +111,257 @@ class FindChildrenData(TreeData):
         return result
 
 
+class MoreChildrenData(TreeData):
+    """Placeholder for the search results that are not in the tree yet."""
+
+    def GetTreeDataType(self):
+        return TreeData.MORE
+
+    def GetTitle(self, remaining):
+        return "... {} more (scroll or double-click to load)".format(remaining)
+
+
 class SymbolData(TreeData):
-    def __init__(self, session, symbol):
+    """Symbol in the tree.
+    The UI thread only keeps the symIndexId and the title, the symbol is read on
+    the ComThread. Search results get their title when they become visible."""
+
+    PENDING = "..."
+
+    def __init__(self, session, symIndexId, title = None):
         assert session
-        assert symbol
         self.session = session
-        self.symbol = symbol
-
-    def __del__(self):
-        del self.symbol
-        del self.session
+        self.symIndexId = symIndexId
+        self.title = title
+        self.reading = False # title requested
+        self.filled = False # children requested
 
     def GetTreeDataType(self):
         return TreeData.SYMBOL
 
-    def GetTitle(self, text = None, attribute = False):
-        symIndexId = self.symbol.symIndexId
+    def GetTitle(self, text = None):
         if text:
-            return "{} - {}".format(symIndexId, text)
-        symTagName = pydia.SYMTAG_name(self.symbol.symTag)
-        name = self.symbol.name
-        if attribute:
-            return "{} - {} = {} , {}".format(symIndexId, attribute, symTagName, name)
-        return "{} - {} , {}".format(symIndexId, symTagName, name)
+            return "{} - {}".format(self.symIndexId, text)
+        return self.title or "{} - {}".format(self.symIndexId, self.PENDING)
+
+
+def ReadTitle(symbol, attribute = None):
+    """runs on the ComThread, returns the tree title of a symbol"""
+    symTagName = pydia.SYMTAG_name(symbol.symTag)
+    if attribute:
+        return "{} - {} = {} , {}".format(symbol.symIndexId, attribute, symTagName, symbol.name)
+    return "{} - {} , {}".format(symbol.symIndexId, symTagName, symbol.name)
+
+def ReleaseSession(session, cache):
+    """runs on the ComThread, drops the COM objects of a session (the UI thread may still hold the PyDia)"""
+    cache.clear()
+    session.__dict__.clear()
+
+#---------------------------------------------------------------------------
+
+class SearchJob(object):
+    """A findChildrenEx search on the ComThread.
+    Listeners are notified on the UI thread; results has the symIndexIds received so far."""
+
+    def __init__(self, key, session, symIndexId, type, name, flags):
+        self.key = key
+        self.session = session
+        self.symIndexId = symIndexId
+        self.type = type
+        self.name = name
+        self.flags = flags
+        self.listeners = [] # objects with OnSearchChunk, OnSearchProgress and OnSearchDone
+        self.results = array.array('L')
+        self.found = 0
+        self.total = None # known at the end
+        self.cancelled = False
+        self.done = False
+        self.steps = None # generator of the search, on the ComThread
+
+    def Cancel(self):
+        """Stop the search at the next chunk (all listeners are cancelled)"""
+        self.cancelled = True
+
+    def AddListener(self, listener):
+        """Runs on the UI thread, late listeners get the results so far"""
+        self.listeners.append(listener)
+        if len(self.results) > 0:
+            listener.OnSearchChunk(self, self.results[:])
+        if self.found or self.total is not None:
+            listener.OnSearchProgress(self)
+        if self.done:
+            listener.OnSearchDone(self)
+
+    def DispatchChunk(self, chunk, found, total):
+        """Runs on the UI thread"""
+        self.results.extend(chunk)
+        self.found = found
+        self.total = total
+        for listener in self.listeners:
+            if len(chunk) > 0:
+                listener.OnSearchChunk(self, chunk)
+            listener.OnSearchProgress(self)
+
+    def DispatchDone(self):
+        """Runs on the UI thread"""
+        self.done = True
+        for listener in self.listeners:
+            listener.OnSearchDone(self)
+
+
+class ComCall(object):
+    """A function to run on the ComThread, done(result) or failed(traceback) is called on the UI thread."""
+
+    def __init__(self, func, done, failed):
+        self.func = func
+        self.done = done
+        self.failed = failed
+
+
+class ComSteps(object):
+    """A generator to run on the ComThread one step at a time, done() is called on the UI thread at its end."""
+
+    def __init__(self, steps, done, failed):
+        self.steps = steps
+        self.done = done
+        self.failed = failed
+
+
+class ComThread(object):
+    """The thread that owns the COM objects of the sessions.
+    DIA objects belong to the apartment of the thread that created them, so the
+    sessions are opened, searched, read and released on this thread only, and
+    the UI thread only keeps symIndexIds and text. Calls and searches run in
+    order; searches and other long work (ComSteps) run one chunk at a time and
+    are queued again after each chunk, so the calls queued meanwhile don't wait
+    for their end. Identical searches in flight are shared."""
+
+    CHUNK_SIZE = 500 # symIndexIds per notification
+
+    def __init__(self, post = wx.CallAfter):
+        self.post = post
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.inflight = dict() # key -> SearchJob
+        self.thread = threading.Thread(target = self._Run, name = "ComThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Submit(self, listener, session, symIndexId, type, name, flags):
+        """Runs on the UI thread, returns the SearchJob"""
+        key = (id(session), symIndexId, type, name, flags)
+        with self.lock:
+            job = self.inflight.get(key)
+            if job is None or job.cancelled:
+                job = SearchJob(key, session, symIndexId, type, name, flags)
+                self.inflight[key] = job
+                self.queue.put(job)
+        job.AddListener(listener)
+        return job
+
+    def Call(self, func, done = None, failed = None):
+        """Runs on the UI thread, func runs on the ComThread"""
+        self.queue.put(ComCall(func, done, failed))
+
+    def Steps(self, steps, done = None, failed = None):
+        """Runs on the UI thread, the generator steps runs on the ComThread"""
+        self.queue.put(ComSteps(steps, done, failed))
+
+    def CancelAll(self):
+        with self.lock:
+            for job in self.inflight.values():
+                job.Cancel()
+
+    def Shutdown(self):
+        self.CancelAll()
+        self.queue.put(None)
+
+    def _Run(self):
+        """runs on the ComThread"""
+        comtypes = pydia.comtypes
+        if comtypes is not None:
+            comtypes.CoInitialize()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, ComCall):
+                    self._Call(item)
+                elif isinstance(item, ComSteps):
+                    self._Steps(item)
+                else:
+                    self._Step(item)
+                item = None # the COM objects of the call are released on this thread
+        finally:
+            if comtypes is not None:
+                comtypes.CoUninitialize()
+
+    def _Call(self, call):
+        """runs on the ComThread"""
+        try:
+            result = call.func()
+        except:
+            traceback.print_exc()
+            if call.failed is not None:
+                self.post(call.failed, traceback.format_exc())
+            return
+        if call.done is not None:
+            self.post(call.done, result)
+
+    def _Steps(self, item):
+        """runs on the ComThread, runs the next step of a generator"""
+        try:
+            next(item.steps)
+            self.queue.put(item) # after the calls queued meanwhile
+            return
+        except StopIteration:
+            pass
+        except:
+            traceback.print_exc()
+            if item.failed is not None:
+                self.post(item.failed, traceback.format_exc())
+            return
+        if item.done is not None:
+            self.post(item.done)
+
+    def _Step(self, job):
+        """runs on the ComThread, searches the next chunk of a job"""
+        try:
+            if job.cancelled:
+                pass # cancelled before it started or between two chunks
+            elif job.steps is None:
+                job.steps = self._Search(job)
+            if not job.cancelled and next(job.steps, None) is not None:
+                self.queue.put(job) # after the calls queued meanwhile
+                return
+        except:
+            traceback.print_exc()
+        if job.steps is not None:
+            job.steps.close()
+            job.steps = None
+        job.session = None
+        with self.lock:
+            if self.inflight.get(job.key) is job:
+                del self.inflight[job.key]
+        self.post(job.DispatchDone)
+
+    def _Search(self, job):
+        """runs on the ComThread, generator that posts one chunk per step"""
+        session = job.session
+        # NOTE this can take a long time, the job may be cancelled meanwhile
+        children = session.findChildrenEx(session.symbolById(job.symIndexId), job.type, job.name, job.flags)
+        yield True
+        found = 0
+        chunk = array.array('L')
+        for child in children:
+            chunk.append(child.symIndexId)
+            found += 1
+            if len(chunk) >= self.CHUNK_SIZE:
+                self.post(job.DispatchChunk, chunk, found, None)
+                chunk = array.array('L')
+                yield True
+        self.post(job.DispatchChunk, chunk, found, found)
 
 #---------------------------------------------------------------------------
 
@@ -197,14 +465,84 @@ class FindChildrenDialog(wx.Dialog):
         return flags
 
 
+class CachedSymbol(object):
+    """Symbol proxy that remembers the attribute values it has read.
+    Errors are remembered too, so a failing attribute is only read once."""
+
+    __slots__ = ("symbol", "cache")
+
+    def __init__(self, symbol, cache):
+        self.symbol = symbol
+        self.cache = cache # attribute -> (value, exception)
+
+    def __getattr__(self, name):
+        entry = self.cache.get(name)
+        if entry is None:
+            try:
+                entry = (getattr(self.symbol, name), None)
+            except Exception as e:
+                entry = (None, e)
+            self.cache[name] = entry
+        if entry[1] is not None:
+            raise entry[1]
+        return entry[0]
+
+    def IsCached(self, name):
+        return name in self.cache
+
+
+class SymbolReader(object):
+    """I read the attributes of a symbol for a SymbolPanel, on the ComThread.
+    The values stay in cache, so a symbol shown again is read at once."""
+
+    def __init__(self, session, symIndexId, cache):
+        self.session = session
+        self.symIndexId = symIndexId
+        self.cache = cache # attribute -> (value, exception), only used on the ComThread
+
+    def Symbol(self):
+        # not kept, the reader is released on the UI thread
+        return CachedSymbol(self.session.symbolById(self.symIndexId), self.cache)
+
+    def Attributes(self):
+        """Return [(attribute, text or None if not read yet)]"""
+        symbol = self.Symbol()
+        return [(attribute, symbol.IsCached(attribute) and self.Text(symbol, attribute) or None)
+            for attribute in sorted(pydia.SymbolPrinter(self.session).attributes(symbol))]
+
+    def Texts(self, attributes):
+        """Return [(attribute, text)]"""
+        symbol = self.Symbol()
+        return [(attribute, self.Text(symbol, attribute)) for attribute in attributes]
+
+    def Metadata(self):
+        # metadata reads the same attributes, most come from the cache by now
+        return pydia.SymbolPrinter(self.session).metadata(self.Symbol())
+
+    @staticmethod
+    def Text(symbol, attribute):
+        try:
+            return str(getattr(symbol, attribute))
+        except Exception as e:
+            return str(e)
+
+
 class SymbolPanel(wx.Panel):
-    def __init__(self, parent, session, symbol, log):
+    """Metadata and attributes of a symbol.
+    The panel is shown right away, the values are read on the ComThread in
+    batches on a timer, starting with the visible rows."""
+
+    BATCH_SIZE = 16 # attributes read per timer event
+    TIMER_INTERVAL = 10
+    PENDING = "..."
+
+    def __init__(self, parent, comThread, reader, log):
         wx.Panel.__init__(self, parent)
         try:
-            assert session
-            assert symbol
             self.log = Log()
-            self.symIndexId = symbol.symIndexId
+            self.comThread = comThread
+            self.reader = reader
+            self.symIndexId = reader.symIndexId
 
             sizer = wx.BoxSizer(wx.VERTICAL)
 
@@ -214,50 +552,269 @@ class SymbolPanel(wx.Panel):
 
             box = wx.StaticBoxSizer(static, wx.VERTICAL)
 
-            metadata = pydia.SymbolPrinter(session).metadata(symbol)
-            self.metactrl = wx.TextCtrl(self, -1, value = '\n'.join(metadata), style = wx.TE_MULTILINE | wx.TE_READONLY)
+            self.metactrl = wx.TextCtrl(self, -1, value = self.PENDING, style = wx.TE_MULTILINE | wx.TE_READONLY)
             box.Add(self.metactrl, 1, wx.EXPAND)
             
             sizer.Add(box, 0, wx.EXPAND | wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
 
-            # attributes
+            # attributes, filled by OnAttributes
             self.listctrl = wx.ListCtrl(self, style = wx.LC_REPORT | wx.LC_SORT_ASCENDING)
             self.listctrl.SetMinSize(wx.Size(-1, 150))
             self.listctrl.InsertColumn(0, "Attribute")
             self.listctrl.InsertColumn(1, "Value")
 
-            self.data = dict()
-            for attribute in sorted(pydia.SymbolPrinter(session).attributes(symbol)):
-                try:
-                    self.data[attribute] = str(getattr(symbol, attribute))
-                except Exception as e:
-                    self.data[attribute] = str(e)
-            for attribute in self.data.keys():
-                value = self.data[attribute]
-                index = self.listctrl.InsertStringItem(sys.maxint, attribute)
-                self.listctrl.SetStringItem(index, 1, value)
-            self.listctrl.SetColumnWidth(0, wx.LIST_AUTOSIZE)
-            self.listctrl.SetColumnWidth(1, wx.LIST_AUTOSIZE)
+            self.rows = dict() # attribute -> row
+            self.pending = []
+            self.reading = True # a ComThread call is in progress
             
             sizer.Add(self.listctrl, 0, wx.EXPAND | wx.ALIGN_CENTER_VERTICAL | wx.LEFT | wx.RIGHT | wx.BOTTOM, 5)
 
             self.SetSizer(sizer)
             sizer.Fit(self)
             self.Layout()
+
+            self.timer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
+            self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
+            self.comThread.Call(reader.Attributes, self.OnAttributes, self.OnFailed)
         except:
             traceback.print_exc()
 
+    def OnAttributes(self, attributes):
+        if not self:
+            return # closed meanwhile
+        for attribute, text in attributes:
+            index = self.listctrl.InsertStringItem(sys.maxint, attribute)
+            if text is None:
+                self.listctrl.SetStringItem(index, 1, self.PENDING)
+                self.pending.append(attribute)
+            else:
+                self.listctrl.SetStringItem(index, 1, text)
+        for index in xrange(self.listctrl.GetItemCount()):
+            self.rows[self.listctrl.GetItemText(index)] = index
+        self.listctrl.SetColumnWidth(0, wx.LIST_AUTOSIZE)
+        self.listctrl.SetColumnWidth(1, wx.LIST_AUTOSIZE)
+        self.reading = False
+        self.timer.Start(self.TIMER_INTERVAL)
+
+    def NextBatch(self):
+        """Return the pending attributes to read next, visible rows first"""
+        top = self.listctrl.GetTopItem()
+        visible = set(self.listctrl.GetItemText(index) for index in
+            xrange(top, min(top + self.listctrl.GetCountPerPage() + 1, self.listctrl.GetItemCount())))
+        batch = [attribute for attribute in self.pending if attribute in visible][:self.BATCH_SIZE]
+        for attribute in self.pending:
+            if len(batch) >= self.BATCH_SIZE:
+                break
+            if attribute not in batch:
+                batch.append(attribute)
+        return batch
+
+    def OnTimer(self, event):
+        try:
+            if self.reading:
+                return
+            self.reading = True
+            reader = self.reader
+            if self.pending:
+                batch = self.NextBatch()
+                self.comThread.Call(lambda: reader.Texts(batch), self.OnTexts, self.OnFailed)
+            else:
+                self.timer.Stop()
+                self.comThread.Call(reader.Metadata, self.OnMetadata, self.OnFailed)
+        except:
+            self.timer.Stop()
+            traceback.print_exc()
+
+    def OnTexts(self, texts):
+        if not self:
+            return
+        for attribute, text in texts:
+            self.listctrl.SetStringItem(self.rows[attribute], 1, text)
+            self.pending.remove(attribute)
+        if not self.pending:
+            self.listctrl.SetColumnWidth(1, wx.LIST_AUTOSIZE)
+        self.reading = False
+
+    def OnMetadata(self, metadata):
+        if not self:
+            return
+        self.metactrl.SetValue('\n'.join(metadata))
+
+    def OnFailed(self, text):
+        if not self:
+            return
+        self.timer.Stop()
+        self.metactrl.SetValue(text)
+
+    def OnDestroy(self, event):
+        if event.GetEventObject() is self:
+            self.timer.Stop()
+        event.Skip()
+
+
+class NameFilterListCtrl(wx.ListCtrl):
+    """Virtual list of the NameFilterPanel results."""
+
+    def __init__(self, parent, panel):
+        wx.ListCtrl.__init__(self, parent, style = wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL)
+        self.panel = panel
+
+    def OnGetItemText(self, item, column):
+        return self.panel.GetItemText(item, column)
+
+
+class NameFilterPanel(wx.Panel):
+    """Search-as-you-type over the NameIndex of the session.
+    The query runs on the in-memory index when the typing pauses, no MSDIA calls are made."""
+
+    LIMIT = 500 # results shown
+    DELAY = 100 # ms without keystrokes before the query runs
+    SYMTAGS = ( # (label, symTags)
+        ("All", None),
+        ("UDT", (pydia.SYMTAG.SymTagUDT,)),
+        ("Enum", (pydia.SYMTAG.SymTagEnum,)),
+        ("Typedef", (pydia.SYMTAG.SymTagTypedef,)),
+        ("Function", (pydia.SYMTAG.SymTagFunction,)),
+        ("Data", (pydia.SYMTAG.SymTagData,)),
+        ("PublicSymbol", (pydia.SYMTAG.SymTagPublicSymbol,)),
+        )
+
+    def __init__(self, parent, activate):
+        wx.Panel.__init__(self, parent)
+        self.activate = activate # called with (name, symIndexId)
+        self.index = None # NameIndex
+        self.results = []
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        row = wx.BoxSizer(wx.HORIZONTAL)
+        self.text = wx.SearchCtrl(self, style = wx.TE_PROCESS_ENTER)
+        self.text.ShowCancelButton(True)
+        row.Add(self.text, 1, wx.EXPAND | wx.RIGHT, 5)
+        self.choice = wx.Choice(self, choices = [label for label, symTags in self.SYMTAGS])
+        self.choice.SetSelection(0)
+        row.Add(self.choice, 0)
+        sizer.Add(row, 0, wx.EXPAND | wx.ALL, 5)
+
+        self.listctrl = NameFilterListCtrl(self, self)
+        self.listctrl.InsertColumn(0, "Name", width = 300)
+        self.listctrl.InsertColumn(1, "SymTag", width = 120)
+        self.listctrl.InsertColumn(2, "symIndexId", width = 80)
+        sizer.Add(self.listctrl, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 5)
+        self.SetSizer(sizer)
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
+        self.Bind(wx.EVT_TEXT, self.OnQueryChanged, self.text)
+        self.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.OnCancelButton, self.text)
+        self.Bind(wx.EVT_CHOICE, self.OnQueryChanged, self.choice)
+        self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.OnItemActivated, self.listctrl)
+        self.SetIndex(None)
+
+    def SetIndex(self, index, message = "Open a session..."):
+        self.index = index
+        self.text.Enable(index is not None)
+        self.text.SetDescriptiveText(message if index is None else "Filter {} names...".format(len(index)))
+        self.Refilter()
+
+    def Refilter(self):
+        self.timer.Stop()
+        if self.index is None:
+            self.results = []
+        else:
+            symTags = self.SYMTAGS[self.choice.GetSelection()][1]
+            self.results = self.index.query(self.text.GetValue(), symTags = symTags, limit = self.LIMIT)
+        self.listctrl.SetItemCount(len(self.results))
+        self.listctrl.Refresh()
+
+    def GetItemText(self, item, column):
+        name, symIndexId, symTag = self.index.entry(self.results[item])
+        if column == 0:
+            return name
+        if column == 1:
+            return pydia.SYMTAG_name(symTag)
+        return str(symIndexId)
+
+    def OnQueryChanged(self, event):
+        self.timer.Start(self.DELAY, wx.TIMER_ONE_SHOT)
+
+    def OnTimer(self, event):
+        self.Refilter()
+
+    def OnCancelButton(self, event):
+        self.text.SetValue("")
+
+    def OnItemActivated(self, event):
+        name, symIndexId, symTag = self.index.entry(self.results[event.GetIndex()])
+        self.activate(name, symIndexId)
+
+
+class SearchListener(object):
+    """Shows the results of a SearchJob under a "Find children..." tree item."""
+
+    def __init__(self, gui, item, data):
+        self.gui = gui
+        self.item = item
+        self.data = data
+        self.session = gui.session
+
+    def IsValid(self, job):
+        # the tree item is gone when the session was closed or the search was repeated
+        return self.gui.session is self.session and self.data.job is job
+
+    def OnSearchChunk(self, job, chunk):
+        if not self.IsValid(job):
+            return
+        data = self.data
+        data.results.extend(chunk)
+        tree = self.gui.mgr.GetPane("symboltree").window
+        if data.collapsed:
+            tree.SetItemHasChildren(self.item, True) # loaded when expanded
+        elif data.moreItem is None:
+            self.gui.LoadMoreChildren(self.item)
+            tree.SetItemHasChildren(self.item, True)
+            tree.Expand(self.item)
+        else:
+            tree.SetItemText(data.moreItem, MoreChildrenData().GetTitle(data.GetRemaining()))
+
+    def OnSearchProgress(self, job):
+        if not self.IsValid(job):
+            return
+        tree = self.gui.mgr.GetPane("symboltree").window
+        progress = job.found
+        if job.total is not None:
+            progress = "{}/{}".format(job.found, job.total)
+        tree.SetItemText(self.item, "...(searching {})... [{}]".format(progress, ','.join(self.data.GetOptions())))
+
+    def OnSearchDone(self, job):
+        if not self.IsValid(job):
+            return
+        data = self.data
+        tree = self.gui.mgr.GetPane("symboltree").window
+        title = data.GetTitle()
+        if job.cancelled:
+            title += " (cancelled)"
+        tree.SetItemText(self.item, title)
+        tree.SetItemHasChildren(self.item, len(data.results) > 0)
+        data.busy = False
+        data.job = None
+        self.gui.DoUpdate()
+
 
 class PyDiaGUI(wx.Frame):
     """DIA symbol viewer"""
 
     # File extensions for the Open dialog.
-    wildcard = "All compatible types (*.pdb;*.exe;*.dll)|*.pdb;*.exe;*.dll|" \
+    wildcard = "All compatible types (*.pdb;*.exe;*.dll;*.pydiacap)|*.pdb;*.exe;*.dll;*.pydiacap|" \
                "Program database (*.pdb)|*.pdb|" \
                "Executable (*.exe)|*.exe|" \
                "Dynamic-link library (*.dll)|*.dll|" \
+               "PyDia capture (*.pydiacap)|*.pydiacap|" \
                "All files (*.*)|*.*"
 
+    MORE_TIMER_INTERVAL = 150 # ms between checks for visible placeholders
+    MORE_TIMER_MAX_ROWS = 500 # visible rows checked
+
     def __init__(self, parent = None, id = wx.ID_ANY, title = "PyDiaGUI", *args, **kwargs):
         super(PyDiaGUI, self).__init__(parent, id, title, *args, **kwargs)
 
@@ -270,6 +827,9 @@ class PyDiaGUI(wx.Frame):
         self.log = Log()
         self.session = None # PyDia
         self.sessionPages = []
+        self.comThread = ComThread()
+        self.symbolCache = dict() # symIndexId -> attribute values of the session symbols, only used on the ComThread
+        self.nameIndex = None # NameIndex of the session, built in the background
 
         self.SetSize(wx.Size(800, 600))
         self.SetMinSize(wx.Size(400, 300))
@@ -284,6 +844,7 @@ class PyDiaGUI(wx.Frame):
             self.MakeToolBar()
             self.MakeShellPane()
             self.MakeSymbolTreePane()
+            self.MakeNameFilterPane()
             self.MakeSymbolBook()
             self.BindEvents()
 
@@ -306,14 +867,11 @@ class PyDiaGUI(wx.Frame):
             assert len(paths) == 1 # XXX we only support 1 for now
 
             for path in paths:
-                self.statusbar.PushStatusText("Loading {}...".format(path))
                 try:
                     self.OpenSession(path)
                 except:
                     self.ShowExceptionInDialog()
-                self.statusbar.PopStatusText()
         dlg.Destroy()
-        self.statusbar.SetStatusText("Ready")
 
     def OnClose(self, evt):
         self.CloseSession()
@@ -321,6 +879,7 @@ class PyDiaGUI(wx.Frame):
 
     def OnExit(self, event):
         self.CloseSession()
+        self.comThread.Shutdown()
         self.Close(True)
 
     def OnHelp(self, event):
@@ -360,12 +919,28 @@ class PyDiaGUI(wx.Frame):
         item = event.GetItem()
         assert item.IsOk()
         data = tree.GetPyData(item)
+        if data.GetTreeDataType() == TreeData.MORE:
+            return
         if tree.ItemHasChildren(item) and tree.GetChildrenCount(item, False) == 0:
             if data.GetTreeDataType() == TreeData.SEARCH:
-                self.SearchForChildren(item)
+                if data.results:
+                    data.collapsed = False
+                    self.LoadMoreChildren(item) # evicted when collapsed
+                else:
+                    self.SearchForChildren(item)
             elif data.GetTreeDataType() == TreeData.SYMBOL:
                 self.FillSymbolTreeItem(item)
 
+    def OnTreeItemCollapsed(self, event):
+        """Evict the loaded search results, they are loaded again when expanded"""
+        tree = self.mgr.GetPane("symboltree").window
+        item = event.GetItem()
+        data = tree.GetPyData(item)
+        if data and data.GetTreeDataType() == TreeData.SEARCH and data.results:
+            tree.DeleteChildren(item)
+            data.Evict()
+            tree.SetItemHasChildren(item, True)
+
     def OnTreeItemActivate(self, event):
         tree = self.mgr.GetPane("symboltree").window
         item = event.GetItem()
@@ -375,6 +950,8 @@ class PyDiaGUI(wx.Frame):
         if data.GetTreeDataType() == TreeData.SEARCH:
             # search for children
             self.SearchForChildren(item)
+        elif data.GetTreeDataType() == TreeData.MORE:
+            self.LoadMoreChildren(tree.GetItemParent(item))
         elif data: # symbol
             self.AddSymbolPage(data, tree.GetImageList().GetBitmap(image))
             self.DoUpdate()
@@ -429,8 +1006,9 @@ class PyDiaGUI(wx.Frame):
     def AddSymbolPage(self, data, bitmap = wx.NullBitmap):
         book = self.mgr.GetPane("book").window
 
-        panel = SymbolPanel(book, data.session, data.symbol, self.log)
-        caption = "Symbol #{}".format(data.symbol.symIndexId)
+        reader = SymbolReader(data.session, data.symIndexId, self.symbolCache.setdefault(data.symIndexId, dict()))
+        panel = SymbolPanel(book, self.comThread, reader, self.log)
+        caption = "Symbol #{}".format(data.symIndexId)
         book.AddPage(panel, caption, True, bitmap)
         self.sessionPages.append(panel)
 
@@ -452,6 +1030,30 @@ class PyDiaGUI(wx.Frame):
         tree.AssignImageList(imglist)
         self.mgr.AddPane(tree, paneinfo)
 
+    def MakeNameFilterPane(self):
+        paneinfo = aui.AuiPaneInfo().Name("namefilter").Caption("Name Filter")
+        paneinfo.Left().BestSize(wx.Size(300, -1)).CloseButton(False).MaximizeButton(True).MinimizeButton(True).Hide()
+        panel = NameFilterPanel(self, self.OnNameFilterActivate)
+        self.mgr.AddPane(panel, paneinfo)
+
+    def BuildNameIndex(self):
+        """Build the NameIndex of the session in the background"""
+        session = self.session
+        index = pydiaindex.NameIndex()
+        self.nameIndex = index
+        def done():
+            if self.nameIndex is index and not index.cancelled:
+                self.mgr.GetPane("namefilter").window.SetIndex(index)
+        self.mgr.GetPane("namefilter").Show().window.SetIndex(None, "Indexing names...")
+        self.comThread.Steps(index.buildSteps(session), done)
+
+    def OnNameFilterActivate(self, name, symIndexId):
+        if self.session is None:
+            return
+        data = SymbolData(self.session, symIndexId)
+        self.AddSymbolPage(data)
+        self.DoUpdate()
+
     def BindEvents(self):
         wx.EVT_MENU(self, wx.ID_OPEN, self.OnOpen)
         wx.EVT_MENU(self, wx.ID_CLOSE, self.OnClose)
@@ -464,28 +1066,57 @@ class PyDiaGUI(wx.Frame):
         tree = self.mgr.GetPane("symboltree").window
         self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.OnTreeItemExpanding, tree)
         self.Bind(wx.EVT_TREE_ITEM_ACTIVATED, self.OnTreeItemActivate, tree)
+        self.Bind(wx.EVT_TREE_ITEM_COLLAPSED, self.OnTreeItemCollapsed, tree)
+        self.Bind(wx.EVT_TREE_DELETE_ITEM, self.OnTreeDeleteItem, tree)
+
+        self.moreTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnMoreTimer, self.moreTimer)
 
     def OpenSession(self, path):
-        session = pydia.PyDia(path)
+        """Open a session on the ComThread, OnSessionOpened shows it"""
+        def open():
+            session = pydiacapture.openSession(path)
+            return session, session.globalScope.symIndexId
+        def failed(text):
+            self.statusbar.PopStatusText()
+            self.ShowErrorText(text)
+        self.statusbar.PushStatusText("Loading {}...".format(path))
+        self.comThread.Call(open, lambda result: self.OnSessionOpened(path, *result), failed)
+
+    def OnSessionOpened(self, path, session, symIndexId):
+        self.statusbar.PopStatusText()
+        self.statusbar.SetStatusText("Ready")
         self.CloseSession()
         self.session = session
 
         tree = self.mgr.GetPane("symboltree").Show().window
-        symbol = self.session.globalScope
         image = self.TREE_ART_ROOT_SYMBOL
-        data = SymbolData(session, symbol)
+        data = SymbolData(session, symIndexId)
         root = tree.AddRoot(data.GetTitle(text = path), image)
-        tree.SetPyData(root, data)
+        self.SetItemData(root, data)
+        tree.SetItemHasChildren(root, True)
         self.FillSymbolTreeItem(root)
-        tree.Expand(root)
 
         self.GetMenuBar().FindItemById(wx.ID_CLOSE).Enable(True)
         self.AddSymbolPage(data, tree.GetImageList().GetBitmap(image))
+        self.moreTimer.Start(self.MORE_TIMER_INTERVAL)
+        self.BuildNameIndex()
         self.DoUpdate()
 
     def CloseSession(self):
-        del self.session
+        self.moreTimer.Stop()
+        self.comThread.CancelAll()
+        if self.nameIndex is not None:
+            self.nameIndex.cancel()
+            self.nameIndex = None
+        self.mgr.GetPane("namefilter").Hide().window.SetIndex(None)
+        session = self.session
+        cache = self.symbolCache
         self.session = None
+        self.symbolCache = dict()
+        if session is not None:
+            # the COM objects are released on the thread that created them
+            self.comThread.Call(lambda: ReleaseSession(session, cache))
         
         book = self.mgr.GetPane("book").window
         for page in self.sessionPages:
@@ -498,7 +1129,9 @@ class PyDiaGUI(wx.Frame):
         self.GetMenuBar().FindItemById(wx.ID_CLOSE).Enable(False)
 
     def ShowExceptionInDialog(self):
-        desc = traceback.format_exc()
+        self.ShowErrorText(traceback.format_exc())
+
+    def ShowErrorText(self, desc):
         dlg = wx.MessageDialog(self, desc, 'Error:', wx.OK | wx.ICON_ERROR)
         dlg.ShowModal()
         dlg.Destroy()
@@ -508,77 +1141,151 @@ class PyDiaGUI(wx.Frame):
         tree = self.mgr.GetPane("symboltree").window
         data = tree.GetPyData(item)
         assert data.GetTreeDataType() == TreeData.SEARCH
-        if not data.busy and data.GetNewOptions(self) == wx.ID_OK:
+        if data.busy:
+            result = wx.MessageBox("Cancel the search?", "Find children", wx.YES_NO | wx.ICON_QUESTION, self)
+            if result == wx.YES and data.job:
+                data.job.Cancel()
+        elif data.GetNewOptions(self) == wx.ID_OK:
             parent = tree.GetItemParent(item)
             assert parent.IsOk()
             symdata = tree.GetPyData(parent)
             assert symdata.GetTreeDataType() == TreeData.SYMBOL
 
             data.busy = True
+            tree.DeleteChildren(item)
+            data.SetResults(symdata.session, array.array('L'))
             tree.SetItemText(item, "...(searching)... [{}]".format(','.join(data.GetOptions())))
-            thread.start_new_thread(self._FindChildrenOfSymbol, (item, data, symdata))
+            listener = SearchListener(self, item, data)
+            data.job = self.comThread.Submit(listener, symdata.session, symdata.symIndexId, data.type, data.name or None, data.flags)
 
-    def _FindChildrenOfSymbol(self, item, data, symdata):
-        """runs on worker thread"""
+    def LoadMoreChildren(self, item):
+        """Add the next chunk of search results to the tree"""
         assert item.IsOk()
+        tree = self.mgr.GetPane("symboltree").window
+        data = tree.GetPyData(item)
         assert data.GetTreeDataType() == TreeData.SEARCH
-        assert symdata.GetTreeDataType() == TreeData.SYMBOL
-
-        name = data.name or None
-        type = data.type
-        flags = data.flags
-        children = None
+        tree.Freeze()
         try:
-            # NOTE this can take a long time...
-            children = list(symdata.session.findChildrenEx(symdata.symbol, type, name, flags))
-        except:
-            traceback.print_exc()
-            children = []
-        wx.CallAfter(self.AddChildrenToTree, item, symdata.session, children)
-
-    def AddChildrenToTree(self, item, session, children):
-        assert item.IsOk()
+            if data.moreItem is not None:
+                tree.Delete(data.moreItem)
+                data.moreItem = None
+            # the titles are read by OnMoreTimer when the rows become visible
+            for symIndexId in data.NextChunk():
+                childdata = SymbolData(data.session, symIndexId)
+                childitem = tree.AppendItem(item, childdata.GetTitle(), self.TREE_ART_CHILD_SYMBOL)
+                assert childitem.IsOk()
+                self.SetItemData(childitem, childdata)
+                tree.SetItemHasChildren(childitem)
+            remaining = data.GetRemaining()
+            if remaining > 0:
+                moredata = MoreChildrenData()
+                data.moreItem = tree.AppendItem(item, moredata.GetTitle(remaining), self.TREE_ART_SEARCH_FILTER)
+                self.SetItemData(data.moreItem, moredata)
+        finally:
+            tree.Thaw()
+
+    def ReadTitles(self, children):
+        """Read the titles of symbol items on the ComThread"""
+        if not children:
+            return
+        for childdata in children:
+            childdata.reading = True
+        session = children[0].session
+        symIndexIds = [childdata.symIndexId for childdata in children]
+        def read():
+            titles = []
+            for symIndexId in symIndexIds:
+                try:
+                    titles.append(ReadTitle(session.symbolById(symIndexId)))
+                except Exception as e:
+                    titles.append("{} - {}".format(symIndexId, e))
+            return titles
+        def done(titles):
+            if not self or self.session is not session:
+                return
+            tree = self.mgr.GetPane("symboltree").window
+            for childdata, title in zip(children, titles):
+                childdata.title = title
+                if childdata.item is not None:
+                    tree.SetItemText(childdata.item, title)
+        self.comThread.Call(read, done)
+
+    def OnMoreTimer(self, event):
+        """Read the titles of the visible rows, and load more search results when their placeholder is scrolled into view"""
         tree = self.mgr.GetPane("symboltree").window
-        tree.DeleteChildren(item)
-        for child in children:
-            data = SymbolData(session, child)
-            childitem = tree.AppendItem(item, data.GetTitle(), self.TREE_ART_CHILD_SYMBOL)
-            assert childitem.IsOk()
-            tree.SetPyData(childitem, data)
-            tree.SetItemHasChildren(childitem)
-        data = tree.GetPyData(item)
-        tree.SetItemText(item, data.GetTitle())
-        tree.SetItemHasChildren(item, len(children) > 0)
-        tree.Expand(item)
-        tree.GetPyData(item).busy = False
-        self.DoUpdate()
+        if not tree.IsShown() or tree.GetCount() == 0:
+            return
+        untitled = []
+        item = tree.GetFirstVisibleItem()
+        for i in xrange(self.MORE_TIMER_MAX_ROWS):
+            if not item.IsOk() or not tree.IsVisible(item):
+                break
+            data = tree.GetPyData(item)
+            if data and data.GetTreeDataType() == TreeData.MORE:
+                self.LoadMoreChildren(tree.GetItemParent(item))
+                break
+            if data and data.GetTreeDataType() == TreeData.SYMBOL and data.title is None and not data.reading:
+                untitled.append(data)
+            item = tree.GetNextVisible(item)
+        self.ReadTitles(untitled)
 
     def FillSymbolTreeItem(self, item):
+        """Add the attribute symbols, read on the ComThread, and the search command"""
         tree = self.mgr.GetPane("symboltree").window
         assert item
         assert item.IsOk()
         data = tree.GetPyData(item)
-
-        # attribute symbols
-        for attr in pydia.SymbolPrinter(data.session).attributes(data.symbol):
-            try:
-                value = getattr(data.symbol, attr)
-                if value and value.__class__ is data.symbol.__class__:
-                    image = self.TREE_ART_ATTRIBUTE_SYMBOL
-                    childdata = SymbolData(data.session, value)
-                    childitem = tree.AppendItem(item, childdata.GetTitle(attribute = attr), image)
-                    tree.SetPyData(childitem, childdata)
-                    tree.SetItemHasChildren(childitem, True)
-            except:
-                #traceback.print_exc()
-                pass
-
-        # search filter
-        image = self.TREE_ART_SEARCH_FILTER
-        finddata = FindChildrenData()
-        finditem = tree.AppendItem(item, finddata.GetTitle(), image)
-        tree.SetPyData(finditem, finddata)
-        tree.SetItemHasChildren(finditem, True)
+        if data.filled:
+            return
+        data.filled = True
+        session = data.session
+        symIndexId = data.symIndexId
+
+        def read():
+            symbol = session.symbolById(symIndexId)
+            children = [] # (symIndexId, title)
+            for attr in pydia.SymbolPrinter(session).symbolAttributes(symbol):
+                try:
+                    value = getattr(symbol, attr)
+                    if value:
+                        children.append((value.symIndexId, ReadTitle(value, attr)))
+                except:
+                    #traceback.print_exc()
+                    pass
+            return children
+
+        def done(children):
+            if not self or self.session is not session or data.item is None:
+                return
+            tree = self.mgr.GetPane("symboltree").window
+            item = data.item
+
+            # attribute symbols
+            image = self.TREE_ART_ATTRIBUTE_SYMBOL
+            for symIndexId, title in children:
+                childdata = SymbolData(session, symIndexId, title)
+                childitem = tree.AppendItem(item, title, image)
+                self.SetItemData(childitem, childdata)
+                tree.SetItemHasChildren(childitem, True)
+
+            # search filter
+            image = self.TREE_ART_SEARCH_FILTER
+            finddata = FindChildrenData()
+            finditem = tree.AppendItem(item, finddata.GetTitle(), image)
+            self.SetItemData(finditem, finddata)
+            tree.SetItemHasChildren(finditem, True)
+            tree.Expand(item)
+
+        self.comThread.Call(read, done)
+
+    def SetItemData(self, item, data):
+        self.mgr.GetPane("symboltree").window.SetPyData(item, data)
+        data.item = item
+
+    def OnTreeDeleteItem(self, event):
+        data = event.GetEventObject().GetPyData(event.GetItem())
+        if data is not None:
+            data.item = None # results that arrive later are dropped
 
 #---------------------------------------------------------------------------
 
@@ -608,7 +1315,11 @@ def GetIntroText():
     "</ol>" \
     "<p>Double-click the <code>Find children...</code> command to search for child debug symbols. " \
     "If a search hasn't been performed yet, expanding the command does the same. " \
-    "Symbols found this way appear as tree children of the command.</p>" \
+    "Symbols found this way appear as tree children of the command. " \
+    "Large results are added in chunks when you scroll to the end of the loaded symbols, " \
+    "the names are read as the symbols scroll into view and collapsing the command unloads them.</p>" \
+    "<p>The <code>Name Filter</code> pane searches the names of the global symbols as you type. " \
+    "The names are indexed in the background after the file is loaded.</p>" \
     "<a name='feedback' /><h4>Feedback</h4>" \
     "<p>Please report any bugs or requests of improvement to:</p>" \
     "<ul><li>https://github.com/flaviojs/pydia</li></ul>" \
@@ -0,0 +1,431 @@
+"""
+Header generation for all the types of a session.
+
+The UDTs are the nodes of a dependency graph built in one pass over their
+children. Only the complete types are edges: base classes and members by value
+need the definition of their type, and any use of a nested type needs the
+definition of the class that contains it. Pointers, references, function
+signatures and static members only need a forward declaration, and every
+top-level UDT is forward declared in a common header, so they are not edges.
+
+The nodes are ordered topologically (a by-value cycle is reported and broken)
+and the order is cut into shards of similar size. A shard only includes the
+common header and the earlier shards it depends on, so each shard compiles on
+its own and they can be compiled in parallel:
+    types_fwd.h   forward declarations and top-level enums
+    types_N.h     UDT definitions
+    types.h       includes everything
+Types with the same name are generated once; when their definitions differ the
+first one is kept and the others are noted in a comment.
+
+The names that are not C++ are replaced (see TypeNames). Unnamed types
+(<unnamed-tag>) are named after their symIndexId, and the top-level ones are
+generated once per shape (the pydiadiff.TypeShape digest). Templates are
+opaque: a blob with the length and the natural alignment of the type under an
+identifier made from the name, and the enums of a template scope are in a
+namespace of their own. Every definition is followed by a static_assert on its
+sizeof, so a compiler checks the layouts.
+"""
+import io
+import os
+import re
+import pydia
+import pydiadiff
+import pydialayout
+from pydia import SYMTAG, DATAKIND, UDTKIND_str, DEBUG, DiaEnumSymbolsIterator, EnumPrinter, UdtPrinter
+
+
+def splitName(name):
+    """Split a qualified name on the :: that are outside of template arguments"""
+    parts = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(name):
+        c = name[i]
+        if c == "<":
+            depth += 1
+        elif c == ">":
+            depth -= 1
+        elif depth == 0 and name.startswith("::", i):
+            parts.append(name[start:i])
+            i += 2
+            start = i
+            continue
+        i += 1
+    parts.append(name[start:])
+    return parts
+
+def isUnnamed(name):
+    """True if a type name is the one the compiler gives to unnamed types (<unnamed-tag>, __unnamed, lambdas, ...)"""
+    last = splitName(name)[-1]
+    return last.startswith("<unnamed") or last.startswith("__unnamed") or last.startswith("<anonymous") or last.startswith("<lambda")
+
+def isTemplate(name):
+    """True if a scope of a type name has template arguments"""
+    parts = splitName(name)
+    if isUnnamed(name):
+        parts = parts[:-1]
+    return bool([part for part in parts if part.find("<") != -1])
+
+def identifier(name):
+    """Return a C++ identifier for a name"""
+    ident = re.sub(r"[^0-9A-Za-z_]", "_", name.replace("::", "__"))
+    if not ident or ident[0].isdigit():
+        ident = "_" + ident
+    return ident
+
+def forwardDeclaration(udtKind, name):
+    """Return the line that forward declares a top-level UDT"""
+    parts = splitName(name)
+    if [part for part in parts if part.find("<") != -1]:
+        return "// {} {}; // XXX template, not forward declared".format(UDTKIND_str(udtKind), name)
+    line = "{} {};".format(UDTKIND_str(udtKind), parts[-1])
+    for namespace in reversed(parts[:-1]):
+        line = "namespace {} {{ {} }}".format(namespace, line)
+    return line
+
+
+class TypeNames(object):
+    """I name the UDTs and enums in the headers (the typeNames of the printers)."""
+
+    def __init__(self):
+        self.renamed = {} # symIndexId -> name of a top-level unnamed type
+        self.synthetics = {} # key -> identifier
+        self.identifiers = set()
+
+    def synthetic(self, key, name):
+        """Return the unique identifier made from name for key"""
+        ident = self.synthetics.get(key)
+        if ident is None:
+            base = ident = identifier(name)
+            n = 1
+            while ident in self.identifiers:
+                n += 1
+                ident = "{}_{}".format(base, n)
+            self.identifiers.add(ident)
+            self.synthetics[key] = ident
+        return ident
+
+    def rename(self, symIndexId, name):
+        self.renamed[symIndexId] = name
+        return name
+
+    def unnamed(self, symIndexId):
+        return self.synthetic(("unnamed", symIndexId), "unnamed_{}".format(symIndexId))
+
+    def template(self, name):
+        return self.synthetic(("template", name), name)
+
+    def scopes(self, symbol):
+        """Return the namespaces of a top-level enum definition"""
+        parts = splitName(symbol.name)
+        if isTemplate(symbol.name):
+            return [self.synthetic(("scope", "::".join(parts[:-1])), "::".join(parts[:-1]) + "::scope")]
+        return parts[:-1]
+
+    def name(self, symbol, definition=False):
+        """Return the name of a UDT or enum, in a reference or in its definition"""
+        symIndexId = symbol.symIndexId
+        name = self.renamed.get(symIndexId)
+        if name is not None:
+            return name
+        name = symbol.name
+        if isUnnamed(name):
+            return self.unnamed(symIndexId) # nested, defined in its class
+        if symbol.symTag == SYMTAG.SymTagEnum:
+            if definition:
+                return splitName(name)[-1]
+            if isTemplate(name):
+                return "::".join(self.scopes(symbol) + [splitName(name)[-1]])
+            return name
+        if isTemplate(name):
+            return self.template(name)
+        if definition and symbol.nested:
+            return splitName(name)[-1]
+        return name
+
+    def definedInside(self, symbol):
+        """True if a nested type is defined in its class"""
+        return not isTemplate(symbol.name)
+
+
+class TypeNode(object):
+    """A generated UDT definition."""
+    __slots__ = ("name", "symIndexId", "opaque", "complete", "weight", "broken", "conflicts")
+
+    def __init__(self, name, symIndexId, opaque=False):
+        self.name = name
+        self.symIndexId = symIndexId
+        self.opaque = opaque # template, defined as a blob
+        self.complete = [] # names of the nodes that must be defined first
+        self.weight = 1 # children read, estimates the size of the definition
+        self.broken = [] # complete dependencies dropped to break a cycle
+        self.conflicts = [] # symIndexIds of other definitions with the same name
+
+
+class HeaderGenerator:
+    """I write the types of a session as headers that compile."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.nodes = {} # name -> TypeNode
+        self.forwards = [] # (udtKind, name) of the top-level UDTs
+        self.enums = [] # symIndexIds of the top-level enums
+        self.owners = {} # symIndexId -> name of the top-level UDT that defines it, or None
+        self.analyzer = pydialayout.LayoutAnalyzer(pydia) # alignment of the opaque types
+        self.typeNames = TypeNames()
+        self.shape = None # pydiadiff.TypeShape, created on demand
+        self.duplicates = 0 # identical definitions dropped
+
+    def digest(self, symbol):
+        if self.shape is None:
+            self.shape = pydiadiff.TypeShape(self.pydia)
+        return self.shape.digest(symbol)
+
+    def collect(self):
+        """Build the dependency graph"""
+        candidates = {} # name -> [symbol]
+        names = []
+        forwards = set()
+        unnamed = {} # digest -> name
+        for symbol in self.pydia.findChildrenByTypeEx(SYMTAG.SymTagUDT):
+            name = symbol.name
+            template = isTemplate(name)
+            if symbol.nested and not template:
+                continue # defined inside its class
+            if isUnnamed(name):
+                if symbol.length == 0:
+                    continue
+                digest = self.digest(symbol)
+                if digest in unnamed:
+                    self.typeNames.rename(symbol.symIndexId, unnamed[digest])
+                    self.duplicates += 1
+                    continue
+                name = unnamed[digest] = self.typeNames.rename(symbol.symIndexId, self.typeNames.unnamed(symbol.symIndexId))
+            elif template:
+                name = self.typeNames.template(name)
+            if name not in forwards:
+                forwards.add(name)
+                self.forwards.append((symbol.udtKind, name))
+            if symbol.length == 0:
+                continue # forward declaration
+            if name not in candidates:
+                candidates[name] = []
+                names.append(name)
+            candidates[name].append(symbol)
+        enumNames = set()
+        for symbol in self.pydia.findChildrenByTypeEx(SYMTAG.SymTagEnum):
+            name = symbol.name
+            if symbol.nested and not isTemplate(name):
+                continue
+            if isUnnamed(name):
+                digest = self.digest(symbol)
+                if digest in unnamed:
+                    self.typeNames.rename(symbol.symIndexId, unnamed[digest])
+                    continue
+                name = unnamed[digest] = self.typeNames.rename(symbol.symIndexId, self.typeNames.unnamed(symbol.symIndexId))
+            if name in enumNames:
+                continue
+            enumNames.add(name)
+            self.enums.append(symbol.symIndexId)
+        for name in names:
+            symbols = candidates[name]
+            node = TypeNode(name, symbols[0].symIndexId, isTemplate(symbols[0].name))
+            if len(symbols) > 1:
+                digest = self.digest(symbols[0])
+                for symbol in symbols[1:]:
+                    if self.digest(symbol) == digest:
+                        self.duplicates += 1
+                    else:
+                        node.conflicts.append(symbol.symIndexId)
+            self.nodes[name] = node
+        for name in names:
+            if not self.nodes[name].opaque:
+                self.addDependencies(self.nodes[name], candidates[name][0])
+        DEBUG("HeaderGenerator.collect", "{} UDTs, {} enums, {} forward declarations, {} duplicates".format(
+            len(self.nodes), len(self.enums), len(self.forwards), self.duplicates))
+
+    def owner(self, symbol):
+        """Return the name of the node that defines a nested UDT or enum, or None"""
+        symIndexId = symbol.symIndexId
+        if symIndexId not in self.owners:
+            parent = symbol
+            while parent.nested and parent.classParent and not isTemplate(parent.name):
+                parent = parent.classParent
+            name = self.typeNames.name(parent)
+            self.owners[symIndexId] = name in self.nodes and name or None
+        return self.owners[symIndexId]
+
+    def typeDependencies(self, symbol, complete, byValue=True):
+        """Add the nodes that must be defined to use a type"""
+        while symbol:
+            symTag = symbol.symTag
+            if symTag == SYMTAG.SymTagArrayType:
+                symbol = symbol.type
+            elif symTag == SYMTAG.SymTagPointerType:
+                byValue = False
+                symbol = symbol.type
+            elif symTag == SYMTAG.SymTagFunctionType:
+                for arg in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagFunctionArgType, None, 0)):
+                    self.typeDependencies(arg.type, complete, False)
+                byValue = False
+                symbol = symbol.type
+            else:
+                if symTag == SYMTAG.SymTagUDT and byValue or symTag in (SYMTAG.SymTagUDT, SYMTAG.SymTagEnum) and symbol.nested:
+                    name = self.owner(symbol)
+                    if name is not None:
+                        complete.add(name)
+                return
+
+    def addDependencies(self, node, symbol):
+        """Read the children of a UDT (and of its nested UDTs) into node"""
+        complete = set()
+        parents = [symbol]
+        while parents:
+            parent = parents.pop()
+            parentId = parent.symIndexId
+            for child in DiaEnumSymbolsIterator(parent.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+                node.weight += 1
+                symTag = child.symTag
+                if symTag == SYMTAG.SymTagBaseClass:
+                    self.typeDependencies(child.type, complete)
+                elif child.classParentId != parentId:
+                    continue # belongs to a base class
+                elif symTag == SYMTAG.SymTagData:
+                    self.typeDependencies(child.type, complete, child.dataKind == DATAKIND.DataIsMember)
+                elif symTag in (SYMTAG.SymTagFunction, SYMTAG.SymTagTypedef):
+                    self.typeDependencies(child.type, complete, False)
+                elif symTag == SYMTAG.SymTagUDT and child.symIndexId != parentId:
+                    parents.append(child)
+        complete.discard(node.name)
+        node.complete = sorted(complete)
+
+    def order(self):
+        """Return the node names with the dependencies first, breaking the by-value cycles"""
+        VISITING, DONE = 1, 2
+        state = {}
+        order = []
+        for name in sorted(self.nodes):
+            if name in state:
+                continue
+            state[name] = VISITING
+            stack = [(name, iter(self.nodes[name].complete))]
+            while stack:
+                current, dependencies = stack[-1]
+                for dependency in dependencies:
+                    if dependency not in state:
+                        state[dependency] = VISITING
+                        stack.append((dependency, iter(self.nodes[dependency].complete)))
+                        break
+                    if state[dependency] == VISITING:
+                        DEBUG("HeaderGenerator.order", "dependency cycle", current, dependency)
+                        self.nodes[current].broken.append(dependency)
+                else:
+                    stack.pop()
+                    state[current] = DONE
+                    order.append(current)
+        return order
+
+    def shard(self, order, count):
+        """Cut the order into count lists of similar weight"""
+        count = max(1, min(count, len(order)))
+        target = float(sum([self.nodes[name].weight for name in order])) / count
+        shards = [[]]
+        weight = 0
+        for name in order:
+            if weight >= target * len(shards) and len(shards) < count:
+                shards.append([])
+            shards[-1].append(name)
+            weight += self.nodes[name].weight
+        return shards
+
+    def defineLines(self, node):
+        lines = []
+        for dependency in node.broken:
+            lines.append("// XXX dependency cycle, {} is not defined yet".format(dependency))
+        for symIndexId in node.conflicts:
+            lines.append("// XXX #{} is another definition of {} (not generated)".format(symIndexId, node.name))
+        symbol = self.pydia.symbolById(node.symIndexId)
+        if node.opaque:
+            lines += self.opaqueLines(node, symbol)
+        else:
+            try:
+                lines += UdtPrinter(self.pydia, typeNames=self.typeNames).defineLines(symbol)
+            except AssertionError, e:
+                lines.append("// XXX {} #{} not generated: {}".format(node.name, node.symIndexId, e))
+                return lines
+        lines.append('static_assert(sizeof({0}) == {1}, "sizeof({0}) != {1}");'.format(node.name, symbol.length))
+        return lines
+
+    def opaqueLines(self, node, symbol):
+        """Return the definition of a template as a blob"""
+        length = symbol.length
+        alignment = self.analyzer.alignment(symbol)
+        while length % alignment:
+            alignment /= 2 # packed
+        return [
+            "{} alignas({}) {} // {} #{}".format(UDTKIND_str(symbol.udtKind), alignment, node.name, symbol.name, symbol.symIndexId),
+            "{",
+            "\tunsigned char opaque[{}];".format(length),
+            "};",
+            ]
+
+    def enumLines(self, symbol):
+        """Return the definition of a top-level enum in its namespaces"""
+        lines = EnumPrinter(self.pydia, typeNames=self.typeNames).defineLines(symbol)
+        if symbol.symIndexId in self.typeNames.renamed:
+            return lines # unnamed
+        scopes = self.typeNames.scopes(symbol)
+        if not scopes:
+            return lines
+        return [" ".join(["namespace {} {{".format(scope) for scope in scopes])] + lines + ["}" * len(scopes)]
+
+    def write(self, directory, count=1, basename="types"):
+        """Write the headers to directory, returns their filepaths"""
+        if not self.nodes and not self.forwards:
+            self.collect()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        header = "// generated by pydia from {}".format(os.path.basename(self.pydia.targetFilepath))
+        filepaths = []
+        # forward declarations and enums
+        filename = "{}_fwd.h".format(basename)
+        lines = [header, "#pragma once", ""]
+        lines += [forwardDeclaration(udtKind, name) for udtKind, name in self.forwards]
+        for symIndexId in self.enums:
+            lines.append("")
+            lines += self.enumLines(self.pydia.symbolById(symIndexId))
+        filepaths.append(self.writeLines(directory, filename, lines))
+        # definitions
+        shards = self.shard(self.order(), count)
+        shardOf = {}
+        for index, names in enumerate(shards):
+            for name in names:
+                shardOf[name] = index
+        filenames = []
+        for index, names in enumerate(shards):
+            includes = set()
+            for name in names:
+                includes.update([shardOf[dependency] for dependency in self.nodes[name].complete if shardOf[dependency] < index])
+            lines = [header, "#pragma once", '#include "{}"'.format(filename)]
+            lines += ['#include "{}_{}.h"'.format(basename, i) for i in sorted(includes)]
+            for name in names:
+                lines.append("")
+                lines += self.defineLines(self.nodes[name])
+            filenames.append("{}_{}.h".format(basename, index))
+            filepaths.append(self.writeLines(directory, filenames[-1], lines))
+        # everything
+        lines = [header, "#pragma once", '#include "{}"'.format(filename)]
+        lines += ['#include "{}"'.format(name) for name in filenames]
+        filepaths.append(self.writeLines(directory, "{}.h".format(basename), lines))
+        return filepaths
+
+    def writeLines(self, directory, filename, lines):
+        filepath = os.path.join(directory, filename)
+        with io.open(filepath, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(unicode(line))
+                f.write(u"\n")
+        DEBUG("HeaderGenerator.write", filepath, "{} lines".format(len(lines)))
+        return filepath
@@ -0,0 +1,417 @@
+"""
+In-memory indexes of a session.
+
+NameIndex holds the names of the globalScope children, sorted case-insensitively,
+for prefix and substring queries that are fast enough to run on every keystroke.
+ClassHierarchy holds the base classes of every UDT as integer arrays, for
+ancestor/descendant queries, and is persisted in the offline cache.
+TypeUsageIndex maps each type to the functions, data, members and typedefs
+that use it.
+"""
+import array
+import bisect
+import itertools
+import json
+import pydia
+from pydia import SYMTAG, DEBUG, DiaEnumSymbolsIterator
+
+
+class NameIndex(object):
+    """Names, symIndexIds and symTags of the globalScope children.
+    Entries are sorted by lowercase name; the names are also joined in a single
+    string, shortest first, so a substring query is a str.find loop that finds
+    the matches in rank order and stops after limit of them."""
+
+    SEPARATOR = u"\n"
+    SCAN_LIMIT = 20000 # entries examined per query, when the symTags reject most of them
+    BUILD_CHUNK = 1000 # children read per step of buildSteps
+
+    def __init__(self):
+        self.names = [] # original names, sorted by lowercase name
+        self.keys = [] # lowercase unicode names
+        self.symIndexIds = array.array('L')
+        self.symTags = array.array('B')
+        self.blob = u"" # SEPARATOR + keys joined by SEPARATOR, by (length, entry)
+        self.offsets = array.array('L') # position of each key in blob
+        self.order = array.array('L') # entry of each key in blob
+        self.cancelled = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def cancel(self):
+        """Stop a build in progress"""
+        self.cancelled = True
+
+    def build(self, pydia, symbol = None):
+        """Index the children of symbol (default globalScope), returns False if cancelled"""
+        for step in self.buildSteps(pydia, symbol):
+            pass
+        return not self.cancelled
+
+    def buildSteps(self, pydia, symbol = None):
+        """Generator of build, yields after every BUILD_CHUNK children (the GUI runs a step at a time)"""
+        entries = []
+        for n, child in enumerate(pydia.findChildrenEx(symbol)):
+            if self.cancelled:
+                return
+            name = child.name
+            if name:
+                entries.append((unicode(name).lower(), name, child.symIndexId, child.symTag))
+            if n % self.BUILD_CHUNK == self.BUILD_CHUNK - 1:
+                yield n + 1
+        if self.cancelled:
+            return
+        entries.sort()
+        self.setEntries(entries)
+        DEBUG("NameIndex.build", "{} names".format(len(self)))
+
+    def setEntries(self, entries):
+        """Set the index from a sorted list of (key, name, symIndexId, symTag)"""
+        self.keys = [entry[0] for entry in entries]
+        self.names = [entry[1] for entry in entries]
+        self.symIndexIds = array.array('L', [entry[2] for entry in entries])
+        self.symTags = array.array('B', [entry[3] for entry in entries])
+        keys = self.keys
+        self.order = array.array('L', sorted(xrange(len(keys)), key = lambda i: (len(keys[i]), i)))
+        self.offsets = array.array('L')
+        offset = len(self.SEPARATOR)
+        for i in self.order:
+            self.offsets.append(offset)
+            offset += len(keys[i]) + len(self.SEPARATOR)
+        self.blob = self.SEPARATOR + self.SEPARATOR.join([keys[i] for i in self.order]) + self.SEPARATOR
+
+    def prefixRange(self, key):
+        """Return the (start, end) entries whose key starts with key"""
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + u"\uffff")
+        return start, end
+
+    def firstAccepted(self, start, end, accept, limit):
+        """Return the first limit entries of [start, end) that are accepted"""
+        results = []
+        for i in xrange(start, min(end, start + self.SCAN_LIMIT)):
+            if accept(i):
+                results.append(i)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def substringMatches(self, key, accept):
+        """Yield the entries that contain key but don't start with it, shorter keys first"""
+        pos = self.blob.find(key)
+        for scanned in xrange(self.SCAN_LIMIT):
+            if pos == -1:
+                break
+            j = bisect.bisect_right(self.offsets, pos) - 1
+            i = self.order[j]
+            if pos != self.offsets[j] and accept(i):
+                yield i
+            # continue after this entry
+            pos = self.blob.find(key, self.offsets[j] + len(self.keys[i]))
+
+    def query(self, text, symTags = None, limit = 200):
+        """Return up to limit entry indexes matching text, ranked:
+        prefix matches in sorted order (the exact matches come first), then
+        substring matches, shorter names first; at most SCAN_LIMIT entries of
+        each kind are examined"""
+        key = unicode(text).lower()
+        if symTags is not None:
+            symTags = frozenset(symTags)
+        def accept(i):
+            return symTags is None or self.symTags[i] in symTags
+        if not key:
+            return self.firstAccepted(0, len(self.keys), accept, limit)
+        start, end = self.prefixRange(key)
+        results = self.firstAccepted(start, end, accept, limit)
+        if len(results) < limit:
+            results += itertools.islice(self.substringMatches(key, accept), limit - len(results))
+        return results
+
+    def entry(self, i):
+        """Return (name, symIndexId, symTag) of entry i"""
+        return self.names[i], self.symIndexIds[i], self.symTags[i]
+
+
+class ClassHierarchy(object):
+    """Inheritance graph of the UDTs, built in one pass.
+    Classes are dense indexes; the parents and the children of each class are
+    slices of integer arrays (CSR), so queries only touch the classes in the result."""
+
+    CACHE_NAME = "hierarchy.bin"
+    CACHE_VERSION = 1
+
+    def __init__(self):
+        self.symIndexIds = array.array('L') # class -> symIndexId
+        self.names = [] # class -> name
+        self.parentStart = array.array('L', [0]) # parents of class i are parents[parentStart[i]:parentStart[i+1]]
+        self.parents = array.array('L')
+        self.virtualParents = array.array('B') # 1 if the parent is a virtual base
+        self.childStart = array.array('L', [0])
+        self.children = array.array('L')
+        self.classById = dict() # symIndexId -> class
+        self.classesByName = dict() # name -> [class]
+
+    def __len__(self):
+        return len(self.symIndexIds)
+
+    def build(self, pydia):
+        """Index the base classes of every UDT"""
+        udts = pydia.findChildrenByTypeEx(SYMTAG.SymTagUDT)
+        edges = [] # (child symIndexId, [(parent symIndexId, virtual)])
+        symIndexIds = []
+        names = []
+        for udt in udts:
+            symIndexId = udt.symIndexId
+            symIndexIds.append(symIndexId)
+            names.append(udt.name)
+            bases = []
+            for base in pydia.findChildrenByTypeEx(SYMTAG.SymTagBaseClass, udt):
+                if base.indirectVirtualBaseClass:
+                    continue
+                baseType = base.type
+                if baseType: # NULL pointer is false
+                    bases.append((baseType.symIndexId, base.virtualBaseClass and 1 or 0))
+            edges.append(bases)
+        self.setGraph(symIndexIds, names, edges)
+        DEBUG("ClassHierarchy.build", "{} classes, {} base classes".format(len(self), len(self.parents)))
+
+    def setGraph(self, symIndexIds, names, edges):
+        """Set the graph from the symIndexId, name and [(parent symIndexId, virtual)] of each class"""
+        self.symIndexIds = array.array('L', symIndexIds)
+        self.names = list(names)
+        self.classById = dict([(symIndexId, i) for i, symIndexId in enumerate(self.symIndexIds)])
+        self.parentStart = array.array('L', [0])
+        self.parents = array.array('L')
+        self.virtualParents = array.array('B')
+        childCount = [0] * len(self.symIndexIds)
+        for bases in edges:
+            for parentId, virtual in bases:
+                parent = self.classById.get(parentId)
+                if parent is None:
+                    continue # not a UDT of the global scope
+                self.parents.append(parent)
+                self.virtualParents.append(virtual)
+                childCount[parent] += 1
+            self.parentStart.append(len(self.parents))
+        # children, by counting sort of the parent edges
+        self.childStart = array.array('L', [0])
+        for count in childCount:
+            self.childStart.append(self.childStart[-1] + count)
+        self.children = array.array('L', [0] * len(self.parents))
+        fill = array.array('L', self.childStart[:-1])
+        for i in xrange(len(self.symIndexIds)):
+            for edge in xrange(self.parentStart[i], self.parentStart[i + 1]):
+                parent = self.parents[edge]
+                self.children[fill[parent]] = i
+                fill[parent] += 1
+        self.indexNames()
+
+    def indexNames(self):
+        self.classesByName = dict()
+        for i, name in enumerate(self.names):
+            self.classesByName.setdefault(name, []).append(i)
+
+    # persistence
+
+    def serialize(self):
+        names = u"\n".join([unicode(name or u"") for name in self.names]).encode("utf-8")
+        header = json.dumps(dict(version=self.CACHE_VERSION, classes=len(self), edges=len(self.parents), names=len(names)))
+        return "".join([header, "\n", self.symIndexIds.tostring(), self.parentStart.tostring(),
+                        self.parents.tostring(), self.virtualParents.tostring(), names])
+
+    def deserialize(self, data):
+        """Set the graph from serialize() data, returns False if the data is not usable"""
+        end = data.find("\n")
+        try:
+            header = json.loads(data[:end])
+        except ValueError:
+            return False
+        if header.get("version") != self.CACHE_VERSION:
+            return False
+        pos = end + 1
+        def take(typecode, count):
+            a = array.array(typecode)
+            size = a.itemsize * count
+            a.fromstring(data[pos:pos + size])
+            return a, pos + size
+        classes, edges = header["classes"], header["edges"]
+        symIndexIds, pos = take('L', classes)
+        parentStart, pos = take('L', classes + 1)
+        parents, pos = take('L', edges)
+        virtualParents, pos = take('B', edges)
+        names = data[pos:pos + header["names"]].decode("utf-8").split(u"\n") if classes else []
+        edgeList = [[(symIndexIds[parents[edge]], virtualParents[edge]) for edge in xrange(parentStart[i], parentStart[i + 1])]
+                    for i in xrange(classes)]
+        self.setGraph(symIndexIds, names, edgeList)
+        return True
+
+    def loadOrBuild(self, pydia, cache):
+        """Load the graph from an OfflineCache, or build it and save it there"""
+        data = cache.load(self.CACHE_NAME)
+        if data is not None and self.deserialize(data):
+            DEBUG("ClassHierarchy.loadOrBuild", "loaded {} classes from the cache".format(len(self)))
+            return
+        self.build(pydia)
+        cache.save(self.CACHE_NAME, self.serialize())
+
+    # queries
+
+    def find(self, name):
+        """Return the classes with name"""
+        return self.classesByName.get(name, [])
+
+    def parentsOf(self, i):
+        return self.parents[self.parentStart[i]:self.parentStart[i + 1]]
+
+    def childrenOf(self, i):
+        return self.children[self.childStart[i]:self.childStart[i + 1]]
+
+    def walk(self, i, neighbours):
+        """Return the classes reachable from i (breadth first, i excluded)"""
+        seen = set([i])
+        result = []
+        queue = [i]
+        head = 0
+        while head < len(queue):
+            for j in neighbours(queue[head]):
+                if j not in seen:
+                    seen.add(j)
+                    result.append(j)
+                    queue.append(j)
+            head += 1
+        return result
+
+    def ancestors(self, i):
+        return self.walk(i, self.parentsOf)
+
+    def descendants(self, i):
+        return self.walk(i, self.childrenOf)
+
+    def lowestCommonAncestors(self, a, b):
+        """Return the common ancestors of a and b (or themselves) that aren't ancestors of another common ancestor.
+        Linear in the ancestors of a and b: every ancestor of a common ancestor is common, so a common
+        ancestor is dominated exactly when it is the parent of another one."""
+        ancestorsOfA = set([a] + self.ancestors(a))
+        common = [j for j in [b] + self.ancestors(b) if j in ancestorsOfA]
+        dominated = set()
+        for j in common:
+            dominated.update(self.parentsOf(j))
+        return [j for j in common if j not in dominated]
+
+    def diamondBases(self, i):
+        """Return the ancestors of i that are reached through more than one path"""
+        paths = dict() # ancestor -> number of paths, counted in topological order
+        order = [i] + self.ancestors(i)
+        paths[i] = 1
+        # an ancestor's path count is complete once all its descendants in the subgraph were counted
+        pending = dict([(j, 0) for j in order])
+        for j in order:
+            for k in self.parentsOf(j):
+                pending[k] += 1
+        ready = [i]
+        diamonds = []
+        while ready:
+            j = ready.pop()
+            if paths[j] > 1:
+                diamonds.append(j)
+            for k in self.parentsOf(j):
+                paths[k] = paths.get(k, 0) + paths[j]
+                pending[k] -= 1
+                if pending[k] == 0:
+                    ready.append(k)
+        return diamonds
+
+    def diamonds(self):
+        """Return the classes that inherit a base through more than one path"""
+        return [i for i in xrange(len(self)) if self.parentStart[i + 1] - self.parentStart[i] > 1 and self.diamondBases(i)]
+
+
+USAGE = pydia.enum("UsageData","UsageMember","UsageParam","UsageReturn","UsageTypedef","UsageBase")
+def USAGE_name(value):
+    for name in USAGE.__dict__.keys():
+        if name.startswith("Usage") and getattr(USAGE, name) == value:
+            return name
+    return "USAGE_name({})".format(value)
+
+# types that wrap another type, the usage is of the wrapped type
+# (a cv-qualified type is a symbol of its own whose unmodifiedType is the plain type)
+WRAPPER_SYMTAGS = (SYMTAG.SymTagPointerType, SYMTAG.SymTagArrayType)
+
+
+class TypeUsageIndex(object):
+    """Reverse index from a type to the symbols that use it, built in one pass.
+    Modifiers, pointers and arrays are looked through, so a const CPc* parameter
+    is a use of CPc."""
+
+    def __init__(self):
+        self.usages = dict() # type symIndexId -> (array of user symIndexIds, array of USAGE)
+        self.resolved = dict() # type symIndexId -> symIndexId of the wrapped type
+        self.seen = set() # (type, user, usage)
+
+    def build(self, pydia):
+        """Index the functions, data, typedefs and UDT members/bases of the global scope"""
+        for symbol in pydia.findChildrenEx():
+            symTag = symbol.symTag
+            if symTag == SYMTAG.SymTagFunction:
+                self.addSignature(symbol, symbol.type)
+            elif symTag == SYMTAG.SymTagData:
+                self.add(symbol.type, symbol, USAGE.UsageData)
+            elif symTag == SYMTAG.SymTagTypedef:
+                self.add(symbol.type, symbol, USAGE.UsageTypedef)
+            elif symTag == SYMTAG.SymTagUDT:
+                for child in pydia.findChildrenEx(symbol):
+                    childSymTag = child.symTag
+                    if childSymTag == SYMTAG.SymTagData:
+                        self.add(child.type, child, USAGE.UsageMember)
+                    elif childSymTag == SYMTAG.SymTagBaseClass:
+                        self.add(child.type, child, USAGE.UsageBase)
+                    elif childSymTag == SYMTAG.SymTagFunction:
+                        self.addSignature(child, child.type)
+        self.seen = set()
+        DEBUG("TypeUsageIndex.build", "{} types used".format(len(self.usages)))
+
+    def addSignature(self, function, functionType):
+        if not functionType: # NULL pointer
+            return
+        self.add(functionType.type, function, USAGE.UsageReturn)
+        for arg in DiaEnumSymbolsIterator(functionType.findChildrenEx(SYMTAG.SymTagFunctionArgType, None, 0)):
+            self.add(arg.type, function, USAGE.UsageParam)
+
+    def resolve(self, symbol):
+        """Return the symIndexId of the type wrapped by const/volatile modifiers, pointers and arrays"""
+        symIndexId = symbol.symIndexId
+        target = self.resolved.get(symIndexId)
+        if target is None:
+            unmodified = symbol.unmodifiedType
+            if unmodified and unmodified.symIndexId != symIndexId: # NULL pointer is false
+                target = self.resolve(unmodified)
+            elif symbol.symTag in WRAPPER_SYMTAGS and symbol.type:
+                target = self.resolve(symbol.type)
+            else:
+                target = symIndexId
+            self.resolved[symIndexId] = target
+        return target
+
+    def add(self, typeSymbol, user, usage):
+        if not typeSymbol: # NULL pointer
+            return
+        typeId = self.resolve(typeSymbol)
+        userId = user.symIndexId
+        key = (typeId, userId, usage)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        entry = self.usages.get(typeId)
+        if entry is None:
+            entry = (array.array('L'), array.array('B'))
+            self.usages[typeId] = entry
+        entry[0].append(userId)
+        entry[1].append(usage)
+
+    def users(self, symIndexId):
+        """Return [(user symIndexId, USAGE)] of a type"""
+        entry = self.usages.get(symIndexId)
+        if entry is None:
+            return []
+        return zip(entry[0], entry[1])
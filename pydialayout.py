@@ -0,0 +1,277 @@
+"""
+Struct layout analysis (pahole style).
+
+For every UDT: the extent of each member (bitfields included), the holes
+between members, the tail padding, the wasted bytes and the members that
+cross a cacheline. The summary is a table that can be sorted by any column
+to find the worst packed types of a program database.
+
+Virtual bases have no offset in the PDB (it is in the vbtable), so they are
+placed the way MSVC does: after the non-virtual part of the most derived class
+(rounded up to its alignment), in the order of the vbtable, each aligned and
+sized as its own non-virtual part. The vbptr is a field at
+virtualBasePointerOffset unless a base class holds it. vtordisp fields are
+not modeled and show up as holes before the virtual bases.
+"""
+import pydia
+from pydia import SYMTAG, DATAKIND, LOCATIONTYPE, UDTKIND, DEBUG, DiaEnumSymbolsIterator
+
+
+CACHELINE_SIZE = 64
+
+# summary columns: (key, header, width, value format)
+LAYOUT_COLUMNS = (
+    ("name", "name", "<40", ""),
+    ("length", "size", ">8", ""),
+    ("members", "members", ">8", ""),
+    ("holes", "holes", ">6", ""),
+    ("holeBytes", "hole B", ">7", ""),
+    ("bitHoles", "bit holes", ">9", ""),
+    ("tailPadding", "tail B", ">7", ""),
+    ("wasted", "wasted B", ">9", ""),
+    ("wastedPercent", "wasted %", ">9", ".1f"),
+    ("cachelines", "lines", ">6", ""),
+    ("crossings", "crossing", ">9", ""),
+    )
+LAYOUT_SORT_KEYS = tuple([column[0] for column in LAYOUT_COLUMNS])
+
+
+class LayoutMember(object):
+    """A field of a UDT layout: member, base class, virtual base, vfptr or vbptr."""
+    __slots__ = ("name", "kind", "offset", "length", "bitPosition", "bitLength", "typeId")
+
+    def __init__(self, name, kind, offset, length, bitPosition=None, bitLength=None, typeId=None):
+        self.name = name
+        self.kind = kind # "member", "base", "vbase", "vfptr", "vbptr"
+        self.offset = offset # bytes
+        self.length = length # bytes (storage unit for bitfields)
+        self.bitPosition = bitPosition
+        self.bitLength = bitLength
+        self.typeId = typeId # symIndexId of the type (storage unit type for bitfields)
+
+    def end(self):
+        return self.offset + self.length
+
+    def isBitField(self):
+        return self.bitLength is not None
+
+    def crossesCacheline(self, cachelineSize=CACHELINE_SIZE):
+        return self.length > 0 and self.offset // cachelineSize != (self.end() - 1) // cachelineSize
+
+
+class UdtLayout(object):
+    """Layout of one UDT."""
+
+    def __init__(self, name, symIndexId, length, udtKind, members, cachelineSize=CACHELINE_SIZE):
+        self.name = name
+        self.symIndexId = symIndexId
+        self.length = length
+        self.udtKind = udtKind
+        self.members = sorted(members, key=lambda member: (member.offset, member.bitPosition or 0))
+        self.cachelineSize = cachelineSize
+        self.analyze()
+
+    def analyze(self):
+        self.holes = [] # (offset, bytes) between members
+        self.bitHoles = [] # (offset, bitPosition, bits) unused bits inside bitfield storage units
+        end = 0
+        union = self.udtKind == UDTKIND.UdtUnion
+        bitUnit = None # (offset, length, used bits) of the current bitfield storage unit
+        for member in self.members:
+            if member.isBitField():
+                if bitUnit is not None and bitUnit[0] == member.offset:
+                    bitUnit[2].append((member.bitPosition, member.bitLength))
+                    continue
+                self.closeBitUnit(bitUnit)
+                bitUnit = [member.offset, member.length, [(member.bitPosition, member.bitLength)]]
+            else:
+                self.closeBitUnit(bitUnit)
+                bitUnit = None
+            if not union and member.offset > end:
+                self.holes.append((end, member.offset - end))
+            end = max(end, member.end())
+        self.closeBitUnit(bitUnit)
+        self.dataEnd = end
+        self.tailPadding = max(0, self.length - end) if self.members else 0
+
+    def closeBitUnit(self, bitUnit):
+        if bitUnit is None:
+            return
+        offset, length, used = bitUnit
+        position = 0
+        for bitPosition, bitLength in sorted(used):
+            if bitPosition > position:
+                self.bitHoles.append((offset, position, bitPosition - position))
+            position = max(position, bitPosition + bitLength)
+        if position < length * 8:
+            self.bitHoles.append((offset, position, length * 8 - position))
+
+    def summary(self):
+        """Return a dict with the LAYOUT_COLUMNS values"""
+        holeBytes = sum([size for offset, size in self.holes])
+        bitHoles = sum([bits for offset, position, bits in self.bitHoles])
+        wasted = holeBytes + self.tailPadding
+        return dict(
+            name=self.name,
+            length=self.length,
+            members=len(self.members),
+            holes=len(self.holes),
+            holeBytes=holeBytes,
+            bitHoles=bitHoles,
+            tailPadding=self.tailPadding,
+            wasted=wasted,
+            wastedPercent=self.length and 100.0 * wasted / self.length or 0.0,
+            cachelines=(self.length + self.cachelineSize - 1) // self.cachelineSize,
+            crossings=len([member for member in self.members if member.crossesCacheline(self.cachelineSize)]),
+            )
+
+    def lines(self):
+        """Return a pahole-like listing of the layout"""
+        lines = []
+        lines.append("{} {} {{ // sizeof={} #{}".format(pydia.UDTKIND_str(self.udtKind), self.name, self.length, self.symIndexId))
+        union = self.udtKind == UDTKIND.UdtUnion
+        end = 0
+        line = 0
+        for member in self.members:
+            if not union and member.offset > end:
+                lines.append("\t/* XXX {} bytes hole */".format(member.offset - end))
+            while member.offset >= (line + 1) * self.cachelineSize:
+                line += 1
+                lines.append("\t/* --- cacheline {} boundary ({} bytes) --- */".format(line, line * self.cachelineSize))
+            if member.isBitField():
+                where = "/* {:>5}:{:>2} {:>4} */".format(member.offset, member.bitPosition, member.length)
+                what = "{} : {};".format(member.name, member.bitLength)
+            else:
+                where = "/* {:>5}    {:>4} */".format(member.offset, member.length)
+                what = "{};".format(member.name)
+            note = ""
+            if member.crossesCacheline(self.cachelineSize):
+                note = " // crosses a cacheline"
+            lines.append("\t{} {} {}{}".format(where, member.kind, what, note))
+            end = max(end, member.end())
+        for offset, position, bits in self.bitHoles:
+            lines.append("\t/* XXX {} bits hole at {}:{} */".format(bits, offset, position))
+        if self.tailPadding:
+            lines.append("\t/* XXX {} bytes tail padding */".format(self.tailPadding))
+        summary = self.summary()
+        lines.append("}}; // {} holes ({} bytes), {} bytes wasted, {} cachelines, {} crossing".format(
+            summary["holes"], summary["holeBytes"], summary["wasted"], summary["cachelines"], summary["crossings"]))
+        return lines
+
+
+class LayoutAnalyzer:
+    """I compute the layout of UDTs."""
+
+    def __init__(self, pydia, cachelineSize=CACHELINE_SIZE):
+        self.pydia = pydia
+        self.cachelineSize = cachelineSize
+        self.alignments = {} # symIndexId of a type -> natural alignment
+        self.nonVirtualLengths = {} # symIndexId of a UDT -> length without its virtual bases
+
+    def alignment(self, symbol):
+        """Return the natural alignment of a type (default packing)"""
+        symIndexId = symbol.symIndexId
+        alignment = self.alignments.get(symIndexId)
+        if alignment is None:
+            self.alignments[symIndexId] = 1 # cycles
+            symTag = symbol.symTag
+            if symTag in (SYMTAG.SymTagArrayType, SYMTAG.SymTagTypedef):
+                alignment = symbol.type and self.alignment(symbol.type) or 1
+            elif symTag == SYMTAG.SymTagUDT:
+                alignment = 1
+                for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+                    childSymTag = child.symTag
+                    if childSymTag == SYMTAG.SymTagBaseClass or childSymTag == SYMTAG.SymTagVTable or \
+                            childSymTag == SYMTAG.SymTagData and child.dataKind == DATAKIND.DataIsMember:
+                        alignment = max(alignment, child.type and self.alignment(child.type) or 1)
+            else:
+                alignment = min(max(symbol.length or 1, 1), 8)
+            self.alignments[symIndexId] = alignment
+        return alignment
+
+    def nonVirtualLength(self, symbol):
+        """Return the length of a UDT without its virtual bases (its length as a virtual base)"""
+        if symbol.symIndexId not in self.nonVirtualLengths:
+            self.layout(symbol)
+        return self.nonVirtualLengths[symbol.symIndexId]
+
+    def layout(self, symbol):
+        """Return the UdtLayout of a UDT"""
+        symIndexId = symbol.symIndexId
+        members = []
+        virtualBases = {} # virtualBaseDispIndex -> SymTagBaseClass
+        vbptrs = {} # offset -> length
+        for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+            symTag = child.symTag
+            if symTag == SYMTAG.SymTagBaseClass:
+                if child.virtualBaseClass:
+                    virtualBases.setdefault(child.virtualBaseDispIndex, child) # direct and indirect
+                    vbptrType = child.virtualBaseTableType
+                    vbptrs[child.virtualBasePointerOffset] = vbptrType and vbptrType.length or 4
+                else:
+                    baseType = child.type
+                    length = baseType and self.nonVirtualLength(baseType) or child.length # its virtual bases are placed here
+                    members.append(LayoutMember(child.name, "base", child.offset, length, typeId=child.typeId))
+            elif child.classParentId != symIndexId:
+                continue # belongs to a base class
+            elif symTag == SYMTAG.SymTagData:
+                if child.dataKind != DATAKIND.DataIsMember:
+                    continue # static members, constants...
+                locationType = child.locationType
+                name = child.name.split("::")[-1]
+                if locationType == LOCATIONTYPE.LocIsBitField:
+                    members.append(LayoutMember(name, "member", child.offset, child.type.length, child.bitPosition, child.length, child.typeId))
+                elif locationType == LOCATIONTYPE.LocIsThisRel:
+                    members.append(LayoutMember(name, "member", child.offset, child.length or child.type.length, typeId=child.typeId))
+            elif symTag == SYMTAG.SymTagVTable:
+                members.append(LayoutMember("__vfptr", "vfptr", child.offset, child.type.length, typeId=child.typeId))
+        bases = [member for member in members if member.kind == "base"]
+        for offset, length in sorted(vbptrs.iteritems()):
+            if not [base for base in bases if base.offset <= offset < base.end()]:
+                members.append(LayoutMember("__vbptr", "vbptr", offset, length))
+        end = max([member.end() for member in members] or [0])
+        if virtualBases:
+            alignment = self.alignment(symbol)
+            end = (end + alignment - 1) // alignment * alignment
+        self.nonVirtualLengths[symIndexId] = virtualBases and end or symbol.length
+        for index in sorted(virtualBases):
+            base = virtualBases[index]
+            baseType = base.type
+            if not baseType:
+                continue
+            alignment = self.alignment(baseType)
+            offset = (end + alignment - 1) // alignment * alignment
+            length = self.nonVirtualLength(baseType)
+            members.append(LayoutMember(base.name, "vbase", offset, length, typeId=base.typeId))
+            end = offset + length
+        return UdtLayout(symbol.name, symIndexId, symbol.length, symbol.udtKind, members, self.cachelineSize)
+
+    def layouts(self, symbols=None):
+        """Return the UdtLayout of each UDT (default all the UDTs of the session)"""
+        if symbols is None:
+            symbols = self.pydia.findChildrenByTypeEx(SYMTAG.SymTagUDT)
+        layouts = []
+        for symbol in symbols:
+            if symbol.length == 0:
+                continue # forward declaration
+            layouts.append(self.layout(symbol))
+        DEBUG("LayoutAnalyzer.layouts", "{} UDTs".format(len(layouts)))
+        return layouts
+
+
+def sortSummaries(summaries, key="wasted", reverse=None):
+    """Sort by key, descending except the names (reverse=None), then by name"""
+    assert key in LAYOUT_SORT_KEYS, "unknown sort key '{}', expected one of {}".format(key, ", ".join(LAYOUT_SORT_KEYS))
+    if reverse is None:
+        reverse = key != "name"
+    summaries = sorted(summaries, key=lambda summary: summary["name"])
+    return sorted(summaries, key=lambda summary: summary[key], reverse=reverse) # stable, the names stay ascending
+
+def formatSummaries(summaries):
+    """Return the lines of the summary table"""
+    header = " ".join(["{:" + width + "}" for key, title, width, spec in LAYOUT_COLUMNS])
+    row = " ".join(["{:" + width + spec + "}" for key, title, width, spec in LAYOUT_COLUMNS])
+    lines = [header.format(*[title for key, title, width, spec in LAYOUT_COLUMNS])]
+    for summary in summaries:
+        lines.append(row.format(*[summary[key] for key, title, width, spec in LAYOUT_COLUMNS]))
+    return lines
@@ -0,0 +1,403 @@
+"""
+Query language over the symbols of a session.
+
+    udt where length == 46 and name ~ "^PACKET_"
+    enum where not nested show define
+    data where name ~ "test_location" and dataKind == DataIsConstant limit 10
+
+A query is a symTag (the SYMTAG name without the SymTag prefix, or "symbol"
+for any), an optional where clause (and/or/not, parentheses, comparisons with
+== != < <= > >= ~ !~, where ~ is a regular expression search, and bare
+attributes tested for truth), an optional show clause (see SHOW) and an
+optional limit. Values are numbers, "strings", true/false or the names of the
+pydia enums (UdtClass, DataIsMember, btInt, ...).
+
+The where clause is split into conjuncts. The first one is evaluated over
+whole columns (one attribute of every symbol of the symTag, read in one pass
+and kept in the offline cache), or pushed down to MSDIA when it is a name
+equality. The other ones only read the attributes of the remaining symbols,
+unless their column is already available, and the results are streamed.
+"""
+import array
+import re
+import pydia
+import pydiacache
+from pydia import SYMTAG, ATTRKIND, NameSearchOptions, DEBUG
+
+
+SHOW = ("name", "metadata", "declare", "define", "layout")
+
+TOKEN = re.compile(r'\s*(?:(?P<number>-?0[xX][0-9a-fA-F]+|-?\d+)|(?P<string>"(?:[^"\\]|\\.)*")|(?P<op>==|!=|<=|>=|!~|[<>~()])|(?P<word>[A-Za-z_][A-Za-z0-9_]*))')
+KEYWORDS = ("where", "and", "or", "not", "show", "limit", "true", "false")
+OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    }
+# relative cost of a conjunct by operator, cheap and selective first
+OPERATOR_COST = {"==": 1, "!=": 3, "<": 2, "<=": 2, ">": 2, ">=": 2, "~": 4, "!~": 5, None: 3}
+
+# enums whose names can be used as values
+VALUE_ENUMS = (pydia.SYMTAG, pydia.BASICTYPE, pydia.LOCATIONTYPE, pydia.DATAKIND, pydia.UDTKIND, pydia.CVACCESS, pydia.CVCALL)
+
+
+class QueryError(ValueError):
+    pass
+
+def tokenize(text):
+    """Return a list of (kind, value)"""
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise QueryError("unexpected '{}' at {}".format(text[pos:pos + 10].strip(), pos))
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "number":
+            value = int(value, 16) if value.lower().find("x") != -1 else int(value)
+        elif kind == "string":
+            value = value[1:-1].replace('\\"', '"') # other escapes are left to the regular expressions
+        elif kind == "word" and value.lower() in KEYWORDS:
+            kind = "keyword"
+            value = value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+def enumValue(name):
+    for values in VALUE_ENUMS:
+        if name in values.__dict__:
+            return getattr(values, name)
+    return None
+
+def symTagOf(name):
+    """Return the symTag of a query symTag name"""
+    if name.lower() in ("symbol", "any"):
+        return SYMTAG.SymTagNull
+    for attr in SYMTAG.__dict__.keys():
+        if attr.startswith("SymTag") and attr[6:].lower() == name.lower():
+            return getattr(SYMTAG, attr)
+    raise QueryError("unknown symTag '{}'".format(name))
+
+
+class Query(object):
+    """A parsed query."""
+
+    def __init__(self, text):
+        self.text = text
+        self.symTag = SYMTAG.SymTagNull
+        self.where = None # ("and", [nodes]), ("or", [nodes]), ("not", node), ("cmp", attr, op, value)
+        self.show = "name"
+        self.limit = 0
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.parse()
+        del self.tokens
+
+    # parser
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        if kind is not None and token[0] != kind or value is not None and token[1] != value:
+            return None
+        return token
+
+    def take(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if token is None:
+            found = self.pos < len(self.tokens) and repr(self.tokens[self.pos][1]) or "the end"
+            raise QueryError("expected {} but found {} in '{}'".format(value or kind, found, self.text))
+        self.pos += 1
+        return token[1]
+
+    def parse(self):
+        self.symTag = symTagOf(self.take("word"))
+        if self.peek("keyword", "where"):
+            self.take()
+            self.where = self.parseOr()
+        if self.peek("keyword", "show"):
+            self.take()
+            self.show = self.take("word")
+            if self.show not in SHOW:
+                raise QueryError("unknown show '{}', expected one of {}".format(self.show, ", ".join(SHOW)))
+        if self.peek("keyword", "limit"):
+            self.take()
+            self.limit = self.take("number")
+        if self.pos != len(self.tokens):
+            raise QueryError("unexpected {} in '{}'".format(repr(self.tokens[self.pos][1]), self.text))
+
+    def parseOr(self):
+        nodes = [self.parseAnd()]
+        while self.peek("keyword", "or"):
+            self.take()
+            nodes.append(self.parseAnd())
+        return len(nodes) == 1 and nodes[0] or ("or", nodes)
+
+    def parseAnd(self):
+        nodes = [self.parseNot()]
+        while self.peek("keyword", "and"):
+            self.take()
+            nodes.append(self.parseNot())
+        return len(nodes) == 1 and nodes[0] or ("and", nodes)
+
+    def parseNot(self):
+        if self.peek("keyword", "not"):
+            self.take()
+            return ("not", self.parseNot())
+        if self.peek("op", "("):
+            self.take()
+            node = self.parseOr()
+            self.take("op", ")")
+            return node
+        return self.parseComparison()
+
+    def parseComparison(self):
+        attr = self.take("word")
+        attributes = pydia.SYMTAG_ATTRIBUTES.get(self.symTag, pydia.SYMTAG_ATTRIBUTES[SYMTAG.SymTagNull])
+        if attr not in attributes and not (attr.endswith("Id") and attr[:-2] in attributes):
+            raise QueryError("'{}' is not an attribute of {}".format(attr, pydia.SYMTAG_name(self.symTag)))
+        if pydia.attributeKind(attr) == ATTRKIND.AttrSymbol:
+            attr += "Id" # compared by symIndexId
+        op = self.peek("op")
+        if op is None or op[1] in ("(", ")"):
+            return ("cmp", attr, None, None)
+        op = self.take("op")
+        if self.pos >= len(self.tokens):
+            raise QueryError("expected a value after {} in '{}'".format(op, self.text))
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == "keyword" and value in ("true", "false"):
+            value = value == "true"
+        elif kind == "word":
+            name, value = value, enumValue(value)
+            if value is None:
+                raise QueryError("unknown value '{}'".format(name))
+        elif kind != "number" and kind != "string":
+            raise QueryError("expected a value after {} in '{}'".format(op, self.text))
+        if op in ("~", "!~"):
+            if pydia.attributeKind(attr) not in (ATTRKIND.AttrString, ATTRKIND.AttrGuid):
+                raise QueryError("{} expects a string attribute, {} is not one".format(op, attr))
+            if not isinstance(value, basestring):
+                raise QueryError("{} expects a string".format(op))
+            value = re.compile(value)
+        return ("cmp", attr, op, value)
+
+    # planner
+
+    def conjuncts(self):
+        """Return the top-level conjuncts of the where clause"""
+        if self.where is None:
+            return []
+        if self.where[0] == "and":
+            return list(self.where[1])
+        return [self.where]
+
+
+def attributesOf(node):
+    """Return the set of attributes read by a node"""
+    if node[0] == "cmp":
+        return set([node[1]])
+    if node[0] == "not":
+        return attributesOf(node[1])
+    return set().union(*[attributesOf(child) for child in node[1]])
+
+def costOf(node):
+    if node[0] == "cmp":
+        return OPERATOR_COST[node[2]]
+    if node[0] == "not":
+        return costOf(node[1]) + 1
+    return sum([costOf(child) for child in node[1]])
+
+def compileNode(node):
+    """Return a function(get) -> bool, where get(attr) returns the value of an attribute"""
+    if node[0] == "and":
+        predicates = [compileNode(child) for child in node[1]]
+        return lambda get: all([predicate(get) for predicate in predicates])
+    if node[0] == "or":
+        predicates = [compileNode(child) for child in node[1]]
+        return lambda get: any([predicate(get) for predicate in predicates])
+    if node[0] == "not":
+        predicate = compileNode(node[1])
+        return lambda get: not predicate(get)
+    kind, attr, op, value = node
+    if op is None:
+        return lambda get: bool(get(attr))
+    if op == "~":
+        return lambda get: value.search(get(attr) or u"") is not None
+    if op == "!~":
+        return lambda get: value.search(get(attr) or u"") is None
+    compare = OPERATORS[op]
+    if isinstance(value, basestring):
+        return lambda get: compare(get(attr) or u"", value)
+    return lambda get: compare(get(attr) or 0, value)
+
+
+class ColumnStore:
+    """I hold attributes of the symbols of a symTag as columns aligned with their symIndexIds."""
+
+    def __init__(self, pydia, cache=None):
+        self.pydia = pydia
+        self.cache = cache # pydiacache.OfflineCache or None
+        self.idColumns = {} # symTag -> array of symIndexIds
+        self.columns = {} # (symTag, attr) -> list
+
+    def entryName(self, symTag, attr):
+        return "column-{}-{}.json".format(pydia.SYMTAG_name(symTag), attr)
+
+    def ids(self, symTag):
+        ids = self.idColumns.get(symTag)
+        if ids is None:
+            values = self.cache and self.cache.loadJSON(self.entryName(symTag, "symIndexId"))
+            if values is None:
+                values = [symbol.symIndexId for symbol in self.pydia.findChildrenByTypeEx(symTag)]
+                if self.cache:
+                    self.cache.saveJSON(self.entryName(symTag, "symIndexId"), values)
+            ids = self.idColumns[symTag] = array.array('L', values)
+        return ids
+
+    def hasColumn(self, symTag, attr):
+        """True if the column is in memory or in the cache (loads it)"""
+        if (symTag, attr) in self.columns:
+            return True
+        values = self.cache and self.cache.loadJSON(self.entryName(symTag, attr))
+        if values is not None and len(values) == len(self.ids(symTag)):
+            self.columns[(symTag, attr)] = values
+            return True
+        return False
+
+    def column(self, symTag, attrs):
+        """Return {attr: column}, reading the missing columns in one pass"""
+        missing = [attr for attr in attrs if not self.hasColumn(symTag, attr)]
+        if missing:
+            ids = self.ids(symTag)
+            values = dict([(attr, []) for attr in missing])
+            for symbol in self.pydia.findChildrenByTypeEx(symTag):
+                for attr in missing:
+                    values[attr].append(readAttribute(symbol, attr))
+            assert len(values[missing[0]]) == len(ids), "the children of the global scope changed"
+            for attr in missing:
+                self.columns[(symTag, attr)] = values[attr]
+                if self.cache:
+                    self.cache.saveJSON(self.entryName(symTag, attr), values[attr])
+            DEBUG("ColumnStore.column", pydia.SYMTAG_name(symTag), "read {} in one pass of {} symbols".format(", ".join(missing), len(ids)))
+        return dict([(attr, self.columns[(symTag, attr)]) for attr in attrs])
+
+
+def readAttribute(symbol, attr):
+    """Return the value of an attribute as stored in a column (symbols as symIndexIds)"""
+    try:
+        value = getattr(symbol, attr)
+    except (pydia.COMError, ValueError): # ValueError: NULL pointer
+        return None
+    if attr.endswith("Id") or pydia.attributeKind(attr) == ATTRKIND.AttrScalar:
+        return value
+    if pydia.attributeKind(attr) == ATTRKIND.AttrSymbol:
+        return value and value.symIndexId or 0 # NULL pointer is false
+    return value and unicode(value) or None
+
+
+class QueryEngine:
+    """I run queries over a ColumnStore."""
+
+    def __init__(self, pydia, store=None):
+        self.pydia = pydia
+        if store is None:
+            cache = pydia.globalScope.guid and pydiacache.OfflineCache(pydia) or None
+            store = ColumnStore(pydia, cache)
+        self.store = store
+
+    def plan(self, query):
+        """Return (driving conjunct, other conjuncts) ordered by cost"""
+        conjuncts = query.conjuncts()
+        store = self.store
+        def cost(node):
+            loaded = [attr for attr in attributesOf(node) if not store.hasColumn(query.symTag, attr)]
+            return (len(loaded), costOf(node))
+        conjuncts.sort(key=cost)
+        if not conjuncts:
+            return None, []
+        # a name equality is answered by MSDIA, unless the column is at hand
+        for i, node in enumerate(conjuncts):
+            if node[0] == "cmp" and node[1] == "name" and node[2] == "==" and not store.hasColumn(query.symTag, "name"):
+                return node, conjuncts[:i] + conjuncts[i + 1:]
+        return conjuncts[0], conjuncts[1:]
+
+    def candidates(self, query, node):
+        """Yield the symIndexIds that pass the driving conjunct"""
+        symTag = query.symTag
+        if node is None:
+            for symIndexId in self.store.ids(symTag):
+                yield symIndexId
+        elif node[0] == "cmp" and node[1] == "name" and node[2] == "==" and not self.store.hasColumn(symTag, "name"):
+            for symbol in self.pydia.findChildrenEx(None, symTag, node[3], NameSearchOptions.nsfCaseSensitive):
+                yield symbol.symIndexId
+        else:
+            attrs = sorted(attributesOf(node))
+            columns = self.store.column(symTag, attrs)
+            predicate = compileNode(node)
+            ids = self.store.ids(symTag)
+            row = [0]
+            get = lambda attr: columns[attr][row[0]]
+            for i in xrange(len(ids)):
+                row[0] = i
+                if predicate(get):
+                    yield ids[i]
+
+    def execute(self, query):
+        """Yield the symbols that match a query"""
+        if isinstance(query, basestring):
+            query = Query(query)
+        driving, others = self.plan(query)
+        DEBUG("QueryEngine.execute", query.text, "driving={} others={}".format(driving, len(others)))
+        steps = []
+        for node in others:
+            attrs = attributesOf(node)
+            columns = None
+            if len([attr for attr in attrs if self.store.hasColumn(query.symTag, attr)]) == len(attrs):
+                columns = self.store.column(query.symTag, attrs)
+            steps.append((compileNode(node), columns))
+        rowOf = None
+        if [step for step in steps if step[1] is not None]:
+            rowOf = dict([(symIndexId, i) for i, symIndexId in enumerate(self.store.ids(query.symTag))])
+        count = 0
+        for symIndexId in self.candidates(query, driving):
+            symbol = None
+            for predicate, columns in steps:
+                if columns is not None:
+                    row = rowOf[symIndexId]
+                    get = lambda attr: columns[attr][row]
+                else:
+                    if symbol is None:
+                        symbol = self.pydia.symbolById(symIndexId)
+                    get = lambda attr: readAttribute(symbol, attr)
+                if not predicate(get):
+                    break
+            else:
+                yield symbol or self.pydia.symbolById(symIndexId)
+                count += 1
+                if query.limit and count >= query.limit:
+                    return
+
+
+def showLines(session, show, symbol):
+    """Return the lines that show a query result"""
+    symTag = symbol.symTag
+    if show == "define" and symTag == SYMTAG.SymTagUDT:
+        return [""] + pydia.UdtPrinter(session).defineLines(symbol)
+    if show == "define" and symTag == SYMTAG.SymTagEnum:
+        return [""] + pydia.EnumPrinter(session).defineLines(symbol)
+    if show == "declare" and symTag in (SYMTAG.SymTagBaseType, SYMTAG.SymTagPointerType, SYMTAG.SymTagEnum, SYMTAG.SymTagUDT, SYMTAG.SymTagArrayType):
+        return [pydia.TypePrinter(session).declare(symbol)]
+    if show == "layout" and symTag == SYMTAG.SymTagUDT:
+        import pydialayout
+        return pydialayout.LayoutAnalyzer(session).layout(symbol).lines()
+    if show == "name":
+        return [u"{} // #{} {}".format(symbol.name, symbol.symIndexId, pydia.SYMTAG_name(symTag))]
+    return [" ".join(pydia.SymbolPrinter(session).metadata(symbol))]
@@ -0,0 +1,109 @@
+"""
+Parallel scans of the compilands of a session.
+
+Compilands are independent, so a scan calls a callback for each SymTagCompiland
+in a pool of worker processes. Each worker opens its own session (MSDIA or a
+capture) and the results are yielded as they arrive.
+
+The callback receives (pydia, compiland) and must return something picklable.
+It must be a module level function so the workers can import it.
+"""
+import multiprocessing
+import sys
+import pydiacapture
+from pydia import SYMTAG, DATAKIND, DEBUG, DiaEnumSymbolsIterator
+
+
+_workerSession = None # PyDia of the worker process
+_workerCallback = None
+
+def _initWorker(target, callback):
+    global _workerSession, _workerCallback
+    comtypes = pydiacapture.pydia.comtypes
+    if comtypes is not None:
+        comtypes.CoInitialize()
+    _workerSession = pydiacapture.openSession(target)
+    _workerCallback = callback
+
+def _scanCompiland(symIndexId):
+    compiland = _workerSession.symbolById(symIndexId)
+    return symIndexId, _workerCallback(_workerSession, compiland)
+
+
+def compilandIds(pydia):
+    """Return the symIndexIds of the compilands of a session"""
+    return [compiland.symIndexId for compiland in pydia.findChildrenByTypeEx(SYMTAG.SymTagCompiland)]
+
+def scanCompilands(target, callback, processes=None, pydia=None, ordered=False, chunkSize=4):
+    """Yield (compiland symIndexId, callback result) for each compiland of target.
+    processes=None uses all the cores, processes=1 scans in this process.
+    pydia is an open session of target to use for the compiland list (and for processes=1)."""
+    if pydia is None:
+        pydia = pydiacapture.openSession(target)
+    ids = compilandIds(pydia)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(ids)))
+    DEBUG("scanCompilands", "{} compilands, {} processes".format(len(ids), processes))
+    if processes == 1:
+        for symIndexId in ids:
+            yield symIndexId, callback(pydia, pydia.symbolById(symIndexId))
+        return
+    sys.stdout.flush() # the workers inherit the buffer on fork
+    pool = multiprocessing.Pool(processes, _initWorker, (target, callback))
+    try:
+        if ordered:
+            results = pool.imap(_scanCompiland, ids, chunkSize)
+        else:
+            results = pool.imap_unordered(_scanCompiland, ids, chunkSize)
+        for result in results:
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+#---------------------------------------------------------------------------
+# callbacks
+
+def compilerInfo(pydia, compiland):
+    """Return (name, compilerName, frontEnd version, backEnd version) of a compiland"""
+    frontEnd = "{}.{}.{}".format(compiland.frontEndMajor, compiland.frontEndMinor, compiland.frontEndBuild)
+    backEnd = "{}.{}.{}".format(compiland.backEndMajor, compiland.backEndMinor, compiland.backEndBuild)
+    for details in DiaEnumSymbolsIterator(compiland.findChildrenEx(SYMTAG.SymTagCompilandDetails, None, 0)):
+        frontEnd = "{}.{}.{}".format(details.frontEndMajor, details.frontEndMinor, details.frontEndBuild)
+        backEnd = "{}.{}.{}".format(details.backEndMajor, details.backEndMinor, details.backEndBuild)
+        return compiland.name, details.compilerName, frontEnd, backEnd
+    return compiland.name, compiland.compilerName, frontEnd, backEnd
+
+def countLocals(symbol):
+    """Return the number of locals of a function or block (nested blocks included)"""
+    count = 0
+    for child in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+        symTag = child.symTag
+        if symTag == SYMTAG.SymTagData and child.dataKind == DATAKIND.DataIsLocal:
+            count += 1
+        elif symTag == SYMTAG.SymTagBlock:
+            count += countLocals(child)
+    return count
+
+def symbolCounts(pydia, compiland):
+    """Return (name, functions, static data, locals) of a compiland"""
+    functions = 0
+    statics = 0
+    locals = 0
+    for child in DiaEnumSymbolsIterator(compiland.findChildrenEx(SYMTAG.SymTagNull, None, 0)):
+        symTag = child.symTag
+        if symTag == SYMTAG.SymTagFunction:
+            functions += 1
+            locals += countLocals(child)
+        elif symTag == SYMTAG.SymTagData and child.dataKind in (DATAKIND.DataIsFileStatic, DATAKIND.DataIsGlobal, DATAKIND.DataIsStaticLocal):
+            statics += 1
+    return compiland.name, functions, statics, locals
+
+def compilandSummary(pydia, compiland):
+    """Return (name, compilerName, frontEnd, backEnd, functions, statics, locals) of a compiland"""
+    return compilerInfo(pydia, compiland) + symbolCounts(pydia, compiland)[1:]
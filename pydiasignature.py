@@ -0,0 +1,134 @@
+"""
+Interned function signatures.
+
+A PDB has a SymTagFunctionType per (return type, calling convention, params,
+this adjustment, const, class) and often thousands of them that only differ
+by the class. The SignatureTable interns them by
+    (return type, calling convention, params, thisAdjust, const)
+with the types as text, so each unique signature is one Signature record that
+counts the function types (and functions) that use it. The type names are
+computed once per type symbol, and the records render declarations without
+reading the symbols again.
+"""
+import pydia
+from pydia import SYMTAG, CVCALL, BASICTYPE_str, CVCALL_str, DEBUG, DiaEnumSymbolsIterator
+
+
+class Signature(object):
+    """A unique function signature."""
+    __slots__ = ("index", "returnType", "callingConvention", "params", "thisAdjust", "const", "count", "functions", "symIndexId")
+
+    def __init__(self, index, key, symIndexId):
+        self.index = index
+        self.returnType, self.callingConvention, self.params, self.thisAdjust, self.const = key
+        self.count = 0 # function types
+        self.functions = 0 # functions, when counted
+        self.symIndexId = symIndexId # first function type
+
+    def key(self):
+        return (self.returnType, self.callingConvention, self.params, self.thisAdjust, self.const)
+
+    def declare(self, name=None, className=None, pointer=None, showThiscall=True):
+        """Return the declaration of a function with this signature (pointer="*" or "&" for a function pointer)"""
+        s = []
+        if showThiscall or self.callingConvention != CVCALL.CV_CALL_THISCALL:
+            s.append(CVCALL_str(self.callingConvention) + " ")
+        if className:
+            s.append(className + "::")
+        if pointer:
+            s.append(pointer)
+        if name:
+            s.append(name)
+        declarator = "".join(s).rstrip()
+        if pointer:
+            declarator = "(" + declarator + ")"
+        s = [self.returnType, " ", declarator, "(", ", ".join(self.params) or "void", ")"]
+        if self.const:
+            s.append(" const")
+        if self.thisAdjust:
+            s.append(" /* this+{} */".format(self.thisAdjust))
+        return "".join(s)
+
+
+class SignatureTable:
+    """I intern the function types of a session."""
+
+    def __init__(self, pydia):
+        self.pydia = pydia
+        self.signatures = [] # Signature by index
+        self.byKey = {} # key -> Signature
+        self.byId = {} # symIndexId of a function type -> Signature
+        self.typeNames = {} # symIndexId of a type -> name
+        self.functionsCounted = False
+
+    def typeName(self, symbol):
+        """Return the name of a type, computed once per symbol"""
+        if not symbol: # NULL pointer
+            return "void"
+        symIndexId = symbol.symIndexId
+        name = self.typeNames.get(symIndexId)
+        if name is None:
+            symTag = symbol.symTag
+            if symTag == SYMTAG.SymTagBaseType:
+                name = BASICTYPE_str(symbol.baseType, symbol.length)
+            elif symTag == SYMTAG.SymTagPointerType:
+                pointee = symbol.type
+                op = symbol.reference and "&" or "*"
+                if pointee and pointee.symTag == SYMTAG.SymTagFunctionType:
+                    name = self.signature(pointee).declare(pointer=op)
+                else:
+                    name = self.typeName(pointee) + op
+                if symbol.constType:
+                    name += " const"
+            elif symTag == SYMTAG.SymTagArrayType:
+                name = "{}[{}]".format(self.typeName(symbol.type), symbol.count)
+            elif symTag == SYMTAG.SymTagFunctionType:
+                name = self.signature(symbol).declare()
+            else:
+                name = symbol.name or "<{}>".format(pydia.SYMTAG_name(symTag))
+            if symTag != SYMTAG.SymTagPointerType:
+                if symbol.constType:
+                    name = "const " + name
+                if symbol.volatileType:
+                    name = "volatile " + name
+            self.typeNames[symIndexId] = name
+        return name
+
+    def signature(self, symbol):
+        """Return the Signature of a function type, interning it the first time"""
+        symIndexId = symbol.symIndexId
+        signature = self.byId.get(symIndexId)
+        if signature is None:
+            params = [self.typeName(arg.type) for arg in DiaEnumSymbolsIterator(symbol.findChildrenEx(SYMTAG.SymTagFunctionArgType, None, 0))]
+            objectPointerType = symbol.objectPointerType
+            const = bool(objectPointerType and objectPointerType.type and objectPointerType.type.constType)
+            key = (self.typeName(symbol.type), symbol.callingConvention, tuple(params), symbol.thisAdjust or 0, const)
+            signature = self.byKey.get(key)
+            if signature is None:
+                signature = self.byKey[key] = Signature(len(self.signatures), key, symIndexId)
+                self.signatures.append(signature)
+            signature.count += 1
+            self.byId[symIndexId] = signature
+        return signature
+
+    def build(self, functions=True):
+        """Intern all the function types, and count the functions of each signature"""
+        for symbol in self.pydia.findChildrenByTypeEx(SYMTAG.SymTagFunctionType):
+            self.signature(symbol)
+        if functions and not self.functionsCounted:
+            self.functionsCounted = True
+            for symbol in self.pydia.findChildrenByTypeEx(SYMTAG.SymTagFunction):
+                signature = self.byId.get(symbol.typeId)
+                if signature is None:
+                    functionType = symbol.type
+                    if not functionType:
+                        continue
+                    signature = self.signature(functionType)
+                signature.functions += 1
+        DEBUG("SignatureTable.build", "{} function types, {} signatures".format(len(self.byId), len(self.signatures)))
+        return self
+
+    def top(self, count=None, key="count"):
+        """Return the signatures sorted by decreasing key ("count" or "functions")"""
+        signatures = sorted(self.signatures, key=lambda signature: (-getattr(signature, key), signature.index))
+        return count and signatures[:count] or signatures
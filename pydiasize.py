@@ -0,0 +1,246 @@
+"""
+Binary size attribution.
+
+The sized symbols are the functions (length) and the static data (the length
+of their type) of the global scope. Their attributes are read as columns
+(pydiaquery.ColumnStore, kept in the offline cache), so the report of a
+program with 100k+ symbols is built from a few column passes and then only
+loops over lists:
+    names, sizes, sections, compilands     one entry per sized symbol
+The sizes are aggregated by compiland, by section, by namespace (the prefix of
+the :: name at some depth) or by symbol, as top-N tables or as a treemap
+(nested {"name", "size", "children"} for d3 and the like).
+
+The section contributions table (IDiaEnumSectionContribs, declared here by
+IID since the msdia100 type library doesn't expose it) gives the compiland and
+section totals instead, since it also covers what has no symbol (string
+literals, import thunks, padding, ...); those totals count contributions, not
+symbols. It also attributes the static data of the global scope, whose lexical
+parent is the exe, to the compiland whose contribution holds its address.
+"""
+import bisect
+import pydia
+import pydiacache
+import pydiaheader
+import pydiaquery
+from pydia import SYMTAG, LOCATIONTYPE, COMError, DEBUG, DiaEnumSymbolsIterator
+
+
+SIZE_KEYS = ("compiland", "namespace", "section", "symbol")
+TYPE_SYMTAGS = (SYMTAG.SymTagBaseType, SYMTAG.SymTagPointerType, SYMTAG.SymTagArrayType,
+                SYMTAG.SymTagUDT, SYMTAG.SymTagEnum, SYMTAG.SymTagTypedef)
+GLOBAL_NAMESPACE = "<global>"
+UNKNOWN = "<unknown>"
+
+
+# IDiaSectionContrib properties after compiland, in vtable order (dia2.h): (name, ctypes type name)
+SECTION_CONTRIB_PROPERTIES = (
+    ("addressSection", "c_ulong"), ("addressOffset", "c_ulong"), ("relativeVirtualAddress", "c_ulong"),
+    ("virtualAddress", "c_ulonglong"), ("length", "c_ulong"), ("notPaged", "c_long"), ("code", "c_long"),
+    ("initializedData", "c_long"), ("uninitializedData", "c_long"), ("remove", "c_long"), ("comdat", "c_long"),
+    ("discardable", "c_long"), ("notCached", "c_long"), ("share", "c_long"), ("execute", "c_long"),
+    ("read", "c_long"), ("write", "c_long"), ("dataCrc", "c_ulong"), ("relocationsCrc", "c_ulong"),
+    ("compilandId", "c_ulong"),
+    )
+IID_IDiaSectionContrib = "{0CF4B60E-35B1-4C6C-BDD8-854B9C8E3857}"
+IID_IDiaEnumSectionContribs = "{1994DEB2-2C82-4B1D-A57F-AFF424D54A68}"
+declaredInterfaces = {} # msdia module -> IDiaEnumSectionContribs
+
+def sectionContribsInterface(msdia):
+    """Return IDiaEnumSectionContribs of the type library, or declared by IID with comtypes"""
+    interface = getattr(msdia, "IDiaEnumSectionContribs", None)
+    if interface is not None:
+        return interface
+    interface = declaredInterfaces.get(msdia)
+    if interface is None:
+        import ctypes
+        from comtypes import GUID, IUnknown, COMMETHOD, HRESULT
+        POINTER = ctypes.POINTER
+        class IDiaSectionContrib(IUnknown):
+            _iid_ = GUID(IID_IDiaSectionContrib)
+            _methods_ = [COMMETHOD(["propget"], HRESULT, "compiland", (["out", "retval"], POINTER(POINTER(msdia.IDiaSymbol)), "pRetVal"))] + [
+                COMMETHOD(["propget"], HRESULT, name, (["out", "retval"], POINTER(getattr(ctypes, ctype)), "pRetVal"))
+                for name, ctype in SECTION_CONTRIB_PROPERTIES]
+        class IDiaEnumSectionContribs(IUnknown):
+            _iid_ = GUID(IID_IDiaEnumSectionContribs)
+        # count and Item are the names DiaEnumSymbolsIterator uses (typelib names are case insensitive)
+        IDiaEnumSectionContribs._methods_ = [
+            COMMETHOD(["propget"], HRESULT, "_NewEnum", (["out", "retval"], POINTER(POINTER(IUnknown)), "pRetVal")),
+            COMMETHOD(["propget"], HRESULT, "count", (["out", "retval"], POINTER(ctypes.c_long), "pRetVal")),
+            COMMETHOD([], HRESULT, "Item", (["in"], ctypes.c_ulong, "index"), (["out", "retval"], POINTER(POINTER(IDiaSectionContrib)), "section")),
+            COMMETHOD([], HRESULT, "Next", (["in"], ctypes.c_ulong, "celt"), (["out"], POINTER(POINTER(IDiaSectionContrib)), "rgelt"), (["out"], POINTER(ctypes.c_ulong), "pceltFetched")),
+            COMMETHOD([], HRESULT, "Skip", (["in"], ctypes.c_ulong, "celt")),
+            COMMETHOD([], HRESULT, "Reset"),
+            COMMETHOD([], HRESULT, "Clone", (["out", "retval"], POINTER(POINTER(IDiaEnumSectionContribs)), "ppenum")),
+            ]
+        interface = declaredInterfaces[msdia] = IDiaEnumSectionContribs
+    return interface
+
+def sectionContributions(pydia):
+    """Return [(section, offset, length, compiland symIndexId)] of the section contributions table sorted by address, or None"""
+    if pydia.msdia is None:
+        return None # no COM (captures)
+    interface = sectionContribsInterface(pydia.msdia)
+    for table in pydia.session.getEnumTables():
+        try:
+            contributions = table.QueryInterface(interface)
+        except COMError:
+            continue
+        return sorted([(contribution.addressSection, contribution.addressOffset, contribution.length, contribution.compilandId)
+                       for contribution in DiaEnumSymbolsIterator(contributions)])
+    return None
+
+def scopesOf(name):
+    """Return the parts of a qualified name"""
+    if name.find("<") == -1:
+        return name.split("::") # fast path, no template arguments
+    return pydiaheader.splitName(name)
+
+def namespaceOf(parts, depth=1):
+    """Return the first depth scopes of the parts of a name (GLOBAL_NAMESPACE when it has none)"""
+    if len(parts) < 2:
+        return GLOBAL_NAMESPACE
+    return "::".join(parts[:min(depth, len(parts) - 1)])
+
+
+class SizeReport:
+    """I attribute the size of the functions and static data of a session."""
+
+    def __init__(self, pydia, store=None):
+        self.pydia = pydia
+        if store is None:
+            cache = pydia.globalScope.guid and pydiacache.OfflineCache(pydia) or None
+            store = pydiaquery.ColumnStore(pydia, cache)
+        self.store = store
+        self.names = []
+        self.sizes = []
+        self.sections = []
+        self.compilands = [] # compiland symIndexId (lexical parent) or 0
+        self.compilandNames = {} # compiland symIndexId -> name
+        self.contributions = None # [(section, offset, length, compiland symIndexId)] sorted, or None
+        self.parts = None # parts of each name, created on demand
+
+    def collect(self):
+        """Read the sized symbols in a few column passes"""
+        store = self.store
+        compilands = store.ids(SYMTAG.SymTagCompiland)
+        self.compilandNames = dict(zip(compilands, store.column(SYMTAG.SymTagCompiland, ["name"])["name"]))
+        columns = store.column(SYMTAG.SymTagFunction, ["name", "length", "addressSection", "lexicalParentId"])
+        self.names += columns["name"]
+        self.sizes += [length or 0 for length in columns["length"]]
+        self.sections += columns["addressSection"]
+        self.compilands += columns["lexicalParentId"]
+        # static data: the length is the one of the type
+        typeLengths = {}
+        for symTag in TYPE_SYMTAGS:
+            typeLengths.update(zip(store.ids(symTag), store.column(symTag, ["length"])["length"]))
+        try:
+            self.contributions = sectionContributions(self.pydia)
+        except (AttributeError, COMError), e:
+            DEBUG("SizeReport.collect", "no section contributions", e)
+        columns = store.column(SYMTAG.SymTagData, ["name", "locationType", "typeId", "addressSection", "addressOffset", "lexicalParentId"])
+        for name, locationType, typeId, section, offset, compiland in zip(columns["name"], columns["locationType"], columns["typeId"],
+                                                                          columns["addressSection"], columns["addressOffset"], columns["lexicalParentId"]):
+            if locationType == LOCATIONTYPE.LocIsStatic:
+                if compiland not in self.compilandNames:
+                    compiland = self.compilandAt(section, offset) # global data, the lexical parent is the exe
+                self.names.append(name)
+                self.sizes.append(typeLengths.get(typeId) or 0)
+                self.sections.append(section)
+                self.compilands.append(compiland)
+        DEBUG("SizeReport.collect", "{} symbols, {} bytes, {} section contributions".format(
+            len(self.sizes), sum(self.sizes), self.contributions is not None and len(self.contributions) or "no"))
+        return self
+
+    def compilandName(self, symIndexId):
+        return self.compilandNames.get(symIndexId) or UNKNOWN
+
+    def compilandAt(self, section, offset):
+        """Return the symIndexId of the compiland whose contribution holds an address, or 0"""
+        contributions = self.contributions
+        if not contributions:
+            return 0
+        i = bisect.bisect_right(contributions, (section, offset, 0xFFFFFFFF)) - 1
+        if i >= 0:
+            contributionSection, contributionOffset, length, compiland = contributions[i]
+            if contributionSection == section and contributionOffset <= offset < contributionOffset + length:
+                return compiland
+        return 0
+
+    def usesContributions(self, by):
+        """True if the totals by compiland or section are the section contributions"""
+        return self.contributions is not None and by in ("compiland", "section")
+
+    def countLabel(self, by):
+        """Return what the count of an aggregate counts"""
+        return self.usesContributions(by) and "contribs" or "symbols"
+
+    def scopes(self):
+        """Return the parts of the name of each symbol"""
+        if self.parts is None:
+            self.parts = [scopesOf(name or UNKNOWN) for name in self.names]
+        return self.parts
+
+    def keys(self, by, depth=1):
+        """Return the aggregation key of each symbol"""
+        if by == "compiland":
+            return [self.compilandName(compiland) for compiland in self.compilands]
+        if by == "section":
+            return ["section {}".format(section) for section in self.sections]
+        if by == "namespace":
+            return [namespaceOf(parts, depth) for parts in self.scopes()]
+        if by == "symbol":
+            return [name or UNKNOWN for name in self.names]
+        raise ValueError("unknown size key '{}' (one of {})".format(by, ", ".join(SIZE_KEYS)))
+
+    def aggregate(self, by, depth=1):
+        """Return {key: [size, count]}"""
+        totals = {}
+        if self.usesContributions(by):
+            for section, offset, length, compiland in self.contributions:
+                key = by == "compiland" and self.compilandName(compiland) or "section {}".format(section)
+                total = totals.setdefault(key, [0, 0])
+                total[0] += length
+                total[1] += 1
+            return totals
+        for key, size in zip(self.keys(by, depth), self.sizes):
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = [0, 0]
+            total[0] += size
+            total[1] += 1
+        return totals
+
+    def top(self, by, count=20, depth=1):
+        """Return [(key, size, count)] of the biggest keys"""
+        totals = self.aggregate(by, depth)
+        rows = sorted([(key, total[0], total[1]) for key, total in totals.iteritems()], key=lambda row: (-row[1], row[0]))
+        return count and rows[:count] or rows
+
+    def treemap(self, by="namespace"):
+        """Return the sizes as a tree: the scopes of the names ("namespace") or compiland/symbol ("compiland")"""
+        root = dict(name="", size=0, children={})
+        if by == "namespace":
+            paths = self.scopes()
+        elif by == "compiland":
+            paths = [[self.compilandName(compiland), name or UNKNOWN] for compiland, name in zip(self.compilands, self.names)]
+        else:
+            raise ValueError("unknown treemap key '{}' (namespace or compiland)".format(by))
+        for path, size in zip(paths, self.sizes):
+            node = root
+            node["size"] += size
+            for part in path:
+                child = node["children"].get(part)
+                if child is None:
+                    child = node["children"][part] = dict(name=part, size=0, children={})
+                child["size"] += size
+                node = child
+        # children as lists, biggest first, no children list in the leaves
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            children = sorted(node.pop("children").itervalues(), key=lambda child: -child["size"])
+            if children:
+                node["children"] = children
+                stack += children
+        return root
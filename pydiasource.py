@@ -0,0 +1,124 @@
+"""
+Source file inventory.
+
+session.findFile(None, None, 0) enumerates every source file of the program
+database once. Each IDiaSourceFile has a uniqueId, a path, a checksum and the
+compilands that include it, which are kept as compact tables:
+    files       {file id: path}
+    checksums   {file id: (checksumType, hex digest)}
+    compilands  {compiland symIndexId: [file ids]}
+    names       {compiland symIndexId: name}
+The inventory is cached per PDB in the offline cache (see pydiacache). The
+reverse table (file id -> compilands) is built on demand, to find the
+translation units that include a header.
+"""
+import binascii
+import ctypes
+import re
+import pydia
+import pydiacache
+from pydia import COMError, DEBUG, DiaEnumSymbolsIterator
+
+
+INVENTORY_VERSION = 1 # bump when the tables change
+CACHE_ENTRY = "sources_{}.json".format(INVENTORY_VERSION)
+MAX_CHECKSUM = 32 # bytes, SHA-256
+
+# IDiaSourceFile::get_checksumType
+CHECKSUM = pydia.enum("ChecksumNone","ChecksumMD5","ChecksumSHA1","ChecksumSHA256")
+def CHECKSUM_name(value):
+    for name in CHECKSUM.__dict__.keys():
+        if name.startswith("Checksum") and getattr(CHECKSUM, name) == value:
+            return name
+    return "CHECKSUM_name({})".format(value)
+
+
+def readChecksum(sourceFile):
+    """Return the checksum of an IDiaSourceFile as hex or None"""
+    # the checksum property has a size_is buffer, comtypes only exposes the raw method
+    get = getattr(sourceFile, "_IDiaSourceFile__com_get_checksum", None)
+    if get is None:
+        return None
+    data = (ctypes.c_ubyte * MAX_CHECKSUM)()
+    size = ctypes.c_ulong()
+    try:
+        get(MAX_CHECKSUM, ctypes.byref(size), data)
+    except COMError:
+        return None
+    return binascii.hexlify(bytearray(data[:size.value]))
+
+
+class SourceInventory:
+    """I hold the source files of a session and the compilands that include them."""
+
+    def __init__(self):
+        self.files = {} # file id -> path
+        self.checksums = {} # file id -> (checksumType, hex digest)
+        self.compilands = {} # compiland symIndexId -> [file ids]
+        self.names = {} # compiland symIndexId -> name
+        self.includers = None # file id -> [compiland symIndexIds], created on demand
+
+    def collect(self, pydia):
+        """Read all the source files of a session in one pass"""
+        for sourceFile in DiaEnumSymbolsIterator(pydia.session.findFile(None, None, 0)):
+            fileId = sourceFile.uniqueId
+            if fileId in self.files:
+                continue
+            self.files[fileId] = sourceFile.fileName
+            checksumType = sourceFile.checksumType
+            if checksumType:
+                self.checksums[fileId] = (checksumType, readChecksum(sourceFile))
+            for compiland in DiaEnumSymbolsIterator(sourceFile.compilands):
+                symIndexId = compiland.symIndexId
+                if symIndexId not in self.names:
+                    self.names[symIndexId] = compiland.name
+                    self.compilands[symIndexId] = []
+                self.compilands[symIndexId].append(fileId)
+        DEBUG("SourceInventory.collect", "{} source files in {} compilands".format(len(self.files), len(self.compilands)))
+        return self
+
+    def includersOf(self, fileId):
+        """Return the symIndexIds of the compilands that include a file"""
+        if self.includers is None:
+            self.includers = {}
+            for symIndexId, fileIds in self.compilands.iteritems():
+                for id in fileIds:
+                    self.includers.setdefault(id, []).append(symIndexId)
+        return self.includers.get(fileId, [])
+
+    def find(self, pattern):
+        """Return the ids of the files whose path matches a regular expression (case insensitive)"""
+        expression = re.compile(pattern, re.IGNORECASE)
+        return sorted([fileId for fileId, path in self.files.iteritems() if expression.search(path)])
+
+    def translationUnits(self, pattern):
+        """Return the names of the compilands that include the files matching pattern"""
+        symIndexIds = set()
+        for fileId in self.find(pattern):
+            symIndexIds.update(self.includersOf(fileId))
+        return sorted([self.names[symIndexId] for symIndexId in symIndexIds])
+
+    def toJSON(self):
+        return dict(files=self.files, checksums=self.checksums, compilands=self.compilands, names=self.names)
+
+    @classmethod
+    def fromJSON(cls, value):
+        """Inverse of toJSON (JSON keys are strings)"""
+        inventory = cls()
+        for attr in ("files", "checksums", "compilands", "names"):
+            setattr(inventory, attr, dict([(int(key), item) for key, item in value[attr].iteritems()]))
+        inventory.checksums = dict([(key, tuple(item)) for key, item in inventory.checksums.iteritems()])
+        return inventory
+
+
+def loadInventory(pydia, cache=None):
+    """Return the SourceInventory of a session, read once per PDB"""
+    if cache is None and pydia.globalScope.guid:
+        cache = pydiacache.OfflineCache(pydia)
+    value = cache and cache.loadJSON(CACHE_ENTRY)
+    if value is not None:
+        return SourceInventory.fromJSON(value)
+    inventory = SourceInventory().collect(pydia)
+    if cache:
+        cache.saveJSON(CACHE_ENTRY, inventory.toJSON())
+    return inventory
@@ -0,0 +1,251 @@
+"""
+Bulk validation of the invariants that the printers assume.
+
+The printers used to assert them symbol by symbol while rendering (25 reads
+per enumerator), so one violation aborted a whole dump. The invariants are now
+a table checked in one separate pass:
+    (parent symTag, symTag, attribute, allowed values)
+A parent symTag of None means the children of the global scope, whose
+attributes are read as columns (pydiaquery.ColumnStore, kept in the offline
+cache). Otherwise the symbols are the children of the parents, read once per
+parent. Symbol attributes are checked by id: a Reference is the id of a symbol
+of a symTag, optionally with attributes in some values.
+
+Every violation is counted in a report (with a few example symIndexIds)
+instead of stopping the pass. The report is cached per PDB. Nothing runs it
+implicitly, so production dumps don't pay for it (see PyDia.validationReport).
+"""
+import pydia
+import pydiacache
+import pydiaquery
+from pydia import SYMTAG, BASICTYPE, DATAKIND, LOCATIONTYPE, DEBUG, DiaEnumSymbolsIterator
+
+
+VALIDATOR_VERSION = 3 # bump when the invariants change, the cached reports become stale
+CACHE_ENTRY = "validate_{}.json".format(VALIDATOR_VERSION)
+EXAMPLES = 5 # symIndexIds kept per invariant
+
+
+class Reference(object):
+    """Allowed value of a symbol attribute: the id of a symbol of symTag (with each attr in its values)."""
+    __slots__ = ("symTag", "conditions")
+
+    def __init__(self, symTag, *conditions):
+        self.symTag = symTag
+        self.conditions = conditions # (attr, values)
+
+    def __repr__(self):
+        s = pydia.SYMTAG_name(self.symTag)
+        for attr, values in self.conditions:
+            s += ".{} in {}".format(attr, values)
+        return s
+
+GLOBAL_SCOPE = (Reference(SYMTAG.SymTagExe),)
+ZERO = (0,)
+
+INVARIANTS = (
+    # TypePrinter: types are in the global scope
+    (None, SYMTAG.SymTagBaseType, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagPointerType, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagFunctionType, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagEnum, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagUDT, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagArrayType, "lexicalParentId", GLOBAL_SCOPE),
+    # TypePrinter.declare
+    (None, SYMTAG.SymTagPointerType, "unalignedType", ZERO),
+    (None, SYMTAG.SymTagPointerType, "volatileType", ZERO),
+    (None, SYMTAG.SymTagArrayType, "arrayIndexTypeId", (Reference(SYMTAG.SymTagBaseType, ("baseType", (BASICTYPE.btULong, BASICTYPE.btInt))),)),
+    (None, SYMTAG.SymTagArrayType, "constType", ZERO),
+    (None, SYMTAG.SymTagArrayType, "rank", ZERO),
+    (None, SYMTAG.SymTagArrayType, "unalignedType", ZERO),
+    (None, SYMTAG.SymTagArrayType, "volatileType", ZERO),
+    # FunctionPrinter, DataPrinter
+    (None, SYMTAG.SymTagFunction, "lexicalParentId", (Reference(SYMTAG.SymTagCompiland),) + GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagData, "lexicalParentId", GLOBAL_SCOPE),
+    # UdtPrinter.defineVtableLines, debugUDT
+    (None, SYMTAG.SymTagUDT, "constType", ZERO),
+    (None, SYMTAG.SymTagUDT, "unalignedType", ZERO),
+    (None, SYMTAG.SymTagUDT, "volatileType", ZERO),
+    (None, SYMTAG.SymTagVTableShape, "lexicalParentId", GLOBAL_SCOPE),
+    (None, SYMTAG.SymTagVTableShape, "constType", ZERO),
+    (None, SYMTAG.SymTagVTableShape, "unalignedType", ZERO),
+    (None, SYMTAG.SymTagVTableShape, "volatileType", ZERO),
+    # UdtPrinter.virtualFunctions: base classes (virtual bases are placed by VtableLayout and LayoutAnalyzer)
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagBaseClass, "lexicalParentId", GLOBAL_SCOPE),
+    # VTablePrinter, debugUDT
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagVTable, "lexicalParentId", GLOBAL_SCOPE),
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagVTable, "constType", ZERO),
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagVTable, "unalignedType", ZERO),
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagVTable, "volatileType", ZERO),
+    (SYMTAG.SymTagUDT, SYMTAG.SymTagVTable, "typeId", (Reference(SYMTAG.SymTagPointerType, ("length", (4,)), ("reference", ZERO), ("constType", ZERO)),)),
+    # EnumPrinter.defineLines: enumerators
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "access", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "addressOffset", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "addressSection", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "addressTaken", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "bitPosition", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "compilerGenerated", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "constType", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "dataKind", (DATAKIND.DataIsConstant,)),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "isAggregated", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "isSplitted", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "length", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "locationType", (LOCATIONTYPE.LocIsConstant,)),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "offset", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "registerId", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "relativeVirtualAddress", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "slot", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "token", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "unalignedType", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "virtualAddress", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "volatileType", ZERO),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "typeId", (Reference(SYMTAG.SymTagBaseType, ("baseType", (BASICTYPE.btInt,))),)),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "classParentId", (Reference(SYMTAG.SymTagEnum),)),
+    (SYMTAG.SymTagEnum, SYMTAG.SymTagData, "lexicalParentId", GLOBAL_SCOPE),
+    )
+
+def invariantName(parentSymTag, symTag, attr):
+    name = pydia.SYMTAG_name(symTag)[6:]
+    if parentSymTag is not None:
+        name = "{}.{}".format(pydia.SYMTAG_name(parentSymTag)[6:], name)
+    return "{}.{}".format(name, attr)
+
+
+class ValidationReport:
+    """I count the symbols checked and the violations of each invariant."""
+
+    def __init__(self):
+        self.checked = {} # invariant name -> symbols checked
+        self.violations = {} # invariant name -> [count, [(symIndexId, value)]]
+        self.allowed = {} # invariant name -> description of the allowed values
+
+    def add(self, name, symIndexId, value):
+        entry = self.violations.setdefault(name, [0, []])
+        entry[0] += 1
+        if len(entry[1]) < EXAMPLES:
+            entry[1].append((symIndexId, value))
+
+    def count(self):
+        return sum([entry[0] for entry in self.violations.itervalues()])
+
+    def lines(self):
+        lines = []
+        for name in sorted(self.checked):
+            entry = self.violations.get(name)
+            if entry is None:
+                continue
+            examples = ", ".join(["#{}={!r}".format(symIndexId, value) for symIndexId, value in entry[1]])
+            lines.append("{} != {}: {} of {} symbols ({})".format(name, self.allowed[name], entry[0], self.checked[name], examples))
+        lines.append("{} violations of {} invariants ({} violated) in {} checks".format(
+            self.count(), len(self.checked), len(self.violations), sum(self.checked.itervalues())))
+        return lines
+
+    def toJSON(self):
+        return dict(checked=self.checked, violations=self.violations, allowed=self.allowed)
+
+    @classmethod
+    def fromJSON(cls, value):
+        report = cls()
+        report.checked = value["checked"]
+        report.violations = dict([(name, [entry[0], [tuple(example) for example in entry[1]]]) for name, entry in value["violations"].iteritems()])
+        report.allowed = value["allowed"]
+        return report
+
+
+class InvariantValidator:
+    """I check the INVARIANTS over columns of attributes."""
+
+    def __init__(self, pydia, store=None, invariants=INVARIANTS):
+        self.pydia = pydia
+        if store is None:
+            cache = pydia.globalScope.guid and pydiacache.OfflineCache(pydia) or None
+            store = pydiaquery.ColumnStore(pydia, cache)
+        self.store = store
+        self.invariants = invariants
+        self.references = {} # (symTag, conditions) -> set of symIndexIds
+
+    def referenceIds(self, reference):
+        key = (reference.symTag, reference.conditions)
+        ids = self.references.get(key)
+        if ids is None:
+            if reference.symTag == SYMTAG.SymTagExe:
+                ids = set([self.pydia.globalScope.symIndexId])
+            else:
+                ids = set(self.store.ids(reference.symTag))
+                for attr, values in reference.conditions:
+                    column = self.store.column(reference.symTag, [attr])[attr]
+                    ids.intersection_update([symIndexId for symIndexId, value in zip(self.store.ids(reference.symTag), column) if value in values])
+            self.references[key] = ids
+        return ids
+
+    def matcher(self, allowed):
+        """Return a function that tells if a value is allowed"""
+        values = set([value for value in allowed if not isinstance(value, Reference)])
+        references = [value for value in allowed if isinstance(value, Reference)]
+        if not references:
+            return values.__contains__
+        ids = set(values)
+        for reference in references:
+            ids.update(self.referenceIds(reference))
+        return ids.__contains__
+
+    def childColumns(self, parentSymTag, symTag, attrs):
+        """Return (ids, {attr: column}) of the symTag children of all the parents, in one pass"""
+        ids = []
+        columns = dict([(attr, []) for attr in attrs])
+        seen = set()
+        for parentId in self.store.ids(parentSymTag):
+            parent = self.pydia.symbolById(parentId)
+            for child in DiaEnumSymbolsIterator(parent.findChildrenEx(symTag, None, 0)):
+                symIndexId = child.symIndexId
+                if symIndexId in seen:
+                    continue # inherited or shared
+                seen.add(symIndexId)
+                ids.append(symIndexId)
+                for attr in attrs:
+                    columns[attr].append(pydiaquery.readAttribute(child, attr))
+        DEBUG("InvariantValidator.childColumns", invariantName(parentSymTag, symTag, ""), "read {} symbols".format(len(ids)))
+        return ids, columns
+
+    def validate(self):
+        """Check every invariant, returns a ValidationReport"""
+        report = ValidationReport()
+        scopes = [] # (parentSymTag, symTag) in the order of the invariants
+        attrsOf = {}
+        for parentSymTag, symTag, attr, allowed in self.invariants:
+            scope = (parentSymTag, symTag)
+            if scope not in attrsOf:
+                scopes.append(scope)
+                attrsOf[scope] = []
+            attrsOf[scope].append((attr, allowed))
+        for parentSymTag, symTag in scopes:
+            checks = attrsOf[(parentSymTag, symTag)]
+            attrs = [attr for attr, allowed in checks]
+            if parentSymTag is None:
+                ids = self.store.ids(symTag)
+                columns = self.store.column(symTag, attrs)
+            else:
+                ids, columns = self.childColumns(parentSymTag, symTag, attrs)
+            for attr, allowed in checks:
+                name = invariantName(parentSymTag, symTag, attr)
+                report.checked[name] = len(ids)
+                report.allowed[name] = " or ".join([isinstance(value, Reference) and repr(value) or str(value) for value in allowed])
+                isAllowed = self.matcher(allowed)
+                for symIndexId, value in zip(ids, columns[attr]):
+                    if not isAllowed(value):
+                        report.add(name, symIndexId, value)
+        DEBUG("InvariantValidator.validate", "{} violations".format(report.count()))
+        return report
+
+
+def loadReport(pydia, cache=None):
+    """Return the report of a session, validated once per PDB"""
+    if cache is None and pydia.globalScope.guid:
+        cache = pydiacache.OfflineCache(pydia)
+    value = cache and cache.loadJSON(CACHE_ENTRY)
+    if value is not None:
+        return ValidationReport.fromJSON(value)
+    report = InvariantValidator(pydia, cache and pydiaquery.ColumnStore(pydia, cache)).validate()
+    if cache:
+        cache.saveJSON(CACHE_ENTRY, report.toJSON())
+    return report